@@ -0,0 +1,4 @@
+"""
+Offline benchmarks of the Terraform client using a fake 'tofu' executable and a stub cloud
+client, see benchmarks.run.
+"""
@@ -0,0 +1,77 @@
+"""
+Compare two results of the benchmarks, e.g. of the released and the current version.
+
+Usage, from the root of the repository:
+    python -m benchmarks.compare baseline.json results.json --threshold 0.2
+
+The exit code is 1 if the median latency of any case common to both results grew by more
+than the threshold.
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, List, Tuple
+
+DEFAULT_THRESHOLD = 0.2
+
+
+def load_results(path: str) -> Dict[Tuple[str, int, int], dict]:
+    """
+    Load results of the benchmarks keyed by operation, topology size and concurrency.
+
+    :param path: Path of the JSON results
+    :return: Dictionary of results of cases
+    """
+    with open(path) as file:
+        report = json.load(file)
+    return {(result['operation'], result['topology_size'], result['concurrency']): result
+            for result in report['results']}
+
+
+def compare(baseline: Dict[Tuple[str, int, int], dict], current: Dict[Tuple[str, int, int], dict],
+            threshold: float) -> Tuple[List[dict], bool]:
+    """
+    Compare median latency and throughput of cases present in both results.
+
+    :param baseline: Results of the baseline
+    :param current: Results of the compared version
+    :param threshold: The relative growth of median latency considered a regression
+    :return: Tuple of rows of comparison and whether any case regressed
+    """
+    rows, regressed = [], False
+    for key in sorted(set(baseline) & set(current)):
+        old_p50, new_p50 = baseline[key]['latency']['p50'], current[key]['latency']['p50']
+        change = (new_p50 - old_p50) / old_p50 if old_p50 else 0.0
+        regression = change > threshold
+        regressed = regressed or regression
+        rows.append({'operation': key[0], 'topology_size': key[1], 'concurrency': key[2],
+                     'baseline_p50': old_p50, 'current_p50': new_p50, 'p50_change': change,
+                     'baseline_throughput': baseline[key]['throughput'],
+                     'current_throughput': current[key]['throughput'], 'regression': regression})
+    return rows, regressed
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Compare two results of the benchmarks.')
+    parser.add_argument('baseline', help='Path of the baseline results')
+    parser.add_argument('current', help='Path of the compared results')
+    parser.add_argument('--threshold', default=DEFAULT_THRESHOLD, type=float,
+                        help='Relative growth of median latency considered a regression')
+    parser.add_argument('--json', action='store_true', help='Print the comparison as JSON')
+    args = parser.parse_args(argv)
+
+    rows, regressed = compare(load_results(args.baseline), load_results(args.current), args.threshold)
+    if args.json:
+        json.dump({'threshold': args.threshold, 'regressed': regressed, 'cases': rows}, sys.stdout, indent=2)
+        print()
+    else:
+        for row in rows:
+            print(f'{row["operation"]:32} size={row["topology_size"]:<5} concurrency={row["concurrency"]:<3} '
+                  f'p50 {row["baseline_p50"] * 1000:9.2f} -> {row["current_p50"] * 1000:9.2f} ms '
+                  f'({row["p50_change"]:+7.1%}){"  REGRESSION" if row["regression"] else ""}')
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Stub cloud client used by the benchmarks instead of OpenStack or AWS.
+
+Every call sleeps for the configured latency and returns synthetic data consistent with
+the states created by the fake 'tofu' executable.
+"""
+
+import threading
+import time
+from collections import Counter
+from enum import Enum
+from typing import List
+
+from crczp.cloud_commons import CrczpCloudClientBase, TopologyInstance, TransformationConfiguration, \
+    Image, Limits, Quota, QuotaSet, HardwareUsage, NodeDetails
+
+INSTANCE_RESOURCE_TYPE = 'openstack_compute_instance_v2'
+PORT_RESOURCE_TYPE = 'openstack_networking_port_v2'
+NETWORK_RESOURCE_TYPE = 'openstack_networking_network_v2'
+DEFAULT_RESOURCE_PREFIX = 'stack'
+PROVIDER_TEMPLATE = 'provider "fake" {}\n'
+
+
+class StubCloudClient(CrczpCloudClientBase):
+    """
+    Cloud client returning synthetic data after a configurable latency.
+
+    The latency is a class attribute, so it can be set before the client is created by
+    CrczpTerraformClient. Calls are counted per method in the shared `calls` counter.
+    """
+
+    latency = 0.0
+    calls: Counter = Counter()
+    _calls_lock = threading.Lock()
+
+    def __init__(self, trc: TransformationConfiguration, *args, **kwargs):
+        self.trc = trc
+
+    def _call(self, name: str) -> None:
+        with self._calls_lock:
+            self.calls[name] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    @classmethod
+    def reset_calls(cls) -> None:
+        with cls._calls_lock:
+            cls.calls.clear()
+
+    @staticmethod
+    def get_private_ip(instance_attrs: dict) -> str:
+        if 'network' in instance_attrs:
+            return instance_attrs['network'][0]['fixed_ip_v4']
+        return instance_attrs['all_fixed_ips'][0]
+
+    def get_terraform_provider(self) -> str:
+        self._call('get_terraform_provider')
+        return PROVIDER_TEMPLATE
+
+    def create_terraform_template(self, topology_instance: TopologyInstance, *args, **kwargs) -> str:
+        """
+        Create template with a resource block of every node, network and link of the topology
+        and of the management port.
+        """
+        self._call('create_terraform_template')
+        prefix = kwargs.get('resource_prefix') or DEFAULT_RESOURCE_PREFIX
+        blocks = [f'resource "{NETWORK_RESOURCE_TYPE}" "{prefix}-{network.name}" {{\n'
+                  f'  name = "{prefix}-{network.name}"\n'
+                  f'  cidr = "{network.cidr}"\n'
+                  f'}}\n' for network in topology_instance.get_networks()]
+        blocks.extend(f'resource "{PORT_RESOURCE_TYPE}" "{prefix}-{link.name}" {{\n'
+                      f'  name       = "{prefix}-{link.name}"\n'
+                      f'  network_id = {NETWORK_RESOURCE_TYPE}.{prefix}-{link.network.name}.id\n'
+                      f'}}\n' for link in topology_instance.get_links())
+        blocks.append(f'resource "{PORT_RESOURCE_TYPE}" "{prefix}-{self.trc.man_out_port}" {{\n'
+                      f'  name = "{prefix}-{self.trc.man_out_port}"\n'
+                      f'}}\n')
+        blocks.extend(f'resource "{INSTANCE_RESOURCE_TYPE}" "{prefix}-{node.name}" {{\n'
+                      f'  name     = "{prefix}-{node.name}"\n'
+                      f'  key_pair = "{kwargs.get("key_pair_name_ssh")}"\n'
+                      f'}}\n' for node in topology_instance.get_nodes())
+        return '\n'.join(blocks)
+
+    def list_images(self) -> List[Image]:
+        self._call('list_images')
+        return [self._create_image('image')]
+
+    def get_image(self, image_id: str) -> Image:
+        self._call('get_image')
+        return self._create_image(image_id)
+
+    @staticmethod
+    def _create_image(name: str) -> Image:
+        return Image(os_distro='debian', os_type='linux', disk_format='qcow2', container_format='bare',
+                     visibility='public', size=1024, status='active', min_ram=0, min_disk=0,
+                     created_at=None, updated_at=None, tags=[], default_user='debian', name=name,
+                     owner_specified={})
+
+    def resume_node(self, node_id: str) -> None:
+        self._call('resume_node')
+
+    def start_node(self, node_id: str) -> None:
+        self._call('start_node')
+
+    def reboot_node(self, node_id: str) -> None:
+        self._call('reboot_node')
+
+    def get_node_details(self, terraform_attrs: dict) -> NodeDetails:
+        self._call('get_node_details')
+        return NodeDetails(image_id=terraform_attrs.get('image_id', 'image'), status='active',
+                           flavor=terraform_attrs.get('flavor_name', 'standard.small'))
+
+    def get_console_url(self, node_id: str, console_type: str) -> str:
+        self._call('get_console_url')
+        return f'https://console.example.org/{console_type}/{node_id}'
+
+    def create_keypair(self, name: str, public_key: str = None, key_type: str = 'ssh') -> None:
+        self._call('create_keypair')
+
+    def get_keypair(self, name: str):
+        self._call('get_keypair')
+        return name
+
+    def delete_keypair(self, name: str) -> None:
+        self._call('delete_keypair')
+
+    def get_quota_set(self) -> QuotaSet:
+        self._call('get_quota_set')
+        return QuotaSet(*(Quota(limit=10 ** 6, in_use=0) for _ in range(6)))
+
+    def get_project_name(self) -> str:
+        self._call('get_project_name')
+        return 'benchmark'
+
+    def get_hardware_usage(self, topology_instance: TopologyInstance) -> HardwareUsage:
+        self._call('get_hardware_usage')
+        nodes = len(list(topology_instance.get_nodes()))
+        return HardwareUsage(vcpu=nodes, ram=nodes, instances=nodes, network=0, subnet=0, port=nodes)
+
+    def get_flavors_dict(self) -> dict:
+        self._call('get_flavors_dict')
+        return {'standard.small': {'vcpu': 1, 'ram': 1}}
+
+    def get_project_limits(self) -> Limits:
+        self._call('get_project_limits')
+        return Limits(vcpu=10 ** 6, ram=10 ** 6, instances=10 ** 6, network=10 ** 6, subnet=10 ** 6, port=10 ** 6)
+
+
+class BenchmarkCloudLibraries(Enum):
+    """
+    Counterpart of AvailableCloudLibraries selecting the stub cloud client
+    """
+    STUB = StubCloudClient
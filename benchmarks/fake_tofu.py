@@ -0,0 +1,229 @@
+"""
+Scriptable stand-in of the 'tofu' executable used by the benchmarks.
+
+It supports the subset of commands the library executes. 'apply' creates a synthetic state
+with one resource per resource block of the *.tf files of the working directory, stored like
+the local backend does, so 'state pull' returns a state of the size of the deployed topology.
+
+Behaviour is configured by environment variables:
+    FAKE_TOFU_LATENCY            Seconds every command sleeps, default 0
+    FAKE_TOFU_LATENCY_<COMMAND>  Seconds the command sleeps instead, e.g. FAKE_TOFU_LATENCY_APPLY
+    FAKE_TOFU_RESOURCE_LATENCY   Seconds 'apply' and 'destroy' sleep per resource, default 0
+    FAKE_TOFU_EXTRA_RESOURCES    Number of additional resources added to every state, default 0
+
+Only the standard library is used, so the script can run with 'python -I -S'.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+RESOURCE_BLOCK_PATTERN = re.compile(r'^resource\s+"([^"]+)"\s+"([^"]+)"', re.MULTILINE)
+STATE_FILE_NAME = 'terraform.tfstate'
+WORKSPACES_DIR = 'terraform.tfstate.d'
+DATA_DIR = '.terraform'
+ENVIRONMENT_FILE = os.path.join(DATA_DIR, 'environment')
+DEFAULT_WORKSPACE = 'default'
+INSTANCE_TYPES = ('openstack_compute_instance_v2', 'aws_instance')
+
+
+def get_float(name: str, default: float = 0.0) -> float:
+    return float(os.environ.get(name) or default)
+
+
+def sleep(latency: float) -> None:
+    if latency > 0:
+        time.sleep(latency)
+
+
+def get_command_latency(command: str) -> float:
+    return get_float(f'FAKE_TOFU_LATENCY_{command.upper()}', get_float('FAKE_TOFU_LATENCY'))
+
+
+def get_workspace() -> str:
+    if os.environ.get('TF_WORKSPACE'):
+        return os.environ['TF_WORKSPACE']
+    try:
+        with open(ENVIRONMENT_FILE) as file:
+            return file.read().strip() or DEFAULT_WORKSPACE
+    except FileNotFoundError:
+        return DEFAULT_WORKSPACE
+
+
+def get_state_path(workspace: str) -> str:
+    if workspace == DEFAULT_WORKSPACE:
+        return STATE_FILE_NAME
+    return os.path.join(WORKSPACES_DIR, workspace, STATE_FILE_NAME)
+
+
+def list_resource_blocks() -> list:
+    blocks = []
+    for file_name in sorted(os.listdir('.')):
+        if file_name.endswith('.tf'):
+            with open(file_name) as file:
+                blocks.extend(RESOURCE_BLOCK_PATTERN.findall(file.read()))
+    return blocks
+
+
+def fake_id(name: str) -> str:
+    digest = hashlib.sha1(name.encode()).hexdigest()
+    return f'{digest[:8]}-{digest[8:12]}-{digest[12:16]}-{digest[16:20]}-{digest[20:32]}'
+
+
+def fake_mac(name: str) -> str:
+    digest = hashlib.sha1(name.encode()).hexdigest()
+    return 'fa:16:3e:' + ':'.join(digest[i:i + 2] for i in range(0, 6, 2))
+
+
+def fake_ip(index: int) -> str:
+    return f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}'
+
+
+def create_resource(resource_type: str, name: str, index: int) -> dict:
+    attributes = {'id': fake_id(name), 'name': name}
+    if resource_type in INSTANCE_TYPES:
+        attributes.update(image_id=fake_id('image'), flavor_name='standard.small', power_state='active',
+                          network=[{'name': 'network', 'fixed_ip_v4': fake_ip(index), 'mac': fake_mac(name),
+                                    'port': fake_id(name + '-port')}],
+                          block_device=[])
+    else:
+        attributes.update(mac_address=fake_mac(name), all_fixed_ips=[fake_ip(index)],
+                          tags=[], admin_state_up=True)
+    return {'mode': 'managed', 'type': resource_type, 'name': name,
+            'provider': 'provider["registry.opentofu.org/fake/fake"]',
+            'instances': [{'schema_version': 0, 'attributes': attributes, 'dependencies': []}]}
+
+
+def create_state(blocks: list) -> dict:
+    resources = [create_resource(resource_type, name, index) for index, (resource_type, name) in enumerate(blocks)]
+    for index in range(int(os.environ.get('FAKE_TOFU_EXTRA_RESOURCES') or 0)):
+        resources.append(create_resource('null_resource', f'extra-{index}', len(blocks) + index))
+    return {'version': 4, 'terraform_version': '1.8.0', 'serial': 1, 'lineage': fake_id(os.getcwd()),
+            'outputs': {}, 'resources': resources}
+
+
+def write_state(state: dict) -> None:
+    path = get_state_path(get_workspace())
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(state, file)
+
+
+def emit(json_output: bool, event_type: str, message: str, **fields) -> None:
+    if json_output:
+        event = {'@level': 'info', '@message': message, '@module': 'tofu.ui',
+                 '@timestamp': time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime()), 'type': event_type}
+        event.update(fields)
+        print(json.dumps(event))
+    else:
+        print(message)
+
+
+def apply(args: list, destroy: bool = False) -> int:
+    json_output = '-json' in args
+    blocks = list_resource_blocks()
+    action, verb = ('delete', 'Destruction') if destroy else ('create', 'Creation')
+    emit(json_output, 'version', 'OpenTofu 1.8.0', tofu='1.8.0', ui='1.2')
+    for resource_type, name in blocks:
+        hook = {'resource': {'addr': f'{resource_type}.{name}', 'resource_type': resource_type,
+                             'resource_name': name}, 'action': action}
+        emit(json_output, 'apply_start', f'{resource_type}.{name}: {verb}...', hook=hook)
+        emit(json_output, 'apply_complete', f'{resource_type}.{name}: {verb} complete',
+             hook=dict(hook, id_value=fake_id(name), elapsed_seconds=0))
+    sleep(len(blocks) * get_float('FAKE_TOFU_RESOURCE_LATENCY'))
+    write_state(create_state([] if destroy else blocks))
+    changes = {'add': 0 if destroy else len(blocks), 'change': 0, 'remove': len(blocks) if destroy else 0,
+               'operation': 'destroy' if destroy else 'apply'}
+    summary = 'Destroy complete! Resources: {remove} destroyed.' if destroy \
+        else 'Apply complete! Resources: {add} added, 0 changed, 0 destroyed.'
+    emit(json_output, 'change_summary', summary.format(**changes), changes=changes)
+    return 0
+
+
+def workspace(args: list) -> int:
+    subcommand = args[0] if args else 'show'
+    names = [arg for arg in args[1:] if not arg.startswith('-')]
+    if subcommand == 'show':
+        print(get_workspace())
+    elif subcommand == 'list':
+        existing = sorted(os.listdir(WORKSPACES_DIR)) if os.path.isdir(WORKSPACES_DIR) else []
+        for name in [DEFAULT_WORKSPACE] + existing:
+            print(('* ' if name == get_workspace() else '  ') + name)
+    elif subcommand == 'new':
+        path = os.path.join(WORKSPACES_DIR, names[0])
+        if os.path.isdir(path):
+            print(f'Workspace "{names[0]}" already exists', file=sys.stderr)
+            return 1
+        os.makedirs(path)
+        select_workspace(names[0])
+    elif subcommand == 'select':
+        if names[0] != DEFAULT_WORKSPACE and not os.path.isdir(os.path.join(WORKSPACES_DIR, names[0])):
+            print(f'Workspace "{names[0]}" doesn\'t exist.', file=sys.stderr)
+            return 1
+        select_workspace(names[0])
+    elif subcommand == 'delete':
+        path = get_state_path(names[0])
+        if os.path.exists(path):
+            os.remove(path)
+        if os.path.isdir(os.path.dirname(path)):
+            os.rmdir(os.path.dirname(path))
+    return 0
+
+
+def select_workspace(name: str) -> None:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(ENVIRONMENT_FILE, 'w') as file:
+        file.write(name)
+
+
+def state(args: list) -> int:
+    if args and args[0] == 'pull':
+        try:
+            with open(get_state_path(get_workspace())) as file:
+                sys.stdout.write(file.read())
+        except FileNotFoundError:
+            json.dump(create_state([]), sys.stdout)
+    elif args and args[0] == 'push':
+        with open(args[-1]) as file:
+            write_state(json.load(file))
+    return 0
+
+
+def init(args: list) -> int:
+    os.makedirs(os.path.join(DATA_DIR, 'providers'), exist_ok=True)
+    with open('.terraform.lock.hcl', 'w') as file:
+        file.write('# Generated by the fake tofu of the benchmarks\n')
+    print('OpenTofu has been successfully initialized!')
+    return 0
+
+
+def main(argv: list) -> int:
+    command = argv[0] if argv else 'version'
+    sleep(get_command_latency(command))
+    args = argv[1:]
+    if command in ('apply', 'plan'):
+        return apply(args) if command == 'apply' else 0
+    if command == 'destroy':
+        return apply(args, destroy=True)
+    if command == 'workspace':
+        return workspace(args)
+    if command == 'state':
+        return state(args)
+    if command == 'init':
+        return init(args)
+    if command == 'providers':
+        if len(args) > 1:
+            os.makedirs(args[-1], exist_ok=True)
+        return 0
+    if command == 'version':
+        print('OpenTofu v1.8.0')
+        return 0
+    print(f'Unsupported command of fake tofu: {command}', file=sys.stderr)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,315 @@
+"""
+Offline benchmarks of CrczpTerraformClient.
+
+The client runs against the fake 'tofu' executable and the stub cloud client, so the results
+show the overhead of the library itself: template rendering, process management, state parsing,
+caching and locking. Every command also pays the start-up of the fake executable, which stays
+the same between versions of the library.
+
+Usage, from the root of the repository:
+    python -m benchmarks.run --sizes 1,10,50 --concurrency 1,8 --iterations 20 --output results.json
+    python -m benchmarks.compare baseline.json results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import stat
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from crczp.cloud_commons import TransformationConfiguration
+from crczp.topology_definition.models import TopologyDefinition
+
+from crczp.terraform_driver import CrczpTerraformClient, __version__
+from benchmarks.fake_cloud import BenchmarkCloudLibraries, StubCloudClient
+
+RESULTS_SCHEMA_VERSION = 1
+FAKE_TOFU_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_tofu.py')
+HOSTS_PER_NETWORK = 50
+OPERATIONS = ('create_stack', 'list_stack_resources', 'list_stack_resources_cached', 'get_node',
+              'get_enriched_topology_instance', 'create_stacks', 'list_resources_for_stacks',
+              'delete_stack', 'delete_stacks')
+DEFAULT_SIZES = '1,10,50'
+DEFAULT_CONCURRENCY = '1,8'
+DEFAULT_ITERATIONS = 20
+
+
+def create_topology_definition(hosts: int) -> TopologyDefinition:
+    """
+    Create topology definition of the given number of hosts, connected to networks of at most
+    HOSTS_PER_NETWORK hosts.
+
+    :param hosts: The number of hosts
+    :return: TopologyDefinition object
+    """
+    networks = [{'name': f'network-{index}', 'cidr': f'10.{index}.0.0/24'}
+                for index in range((hosts - 1) // HOSTS_PER_NETWORK + 1)]
+    definition = {
+        'name': f'benchmark-{hosts}',
+        'hosts': [{'name': f'host-{index}', 'base_box': {'image': 'debian'}, 'flavor': 'standard.small'}
+                  for index in range(hosts)],
+        'routers': [],
+        'networks': networks,
+        'net_mappings': [{'host': f'host-{index}', 'network': f'network-{index // HOSTS_PER_NETWORK}',
+                          'ip': f'10.{index // HOSTS_PER_NETWORK}.0.{index % HOSTS_PER_NETWORK + 2}'}
+                         for index in range(hosts)],
+        'router_mappings': [],
+        'groups': [],
+    }
+    return TopologyDefinition.load(json.dumps(definition))
+
+
+def install_fake_tofu(bin_dir: str) -> None:
+    """
+    Install the fake 'tofu' executable running in the current Python interpreter.
+
+    :param bin_dir: Directory prepended to PATH
+    :return: None
+    """
+    path = os.path.join(bin_dir, 'tofu')
+    with open(path, 'w') as file:
+        file.write(f'#!/bin/sh\nexec "{sys.executable}" -I -S "{FAKE_TOFU_PATH}" "$@"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def summarize(durations: List[float], wall_time: float) -> dict:
+    """
+    Compute latency statistics of operations.
+
+    :param durations: Durations of operations in seconds
+    :param wall_time: Duration of the whole run in seconds
+    :return: Dictionary of statistics
+    """
+    ordered = sorted(durations)
+
+    def percentile(value: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(value * (len(ordered) - 1))))]
+
+    return {
+        'operations': len(ordered),
+        'throughput': len(ordered) / wall_time if wall_time else None,
+        'wall_time': wall_time,
+        'latency': {
+            'mean': statistics.mean(ordered),
+            'min': ordered[0],
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99),
+            'max': ordered[-1],
+        },
+    }
+
+
+class BenchmarkRunner:
+    """
+    Runs the benchmark cases, every case with a new client and an empty stacks directory
+    """
+
+    def __init__(self, work_dir: str, iterations: int, client_options: dict = None):
+        """
+        :param work_dir: Directory of stacks and other files of the benchmarks
+        :param iterations: The number of measured operations of every case
+        :param client_options: Other keyword arguments of CrczpTerraformClient
+        """
+        self.work_dir = work_dir
+        self.iterations = iterations
+        self.client_options = client_options or {}
+        self.trc = TransformationConfiguration('debian', 'standard.small', 'debian')
+
+    def create_client(self) -> CrczpTerraformClient:
+        stacks_dir = os.path.join(self.work_dir, 'stacks')
+        shutil.rmtree(stacks_dir, ignore_errors=True)
+        os.makedirs(stacks_dir)
+        options = dict(plugin_cache_dir=os.path.join(self.work_dir, 'plugin-cache'),
+                       stack_lock_dir=os.path.join(self.work_dir, 'locks'))
+        options.update(self.client_options)
+        return CrczpTerraformClient(BenchmarkCloudLibraries.STUB, self.trc, stacks_dir, **options)
+
+    @staticmethod
+    def create_stack(client: CrczpTerraformClient, topology_definition: TopologyDefinition,
+                     stack_name: str) -> None:
+        process = client.create_stack(topology_definition, stack_name)
+        _, stderr, return_code = client.wait_for_process(process, None)
+        if return_code:
+            raise RuntimeError(f'Creation of stack {stack_name} failed: {stderr}')
+
+    def measure(self, operation: Callable[[int], None], concurrency: int) -> dict:
+        """
+        Run the operation the configured number of times on concurrent threads.
+
+        :param operation: Callable taking the index of the iteration
+        :param concurrency: The number of concurrent threads
+        :return: Dictionary of statistics
+        """
+        def timed(index: int) -> float:
+            start = time.perf_counter()
+            operation(index)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            durations = list(executor.map(timed, range(self.iterations)))
+        return summarize(durations, time.perf_counter() - start)
+
+    def run_case(self, operation: str, size: int, concurrency: int) -> dict:
+        """
+        Run a single benchmark case.
+
+        :param operation: The name of the operation, one of OPERATIONS
+        :param size: The number of hosts of the topology
+        :param concurrency: The number of concurrent threads or the maximum number of workers
+            of bulk operations
+        :return: Dictionary with parameters and statistics of the case
+        """
+        client = self.create_client()
+        try:
+            return self._run_case(client, operation, size, concurrency)
+        finally:
+            client.close()
+
+    def _run_case(self, client: CrczpTerraformClient, operation: str, size: int, concurrency: int) -> dict:
+        topology_definition = create_topology_definition(size)
+        stack_names = [f'bench-{index}' for index in range(self.iterations)]
+
+        def invalidate_and(call: Callable[[str], object]) -> Callable[[int], None]:
+            def run(index: int) -> None:
+                client.invalidate_stack_state(stack_names[0])
+                call(stack_names[0])
+            return run
+
+        if operation == 'create_stack':
+            stats = self.measure(lambda index: self.create_stack(client, topology_definition, stack_names[index]),
+                                 concurrency)
+        elif operation == 'delete_stack':
+            for stack_name in stack_names:
+                self.create_stack(client, topology_definition, stack_name)
+            stats = self.measure(lambda index: client.wait_for_process(client.delete_stack(stack_names[index]), None),
+                                 concurrency)
+        elif operation in ('create_stacks', 'list_resources_for_stacks', 'delete_stacks'):
+            # A single call processes all stacks, its latency is divided among them
+            if operation != 'create_stacks':
+                for stack_name in stack_names:
+                    self.create_stack(client, topology_definition, stack_name)
+                client.invalidate_stack_state()
+            start = time.perf_counter()
+            if operation == 'create_stacks':
+                client.create_stacks(topology_definition, stack_names, max_workers=concurrency)
+            elif operation == 'delete_stacks':
+                client.delete_stacks(stack_names, max_workers=concurrency)
+            else:
+                client.list_resources_for_stacks(stack_names, max_workers=concurrency)
+            wall_time = time.perf_counter() - start
+            stats = summarize([wall_time / len(stack_names)] * len(stack_names), wall_time)
+        else:
+            self.create_stack(client, topology_definition, stack_names[0])
+            StubCloudClient.reset_calls()
+            if operation == 'list_stack_resources':
+                stats = self.measure(invalidate_and(client.list_stack_resources), concurrency)
+            elif operation == 'list_stack_resources_cached':
+                client.list_stack_resources(stack_names[0])
+                stats = self.measure(lambda index: client.list_stack_resources(stack_names[0]), concurrency)
+            elif operation == 'get_node':
+                stats = self.measure(invalidate_and(lambda stack_name: client.get_node(stack_name, 'host-0')),
+                                     concurrency)
+            elif operation == 'get_enriched_topology_instance':
+                stats = self.measure(invalidate_and(
+                    lambda stack_name: client.get_enriched_topology_instance(stack_name, topology_definition)),
+                    concurrency)
+            else:
+                raise ValueError(f'Unknown operation: {operation}')
+
+        return dict(operation=operation, topology_size=size, concurrency=concurrency,
+                    cloud_calls=dict(StubCloudClient.calls), **stats)
+
+
+def get_git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(FAKE_TOFU_PATH), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the Terraform client.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, type=parse_int_list,
+                        help='Comma separated numbers of hosts of the benchmarked topologies')
+    parser.add_argument('--concurrency', default=DEFAULT_CONCURRENCY, type=parse_int_list,
+                        help='Comma separated numbers of concurrent threads')
+    parser.add_argument('--iterations', default=DEFAULT_ITERATIONS, type=int,
+                        help='Number of measured operations of every case')
+    parser.add_argument('--operations', default=','.join(OPERATIONS),
+                        help='Comma separated operations, available: ' + ', '.join(OPERATIONS))
+    parser.add_argument('--tofu-latency', default=0.0, type=float,
+                        help='Seconds every fake tofu command sleeps')
+    parser.add_argument('--resource-latency', default=0.0, type=float,
+                        help='Seconds fake tofu apply and destroy sleep per resource')
+    parser.add_argument('--extra-resources', default=0, type=int,
+                        help='Number of additional resources in every fake state')
+    parser.add_argument('--cloud-latency', default=0.0, type=float,
+                        help='Seconds every call of the stub cloud client sleeps')
+    parser.add_argument('--output', help='Path of the JSON results, standard output if not set')
+    args = parser.parse_args(argv)
+
+    operations = [operation for operation in args.operations.split(',') if operation]
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        parser.error('unknown operations: ' + ', '.join(sorted(unknown)))
+
+    work_dir = tempfile.mkdtemp(prefix='crczp-terraform-benchmarks-')
+    bin_dir = os.path.join(work_dir, 'bin')
+    os.makedirs(bin_dir)
+    install_fake_tofu(bin_dir)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    os.environ.update(FAKE_TOFU_LATENCY=str(args.tofu_latency), FAKE_TOFU_RESOURCE_LATENCY=str(args.resource_latency),
+                      FAKE_TOFU_EXTRA_RESOURCES=str(args.extra_resources))
+    StubCloudClient.latency = args.cloud_latency
+
+    runner = BenchmarkRunner(work_dir, args.iterations)
+    results = []
+    try:
+        for size in args.sizes:
+            for concurrency in args.concurrency:
+                for operation in operations:
+                    StubCloudClient.reset_calls()
+                    result = runner.run_case(operation, size, concurrency)
+                    results.append(result)
+                    print(f'{operation:32} size={size:<5} concurrency={concurrency:<3} '
+                          f'p50={result["latency"]["p50"] * 1000:9.2f} ms '
+                          f'throughput={result["throughput"]:9.2f}/s', file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'schema_version': RESULTS_SCHEMA_VERSION,
+        'library_version': __version__,
+        'git_revision': get_git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
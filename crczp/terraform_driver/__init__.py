@@ -1,4 +1,17 @@
 __version__ = "v1.0.0"
 
 from .terraform_client import CrczpTerraformClient, AvailableCloudLibraries, CrczpTerraformBackendType
-from .terraform_client_elements import TerraformInstance
+from .terraform_client_elements import TerraformInstance, TerraformStackResult, CrczpTerraformStackLayout, \
+    CrczpTerraformStackState, TerraformStackRecord, TerraformGarbageCollectionReport
+from .terraform_async_client import AsyncCrczpTerraformClient
+from .terraform_state_parser import CLIENT_STATE_ATTRIBUTES
+from .terraform_instrumentation import InstrumentationHook, StructlogInstrumentationHook, \
+    PrometheusInstrumentationHook, OpenTelemetryInstrumentationHook
+
+__all__ = [
+    'CrczpTerraformClient', 'AvailableCloudLibraries', 'CrczpTerraformBackendType', 'TerraformInstance',
+    'TerraformStackResult', 'CrczpTerraformStackLayout', 'CrczpTerraformStackState', 'TerraformStackRecord',
+    'TerraformGarbageCollectionReport', 'AsyncCrczpTerraformClient', 'CLIENT_STATE_ATTRIBUTES',
+    'InstrumentationHook', 'StructlogInstrumentationHook', 'PrometheusInstrumentationHook',
+    'OpenTelemetryInstrumentationHook',
+]
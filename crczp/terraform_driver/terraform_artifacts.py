@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Tuple
+
+from jinja2 import Environment, FileSystemLoader, Template
+
+from crczp.terraform_driver.terraform_stack_lock import SingleFlight
+
+TEMPLATES_DIR_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
+DEFAULT_ARTIFACT_REGISTRY_SIZE = 256
+ARTIFACT_BACKEND = 'backend'
+ARTIFACT_PROVIDER = 'provider'
+
+
+def get_configuration_key(*args, **kwargs) -> str:
+    """
+    Get stable digest of configuration values, so secrets are not kept in registry keys.
+
+    :param args, kwargs: The configuration values
+    :return: Hexadecimal SHA-256 digest
+    """
+    return hashlib.sha256(json.dumps([args, kwargs], sort_keys=True, default=repr).encode()).hexdigest()
+
+
+class TerraformArtifactRegistry:
+    """
+    Process-wide registry of compiled Jinja templates and of rendered backend and provider
+    configurations, shared by all client instances of the process.
+
+    Rendered configurations are keyed by their kind and a digest of the configuration they are
+    rendered from and the least recently used ones are evicted. Concurrent renderings of the
+    same key are coalesced and failed renderings are not stored.
+    """
+
+    def __init__(self, templates_dir: str = TEMPLATES_DIR_PATH, max_size: int = DEFAULT_ARTIFACT_REGISTRY_SIZE):
+        """
+        :param templates_dir: Directory of Jinja templates
+        :param max_size: The maximum number of rendered configurations
+        """
+        self.templates_dir = templates_dir
+        self.max_size = max_size
+        self._environment = None
+        self._templates: Dict[str, Template] = {}
+        self._artifacts: OrderedDict[Tuple[str, Hashable], str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._renders = SingleFlight()
+
+    def get_template(self, template_name: str) -> Template:
+        """
+        Get compiled Jinja template.
+
+        :param template_name: The file name of the template in templates_dir
+        :return: Compiled Template
+        """
+        with self._lock:
+            template = self._templates.get(template_name)
+            if template is None:
+                if self._environment is None:
+                    self._environment = Environment(loader=FileSystemLoader(self.templates_dir))
+                template = self._environment.get_template(template_name)
+                self._templates[template_name] = template
+            return template
+
+    def get_artifact(self, kind: str, key: Hashable, render: Callable[[], str]) -> str:
+        """
+        Get rendered configuration, rendering it on the first request.
+
+        :param kind: The kind of configuration, e.g. ARTIFACT_BACKEND or ARTIFACT_PROVIDER
+        :param key: The key of configuration the content is rendered from
+        :param render: Callable rendering the content
+        :return: The rendered content
+        """
+        artifact_key = (kind, key)
+        with self._lock:
+            content = self._artifacts.get(artifact_key)
+            if content is not None:
+                self._artifacts.move_to_end(artifact_key)
+                return content
+        return self._renders.run(repr(artifact_key), self._render, artifact_key, render)
+
+    def invalidate(self, kind: str = None) -> None:
+        """
+        Drop rendered configurations, e.g. after credentials of the cloud project were rotated.
+
+        :param kind: The kind of configuration, all kinds if None
+        :return: None
+        """
+        with self._lock:
+            for artifact_key in [artifact_key for artifact_key in self._artifacts
+                                 if kind is None or artifact_key[0] == kind]:
+                del self._artifacts[artifact_key]
+
+    def _render(self, artifact_key: Tuple[str, Hashable], render: Callable[[], str]) -> str:
+        content = render()
+        with self._lock:
+            self._artifacts[artifact_key] = content
+            self._artifacts.move_to_end(artifact_key)
+            while len(self._artifacts) > self.max_size:
+                self._artifacts.popitem(last=False)
+        return content
+
+    def __len__(self):
+        return len(self._artifacts)
+
+
+ARTIFACT_REGISTRY = TerraformArtifactRegistry()
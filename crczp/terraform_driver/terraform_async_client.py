@@ -0,0 +1,295 @@
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from crczp.cloud_commons import TopologyInstance, TransformationConfiguration, Image
+from crczp.topology_definition.models import TopologyDefinition, DockerContainers
+
+from crczp.terraform_driver.terraform_async_client_manager import AsyncCrczpTerraformClientManager, \
+    AsyncTerraformProcess, DEFAULT_ASYNC_CONCURRENCY
+from crczp.terraform_driver.terraform_client import CrczpTerraformClient, AvailableCloudLibraries
+from crczp.terraform_driver.terraform_client_elements import TerraformInstance, \
+    CrczpTerraformBackendType, CrczpTerraformStackState, TerraformStackRecord, TerraformGarbageCollectionReport
+
+
+class AsyncCrczpTerraformClient:
+    """
+    Asyncio variant of CrczpTerraformClient. The 'tofu' commands are executed as asyncio
+    subprocesses bounded by a semaphore, blocking cloud calls are executed in threads.
+    """
+
+    def __init__(self, cloud_client: AvailableCloudLibraries, trc: TransformationConfiguration,
+                 stacks_dir: str = None, template_file_name: str = None,
+                 backend_type: CrczpTerraformBackendType = CrczpTerraformBackendType.LOCAL,
+                 db_configuration=None, kube_namespace=None, *args,
+                 max_concurrency: int = DEFAULT_ASYNC_CONCURRENCY, **kwargs):
+        self.sync_client = CrczpTerraformClient(cloud_client, trc, stacks_dir, template_file_name,
+                                                backend_type, db_configuration, kube_namespace,
+                                                *args, **kwargs)
+        self.cloud_client = self.sync_client.cloud_client
+        self.client_manager = AsyncCrczpTerraformClientManager(self.sync_client.client_manager,
+                                                               max_concurrency)
+        self.trc = trc
+
+    @staticmethod
+    def get_process_output(process: AsyncTerraformProcess) -> AsyncIterator[str]:
+        """
+        Get the standard output of process.
+
+        :param process: The process creating output
+        :return: Asynchronous iterator over standard output of process line by line
+        """
+        return process.iter_output()
+
+    @staticmethod
+    async def wait_for_process(process: AsyncTerraformProcess, timeout: float = None)\
+            -> Tuple[str, str, int]:
+        """
+        Wait for the process to finish. The process is killed on timeout or cancellation.
+
+        :param process: The process that is waited for
+        :param timeout: Timeout in seconds
+        :return: Tuple of stdout, stderr and return code
+        """
+        return await process.wait(timeout)
+
+    async def create_stack(self, topology_definition: TopologyDefinition, stack_name: str = 'stack-name',
+                           key_pair_name_ssh: str = 'dummy-ssh-key-pair',
+                           key_pair_name_cert: str = 'dummy-cert-key-pair', dry_run: bool = False,
+                           *args, json_output: bool = False, **kwargs) -> AsyncTerraformProcess:
+        """
+        Create Terraform stack on the cloud.
+
+        :param stack_name: The name of the stack
+        :param topology_definition: TopologyDefinition from which is the stack created
+        :param key_pair_name_ssh: Name of the SSH key pair
+        :param key_pair_name_cert: Name of the certificate key pair
+        :param dry_run: Create only Terraform plan without allocation
+        :param json_output: Run Terraform with machine-readable output, the typed progress
+            events are available via the events() method of the returned process
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: The process that is executing the creation
+        :raise CrczpException: Stack creation has failed
+        """
+        topology_instance = self.sync_client.get_topology_instance(topology_definition)
+        return await self.client_manager.create_stack(topology_instance, dry_run, stack_name,
+                                                      key_pair_name_ssh, key_pair_name_cert,
+                                                      *args, json_output=json_output, **kwargs)
+
+    async def update_stack(self, topology_definition: TopologyDefinition, stack_name: str,
+                           key_pair_name_ssh: str = 'dummy-ssh-key-pair',
+                           key_pair_name_cert: str = 'dummy-cert-key-pair', *args, targeted: bool = True,
+                           json_output: bool = False, **kwargs) -> Optional[AsyncTerraformProcess]:
+        """
+        Update existing Terraform stack to the changed topology definition.
+
+        :param topology_definition: TopologyDefinition the stack is updated to
+        :param stack_name: The name of the stack
+        :param key_pair_name_ssh: Name of the SSH key pair
+        :param key_pair_name_cert: Name of the certificate key pair
+        :param targeted: Apply only the affected resources, the whole stack is applied if False
+        :param json_output: Run Terraform with machine-readable output
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: The process that is executing the update or None if the template is unchanged
+        :raise StackNotFound: The stack does not exist
+        :raise CrczpException: Stack update has failed
+        """
+        topology_instance = self.sync_client.get_topology_instance(topology_definition)
+        return await self.client_manager.update_stack(topology_instance, stack_name, key_pair_name_ssh,
+                                                      key_pair_name_cert, *args, targeted=targeted,
+                                                      json_output=json_output, **kwargs)
+
+    async def delete_stack(self, stack_name: str, json_output: bool = False) -> Optional[AsyncTerraformProcess]:
+        """
+        Delete Terraform stack.
+
+        :param stack_name: Name of stack that is deleted
+        :param json_output: Run Terraform with machine-readable output, the typed progress
+            events are available via the events() method of the returned process
+        :return: The process that is executing the deletion
+        :raise CrczpException: Stack deletion has failed
+        """
+        return await self.client_manager.delete_stack(stack_name, json_output)
+
+    async def delete_stack_directory(self, stack_name: str) -> None:
+        """
+        Delete the stack directory.
+
+        :param stack_name: Name of stack
+        :return: None
+        :raise CrczpException: Stack directory is not found
+        """
+        await self.client_manager.delete_stack_directory(stack_name)
+
+    async def delete_terraform_workspace(self, stack_name: str) -> None:
+        """
+        Delete the Terraform workspace.
+
+        In the directory stack layout, the stack has no workspace and its state in the remote
+        backend is deleted instead. The Postgres schema of the stack is dropped, which needs the
+        'postgres' extra. The Kubernetes secret of the stack, named by
+        CrczpTerraformBackend.get_stack_secret_name, has to be deleted by the caller.
+
+        :param stack_name: Name of stack
+        :return: None
+        :raise CrczpException: Terraform workspace is not found
+        :raise TerraformWorkspaceFailed: The state of the stack could not be deleted
+        """
+        await self.client_manager.delete_terraform_workspace(stack_name)
+
+    async def list_stacks(self, states: List[CrczpTerraformStackState] = None, name_prefix: str = None,
+                          limit: int = None, after: str = None) -> List[str]:
+        """
+        List created Terraform stacks.
+
+        :param states: List only stacks in these states, all stacks if None
+        :param name_prefix: List only stacks whose name starts with the prefix
+        :param limit: The maximum number of listed stacks, all if None
+        :param after: List only stacks whose name follows this name, the last name of the previous page
+        :return: The list containing stack names
+        :raise TerraformImproperlyConfigured: Stacks are filtered without the stack registry
+        """
+        return await self.client_manager.list_stacks(states, name_prefix, limit, after)
+
+    async def list_stack_records(self, states: List[CrczpTerraformStackState] = None, name_prefix: str = None,
+                                 limit: int = None, after: str = None) -> List[TerraformStackRecord]:
+        """
+        List records of stacks in the stack registry ordered by name.
+
+        :param states: List only stacks in these states, all stacks if None
+        :param name_prefix: List only stacks whose name starts with the prefix
+        :param limit: The maximum number of listed stacks, all if None
+        :param after: List only stacks whose name follows this name, the last name of the previous page
+        :return: List of TerraformStackRecord objects
+        :raise TerraformImproperlyConfigured: The stack registry is disabled
+        """
+        return await self.client_manager.list_stack_records(states, name_prefix, limit, after)
+
+    async def reconcile_stack_registry(self) -> Tuple[List[str], List[str]]:
+        """
+        Rebuild the stack registry from the stacks directory.
+
+        :return: Tuple of the names of registered and removed stacks
+        :raise TerraformImproperlyConfigured: The stack registry is disabled
+        """
+        return await self.client_manager.reconcile_stack_registry()
+
+    async def close(self, timeout: float = None) -> None:
+        """
+        Stop the background garbage collection, close connections of the stack registry and
+        the state reader and shut down threads of the client.
+
+        :param timeout: Seconds to wait for each of a running collection and the results of exited
+            commands, see CrczpTerraformClient.close
+        :return: None
+        """
+        await asyncio.to_thread(self.sync_client.close, timeout)
+        self.client_manager.close()
+
+    async def collect_garbage(self, dry_run: bool = False) -> TerraformGarbageCollectionReport:
+        """
+        Remove orphaned and stale stack directories and workspaces and reclaim Terraform data
+        and state copies of idle stacks. The collection runs in a thread.
+
+        :param dry_run: Only report what would be removed and cleaned
+        :return: TerraformGarbageCollectionReport object
+        :raise CrczpException: Workspaces of the shared backend could not be listed
+        """
+        return await self.client_manager.run_locking(self.sync_client.collect_garbage, dry_run)
+
+    async def list_stack_resources(self, stack_name: str) -> List[dict]:
+        """
+        List stack resources and its attributes.
+
+        :param stack_name: The name of stack
+        :return: The list of dictionaries containing resources
+        """
+        return await self.client_manager.list_stack_resources(stack_name)
+
+    async def get_enriched_topology_instance(self, stack_name: str, topology_definition: TopologyDefinition,
+                                             containers: DockerContainers = None) -> TopologyInstance:
+        """
+        Get enriched TopologyInstance.
+
+        :param stack_name: The name of stack
+        :param topology_definition: TopologyDefinition object
+        :param containers: DockerContainers object
+        :return: TopologyInstance with additional properties
+        """
+        topology_instance = self.sync_client.get_topology_instance(topology_definition, containers)
+        return await self.client_manager.get_enriched_topology_instance(stack_name, topology_instance)
+
+    async def get_node(self, stack_name: str, node_name: str) -> TerraformInstance:
+        """
+        Get data about node.
+
+        :param stack_name: The name of stack
+        :param node_name: The name of node
+        :return: TerraformInstance object
+        """
+        return await self.client_manager.get_node(stack_name, node_name)
+
+    async def get_nodes(self, stack_name: str, node_names: List[str] = None) -> Dict[str, TerraformInstance]:
+        """
+        Get data about multiple nodes of the stack at once.
+
+        :param stack_name: The name of stack
+        :param node_names: The names of nodes, all nodes of the stack if None
+        :return: Dictionary of TerraformInstance objects keyed by node name
+        """
+        return await self.client_manager.get_nodes(stack_name, node_names)
+
+    async def get_console_url(self, stack_name: str, node_name: str, console_type: str) -> str:
+        """
+        Get console url of a node.
+
+        :param stack_name: The name of stack
+        :param node_name: The name of node
+        :param console_type: Type can be novnc, xvpvnc, spice-html5, rdp-html5, serial and webmks
+        :return: Url to console
+        """
+        return await self.client_manager.get_console_url(stack_name, node_name, console_type)
+
+    async def get_image(self, image_id: str) -> Image:
+        """
+        Get Image object based on its ID.
+
+        :param image_id: The ID of image on the cloud
+        :return: Image object
+        """
+        return await asyncio.to_thread(self.sync_client.get_image, image_id)
+
+    async def resume_node(self, stack_name: str, node_name: str) -> None:
+        """
+        Resume node.
+
+        :param stack_name: The name of stack
+        :param node_name: The name of node
+        :return: None
+        :raise CrczpException: Node not found
+        """
+        resource_id = await self.client_manager.get_resource_id(stack_name, node_name)
+        await asyncio.to_thread(self.cloud_client.resume_node, resource_id)
+
+    async def start_node(self, stack_name: str, node_name: str) -> None:
+        """
+        Start node.
+
+        :param stack_name: The name of stack
+        :param node_name: The name of node
+        :return: None
+        :raise CrczpException: Node not found
+        """
+        resource_id = await self.client_manager.get_resource_id(stack_name, node_name)
+        await asyncio.to_thread(self.cloud_client.start_node, resource_id)
+
+    async def reboot_node(self, stack_name: str, node_name: str) -> None:
+        """
+        Reboot node.
+
+        :param stack_name: The name of stack
+        :param node_name: The name of node
+        :return: None
+        :raise CrczpException: Node not found
+        """
+        resource_id = await self.client_manager.get_resource_id(stack_name, node_name)
+        await asyncio.to_thread(self.cloud_client.reboot_node, resource_id)
@@ -0,0 +1,807 @@
+import asyncio
+import codecs
+import contextlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from crczp.cloud_commons import CrczpException, TopologyInstance
+
+from crczp.terraform_driver.terraform_client_elements import TerraformInstance, TerraformState, \
+    StackResourceIndex, CrczpTerraformStackState, TerraformStackRecord
+from crczp.terraform_driver.terraform_client_manager import CrczpTerraformClientManager, \
+    CrczpTerraformClientManagerBase, TERRAFORM_DEFAULT_WORKSPACE, DEFAULT_BATCH_WORKERS, STACK_MUTATING_COMMANDS, \
+    STATE_SOURCE_BACKEND, STATE_SOURCE_TOFU, flatten_error_output
+from crczp.terraform_driver.terraform_events import TerraformEvent, parse_event
+from crczp.terraform_driver.terraform_exceptions import TerraformInitFailed, TerraformWorkspaceFailed
+from crczp.terraform_driver.terraform_exc_handlers import command_error_handler
+from crczp.terraform_driver.terraform_instrumentation import SPAN_KIND_STATE, CountingReader
+from crczp.terraform_driver.terraform_scheduler import CommandSlot, get_command_class
+
+DEFAULT_ASYNC_CONCURRENCY = 16
+DEFAULT_LOCK_WAITERS = 64
+
+
+class AsyncStreamTextReader:
+    """
+    Blocking text stream reading an asyncio stream. It is read by a thread other than the thread
+    of the event loop, e.g. by the streaming parser of Terraform state.
+    """
+
+    def __init__(self, stream: asyncio.StreamReader, loop: asyncio.AbstractEventLoop):
+        self.stream = stream
+        self.loop = loop
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read(self, size: int = -1) -> str:
+        while True:
+            data = asyncio.run_coroutine_threadsafe(self.stream.read(size), self.loop).result()
+            text = self.decoder.decode(data, final=not data)
+            # A chunk may end inside of a multi-byte character, empty text means end of stream
+            if text or not data:
+                return text
+
+
+class AsyncTerraformProcess:
+    """
+    Wrapper of an asyncio subprocess executing a 'tofu' command.
+
+    Stderr is drained in background as soon as stdout is consumed, so the child never blocks
+    on a full pipe. Cancellation of a task awaiting the process kills the child.
+    """
+
+    def __init__(self, process: asyncio.subprocess.Process, on_exit: Callable[[], None] = None):
+        self.process = process
+        self._stdout_consumed = False
+        self._stderr_lines: List[str] = []
+        self._stderr_task: Optional[asyncio.Future] = None
+        self._exit_task = asyncio.ensure_future(process.wait())
+        if on_exit:
+            self._exit_task.add_done_callback(lambda _: on_exit())
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.process.returncode
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self.iter_output()
+
+    async def iter_output(self) -> AsyncIterator[str]:
+        """
+        Iterate over the standard output of the process.
+
+        :return: Standard output of process line by line
+        """
+        self._stdout_consumed = True
+        self._drain_stderr()
+        try:
+            async for line in self.process.stdout:
+                yield line.decode()
+        except asyncio.CancelledError:
+            await self.kill()
+            raise
+
+    async def events(self) -> AsyncIterator[TerraformEvent]:
+        """
+        Iterate over typed events of a command executed with the '-json' option.
+
+        :return: TerraformEvent objects in the order of the output
+        """
+        async for line in self.iter_output():
+            event = parse_event(line)
+            if event is not None:
+                yield event
+
+    def get_output_reader(self) -> AsyncStreamTextReader:
+        """
+        Get blocking text stream of the standard output, to be read in a thread other than the thread
+        of the event loop.
+
+        :return: AsyncStreamTextReader object
+        """
+        self._stdout_consumed = True
+        self._drain_stderr()
+        return AsyncStreamTextReader(self.process.stdout, asyncio.get_running_loop())
+
+    async def wait(self, timeout: float = None) -> Tuple[str, str, int]:
+        """
+        Wait for the process to finish. The child is killed on timeout or cancellation.
+
+        :param timeout: The timeout in seconds
+        :return: Tuple of stdout, stderr and return code
+        """
+        stdout, stderr, return_code = await self.communicate(timeout)
+        return stdout, flatten_error_output(stderr), return_code
+
+    async def communicate(self, timeout: float = None) -> Tuple[str, str, int]:
+        """
+        Wait for the process to finish and keep lines of its error output. The child is killed
+        on timeout or cancellation.
+
+        :param timeout: The timeout in seconds
+        :return: Tuple of stdout, stderr and return code, stdout is empty if it was already consumed
+        """
+        try:
+            return await asyncio.wait_for(self._collect(), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            await self.kill()
+            raise
+
+    async def kill(self) -> None:
+        """
+        Kill the process and wait until it exits.
+
+        :return: None
+        """
+        if self.process.returncode is None:
+            with contextlib.suppress(ProcessLookupError):
+                self.process.kill()
+        await asyncio.shield(self._exit_task)
+
+    async def _collect(self) -> Tuple[str, str, int]:
+        stdout_lines: List[str] = []
+        tasks = []
+        if not self._stdout_consumed and self.process.stdout is not None:
+            self._stdout_consumed = True
+            tasks.append(self._read_lines(self.process.stdout, stdout_lines))
+        self._drain_stderr()
+        if self._stderr_task is not None:
+            tasks.append(asyncio.shield(self._stderr_task))
+        await asyncio.gather(*tasks)
+        return_code = await asyncio.shield(self._exit_task)
+        return ''.join(stdout_lines), ''.join(self._stderr_lines), return_code
+
+    def _drain_stderr(self) -> None:
+        if self._stderr_task is None and self.process.stderr is not None:
+            self._stderr_task = asyncio.ensure_future(self._read_lines(self.process.stderr,
+                                                                       self._stderr_lines))
+
+    @staticmethod
+    async def _read_lines(stream: asyncio.StreamReader, sink: List[str]) -> None:
+        async for line in stream:
+            sink.append(line.decode())
+
+
+class AsyncCrczpTerraformClientManager(CrczpTerraformClientManagerBase):
+    """
+    Asyncio manager class for AsyncCrczpTerraformClient.
+
+    Runs 'tofu' commands via asyncio subprocesses. It shares components of the synchronous
+    CrczpTerraformClientManager, e.g. the stack locks, caches and the command scheduler, and
+    delegates listing of stacks, removal of stack directories and reconciliation of the stack
+    registry to it.
+    """
+
+    def __init__(self, manager: CrczpTerraformClientManager,
+                 max_concurrency: int = DEFAULT_ASYNC_CONCURRENCY):
+        super().__init__(
+            manager.stacks_dir, manager.cloud_client, manager.trc, manager.template_file_name,
+            manager.terraform_backend, manager.state_cache, manager.plugin_cache, manager.state_reader,
+            manager.state_attributes, manager.scheduler, manager.stack_locks, manager.stack_layout,
+            manager.retry_policy, manager.cloud_cache, manager.template_cache, manager.artifact_registry,
+            manager.provider_key, manager.instrumentation, manager.stack_registry)
+        self.manager = manager
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._state_loads: Dict[str, asyncio.Future] = {}
+        # Waiting for stack locks and scheduler slots blocks a thread. The waits run on dedicated
+        # executors, so they never occupy the default executor a lock holder needs to finish.
+        # Slot waits are bounded by the semaphore, so they do not queue behind lock waits.
+        self._lock_executor = ThreadPoolExecutor(DEFAULT_LOCK_WAITERS,
+                                                 thread_name_prefix='crczp-stack-lock')
+        self._slot_executor = ThreadPoolExecutor(max_concurrency,
+                                                 thread_name_prefix='crczp-command-slot')
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily, so it is bound to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _execute_command(self, command: List[str], cwd: str,
+                               on_result: Callable[[int], None] = None,
+                               stack_name: str = None) -> AsyncTerraformProcess:
+        """
+        Execute command in cwd. The process holds one concurrency slot and one slot of the
+        command scheduler of the manager until it exits.
+
+        :param command: Command to execute
+        :param cwd: Working directory
+        :param on_result: Callable called in a thread with the return code after the process exits
+        :param stack_name: The name of the stack changed by the command, its cached state is
+            invalidated after the process exits
+        :return: AsyncTerraformProcess object
+        :raise TerraformCommandQueueTimeout: No slot of the scheduler was free in time
+        """
+        semaphore = self._get_semaphore()
+        await semaphore.acquire()
+        try:
+            slot = await self._acquire_scheduler_slot(command)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        def on_exit():
+            self.scheduler.release(slot)
+            semaphore.release()
+
+        def on_process_exit():
+            on_exit()
+            if stack_name is not None and command[1] in STACK_MUTATING_COMMANDS:
+                # State read while the command was running is partial
+                self.state_cache.invalidate(stack_name)
+            if on_result is not None:
+                # The callback may block, e.g. on a write to the stack registry
+                asyncio.get_running_loop().run_in_executor(None, on_result, process.returncode)
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, '-no-color', cwd=cwd, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE, env=self._get_command_environment())
+        except BaseException:
+            on_exit()
+            raise
+        return AsyncTerraformProcess(process, on_exit=on_process_exit)
+
+    async def _acquire_scheduler_slot(self, command: List[str]) -> CommandSlot:
+        """
+        Wait for a slot of the command scheduler without blocking the event loop.
+
+        :param command: Command to execute
+        :return: CommandSlot object
+        """
+        scheduler = self.scheduler
+        command_class = get_command_class(command)
+        return await self._acquire_in_thread(self._slot_executor, scheduler.acquire, scheduler.release,
+                                             command_class, scheduler.get_priority(command_class))
+
+    @contextlib.asynccontextmanager
+    async def _stack_lock(self, stack_name: str, exclusive: bool) -> AsyncGenerator[None, None]:
+        """
+        Hold lock of the stack within the block without blocking the event loop.
+
+        :param stack_name: The name of Terraform stack
+        :param exclusive: Acquire the lock exclusively, shared otherwise
+        :return: Asynchronous context manager
+        """
+        stack_locks = self.stack_locks
+        handle = await self._acquire_in_thread(self._lock_executor, stack_locks.acquire,
+                                               stack_locks.release, stack_name, exclusive)
+        try:
+            yield
+        finally:
+            stack_locks.release(handle)
+
+    @staticmethod
+    async def _acquire_in_thread(executor: ThreadPoolExecutor, acquire: Callable, release: Callable,
+                                 *args):
+        """
+        Call blocking acquire function in a thread of the executor. If the caller is cancelled,
+        the acquired resource is released once the thread gets it.
+
+        :param executor: The executor whose thread waits for the resource
+        :param acquire: The blocking function returning the acquired resource
+        :param release: The function releasing the resource
+        :param args: Arguments of the acquire function
+        :return: The acquired resource
+        """
+        future = asyncio.get_running_loop().run_in_executor(executor, functools.partial(acquire, *args))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The waiting thread cannot be interrupted
+            future.add_done_callback(
+                lambda done: not done.cancelled() and done.exception() is None
+                and release(done.result()))
+            raise
+
+    def close(self) -> None:
+        """
+        Shut down the threads waiting for stack locks and scheduler slots once they are idle.
+
+        :return: None
+        """
+        self._lock_executor.shutdown(wait=False)
+        self._slot_executor.shutdown(wait=False)
+
+    async def run_locking(self, function: Callable, *args):
+        """
+        Call blocking function that waits for stack locks in a thread, which does not belong
+        to the default executor.
+
+        :param function: The blocking function
+        :param args: Arguments of the function
+        :return: The return value of the function
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._lock_executor,
+                                                                functools.partial(function, *args))
+
+    async def _run_command(self, command: List[str], cwd: str) -> Tuple[str, str, int]:
+        """
+        Execute command in cwd and wait for it to finish. The command is repeated according to
+        the retry policy of the manager if it fails with a transient error.
+
+        :param command: Command to execute
+        :param cwd: Working directory
+        :return: Tuple of stdout, stderr and return code of the last attempt
+        """
+        async def attempt() -> Tuple[str, str, int]:
+            with self.instrumentation.command_span(command) as span:
+                process = await self._execute_command(command, cwd)
+                stdout, stderr, return_code = await process.communicate()
+                span.set(exit_code=return_code, output_bytes=len(stdout) + len(stderr))
+                return stdout, stderr, return_code
+
+        # Errors are classified before their lines are joined, which would merge words across lines
+        stdout, stderr, return_code = await self.retry_policy.execute_async(attempt, command=' '.join(command))
+        return stdout, flatten_error_output(stderr), return_code
+
+    async def _initialize_stack_dir(self, stack_name: str, terraform_template: str = None,
+                                    force_init: bool = False) -> bool:
+        """
+        Create Terraform configuration files and initialize the stack directory if needed.
+
+        :param stack_name: The name of Terraform stack.
+        :param terraform_template: Terraform template specifying resources of the stack.
+        :param force_init: Run 'tofu init' even if the stack directory seems initialized.
+        :return: True if 'tofu init' was executed, False if it was skipped
+        :raise TerraformInitFailed: The 'terraform init' command fails.
+        """
+        configuration = await asyncio.to_thread(self._prepare_stack_dir, stack_name, terraform_template,
+                                                force_init)
+        if configuration is None:
+            return False
+
+        stack_dir = self.get_stack_dir(stack_name)
+        await self.init_terraform(stack_dir, stack_name)
+        await asyncio.to_thread(self._store_init_fingerprint, stack_dir, *configuration)
+        return True
+
+    async def _switch_terraform_workspace(self, workspace: str, stack_dir: str) -> None:
+        """
+        Switch Terraform workspace.
+
+        :param workspace: The name of the workspace.
+        :param stack_dir: The path to the stack directory
+        :return: None
+        """
+        command = ['tofu', 'workspace', 'select', workspace]
+        _, stderr, return_code = await self._run_command(command, stack_dir)
+        if return_code:
+            command_error_handler(TerraformWorkspaceFailed, 'Failed to switch Terraform workspace',
+                                  command=' '.join(command), workspace=workspace, stderr=stderr)
+
+    async def _select_stack_workspace(self, stack_name: str) -> None:
+        """
+        Initialize the stack directory and switch to the workspace of the stack.
+
+        :param stack_name: The name of Terraform stack.
+        :return: None
+        :raise TerraformInitFailed: The 'terraform init' command fails.
+        :raise TerraformWorkspaceFailed: Could not switch the workspace.
+        """
+        stack_dir = self.get_stack_dir(stack_name)
+        initialized = await self._initialize_stack_dir(stack_name)
+        if not self.uses_workspaces:
+            return
+        try:
+            await self._switch_terraform_workspace(stack_name, stack_dir)
+        except TerraformWorkspaceFailed:
+            if initialized:
+                raise
+            await self._initialize_stack_dir(stack_name, force_init=True)
+            await self._switch_terraform_workspace(stack_name, stack_dir)
+
+    async def _get_terraform_state(self, stack_name: str) -> TerraformState:
+        """
+        Get parsed Terraform state of the stack, pull it from the backend if it is not cached.
+
+        :param stack_name: The name of Terraform stack.
+        :return: TerraformState object
+        """
+        state = self.state_cache.get(stack_name)
+        if state is not None:
+            return state
+
+        # Concurrent tasks share a single load of the stack
+        load = self._state_loads.get(stack_name)
+        if load is None:
+            load = asyncio.ensure_future(self._load_terraform_state(stack_name))
+            self._state_loads[stack_name] = load
+            load.add_done_callback(lambda _: self._state_loads.pop(stack_name, None))
+        return await asyncio.shield(load)
+
+    async def _load_terraform_state(self, stack_name: str) -> TerraformState:
+        """
+        Read Terraform state of the stack under the shared lock of the stack and cache it.
+        If the stack directory has to be initialized or switched to the workspace of the stack
+        first, it is done under the write lock of the stack.
+
+        :param stack_name: The name of Terraform stack.
+        :return: TerraformState object
+        """
+        with self.instrumentation.span('load state', SPAN_KIND_STATE, stack_name=stack_name) as span:
+            async with self._stack_lock(stack_name, exclusive=False):
+                state, source = await self._read_terraform_state(stack_name)
+            if state is None:
+                # 'tofu init' and the switch of workspace change the stack directory
+                async with self._stack_lock(stack_name, exclusive=True):
+                    await self._prepare_state_pull(stack_name)
+                async with self._stack_lock(stack_name, exclusive=False):
+                    state, source = await self._read_terraform_state(stack_name)
+            if state is None:
+                # The stack directory was changed again meanwhile
+                async with self._stack_lock(stack_name, exclusive=True):
+                    await self._prepare_state_pull(stack_name)
+                    state, source = await self._read_terraform_state(stack_name, prepared=True)
+            span.set(source=source, resources=len(state.resources))
+        await asyncio.to_thread(self._record_state_serial, stack_name, state.serial)
+        return state
+
+    async def _prepare_state_pull(self, stack_name: str) -> None:
+        """
+        Initialize the stack directory and switch to the workspace of the stack, the caller holds
+        the write lock of the stack.
+
+        :param stack_name: The name of Terraform stack.
+        :return: None
+        :raise TerraformInitFailed: The 'terraform init' command fails.
+        :raise CrczpException: Could not switch the workspace.
+        """
+        try:
+            await self._select_stack_workspace(stack_name)
+        except TerraformWorkspaceFailed as exc:
+            raise CrczpException('Failed to switch Terraform workspace') from exc
+
+    async def _read_terraform_state(self, stack_name: str, prepared: bool = False)\
+            -> Tuple[Optional[TerraformState], str]:
+        """
+        Read Terraform state of the stack and cache it, the caller holds a lock of the stack.
+
+        :param stack_name: The name of Terraform stack.
+        :param prepared: The stack directory was prepared for the pull under the held lock
+        :return: Tuple of TerraformState object and its source, the state is None if the stack
+            directory has to be prepared first
+        """
+        generation = self.state_cache.generation(stack_name)
+        state = await asyncio.to_thread(self._read_terraform_state_directly, stack_name)
+        if state is not None:
+            self.state_cache.put(stack_name, state, generation)
+            return state, STATE_SOURCE_BACKEND
+        if not prepared and not await asyncio.to_thread(self._is_stack_dir_selected, stack_name):
+            return None, STATE_SOURCE_TOFU
+        state = await self._pull_terraform_state(stack_name)
+        self.state_cache.put(stack_name, state, generation)
+        return state, STATE_SOURCE_TOFU
+
+    async def _pull_terraform_state(self, stack_name: str) -> TerraformState:
+        """
+        Pull Terraform state from remote backend, the stack directory is prepared for the pull.
+        The state is parsed in a thread directly from the output of 'tofu state pull', only
+        managed resources are kept.
+
+        :param stack_name: The name of Terraform stack.
+        :return: TerraformState object
+        :raise CrczpException: The state could not be pulled or parsed
+        """
+        command = ['tofu', 'state', 'pull']
+
+        async def attempt() -> Tuple[tuple, str, int]:
+            with self.instrumentation.command_span(command, stack_name=stack_name) as span:
+                process = await self._execute_command(command, self.get_stack_dir(stack_name))
+                stream = process.get_output_reader()
+                if self.instrumentation.enabled:
+                    stream = CountingReader(stream)
+                try:
+                    pulled_state, error = await asyncio.to_thread(self._parse_pulled_state, stream)
+                except asyncio.CancelledError:
+                    # The parsing thread stops at the end of output of the killed process
+                    await process.kill()
+                    raise
+                _, pull_stderr, pull_return_code = await process.communicate()
+                span.set(exit_code=pull_return_code, output_bytes=getattr(stream, 'count', None),
+                         parse_error=None if error is None else str(error))
+                return (pulled_state, error), pull_stderr, pull_return_code
+
+        (state, parse_error), stderr, return_code = await self.retry_policy.execute_async(
+            attempt, command=' '.join(command), stack_name=stack_name)
+        self._check_pulled_state(command, stack_name, stderr, return_code, parse_error)
+        return state
+
+    async def init_terraform(self, stack_dir: str, stack_name: str) -> None:
+        """
+        Initialize Terraform properties in stack directory.
+
+        :param stack_dir: Path to the stack directory
+        :param stack_name: The name of Terraform stack
+        :return: None
+        :raise TerraformInitFailed: The 'terraform init' command fails.
+        """
+        command = ['tofu', 'init']
+        _, stderr, return_code = await self._run_command(command, stack_dir)
+        if return_code:
+            command_error_handler(TerraformInitFailed, 'Failed to initialize Terraform',
+                                  command=' '.join(command), stack_name=stack_name, stderr=stderr)
+
+    async def create_terraform_workspace(self, stack_dir: str, stack_name: str,
+                                         should_raise: bool = True) -> None:
+        """
+        Create new Terraform workspace.
+
+        :param stack_dir: Path to the stack directory
+        :param stack_name: The name of Terraform stack
+        :param should_raise: Raise exception if workspace creation fails
+        :return: None
+        :raise TerraformWorkspaceFailed: Could not create new workspace.
+        """
+        command = ['tofu', 'workspace', 'new', stack_name]
+
+        async def attempt() -> Tuple[str, str, int]:
+            process = await self._execute_command(command, stack_dir)
+            stdout, stderr, return_code = await process.communicate()
+            if 'already exists' in stderr:
+                return stdout, stderr, 0
+            return stdout, stderr, return_code
+
+        if not should_raise:
+            await attempt()
+            return
+        _, stderr, return_code = await self.retry_policy.execute_async(
+            attempt, command=' '.join(command), stack_name=stack_name)
+        if return_code:
+            command_error_handler(TerraformWorkspaceFailed, 'Failed to create new workspace',
+                                  command=' '.join(command), stack_name=stack_name,
+                                  stderr=flatten_error_output(stderr))
+
+    async def create_stack(self, topology_instance: TopologyInstance, dry_run, stack_name: str,
+                           key_pair_name_ssh: str, key_pair_name_cert: str, *args, json_output: bool = False,
+                           **kwargs) -> AsyncTerraformProcess:
+        """
+        Create Terraform stack on the cloud.
+
+        :param topology_instance: TopologyInstance from which is the stack created
+        :param dry_run: Create only Terraform plan without allocation
+        :param stack_name: The name of the stack
+        :param key_pair_name_ssh: Name of the SSH key pair
+        :param key_pair_name_cert: Name of the certificate key pair
+        :param json_output: Produce machine-readable output, see AsyncTerraformProcess.events
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: The process that is executing the creation
+        :raise CrczpException: Stack creation has failed
+        """
+        terraform_template = await asyncio.to_thread(
+            self.create_terraform_template, topology_instance, *args,
+            key_pair_name_ssh=key_pair_name_ssh, key_pair_name_cert=key_pair_name_cert,
+            resource_prefix=stack_name, **kwargs)
+        async with self._stack_lock(stack_name, exclusive=True):
+            self.state_cache.invalidate(stack_name)
+            stack_dir = self.get_stack_dir(stack_name)
+            await asyncio.to_thread(self._record_stack_state, stack_name,
+                                    CrczpTerraformStackState.INITIALIZING, terraform_template)
+            try:
+                await self._initialize_stack_dir(stack_name, terraform_template)
+                if self.uses_workspaces:
+                    await self.create_terraform_workspace(stack_dir, stack_name)
+            except Exception as exc:
+                await asyncio.to_thread(self._record_stack_state, stack_name,
+                                        CrczpTerraformStackState.FAILED, error=str(exc))
+                raise
+
+            if dry_run:
+                # Nothing is allocated, the stack stays initializing
+                return await self._execute_command(self._get_stack_command('plan', json_output), stack_dir)
+            command = self._get_stack_command('apply', json_output)
+            on_result = await asyncio.to_thread(self._track_stack_command, stack_name, command,
+                                                CrczpTerraformStackState.APPLYING, terraform_template)
+            return await self._execute_command(command, stack_dir, on_result, stack_name)
+
+    async def update_stack(self, topology_instance: TopologyInstance, stack_name: str,
+                           key_pair_name_ssh: str, key_pair_name_cert: str, *args, targeted: bool = True,
+                           json_output: bool = False, **kwargs) -> Optional[AsyncTerraformProcess]:
+        """
+        Update existing Terraform stack to the topology, applying only the affected resources.
+
+        :param topology_instance: TopologyInstance the stack is updated to
+        :param stack_name: The name of the stack
+        :param key_pair_name_ssh: Name of the SSH key pair
+        :param key_pair_name_cert: Name of the certificate key pair
+        :param targeted: Apply only the affected resources, the whole stack is applied if False
+        :param json_output: Produce machine-readable output, see AsyncTerraformProcess.events
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: The process that is executing the update or None if the template is unchanged
+        :raise StackNotFound: The stack directory does not exist
+        :raise CrczpException: Stack update has failed
+        """
+        terraform_template = await asyncio.to_thread(
+            self.create_terraform_template, topology_instance, *args,
+            key_pair_name_ssh=key_pair_name_ssh, key_pair_name_cert=key_pair_name_cert,
+            resource_prefix=stack_name, **kwargs)
+        async with self._stack_lock(stack_name, exclusive=True):
+            command = await asyncio.to_thread(self._prepare_stack_update, stack_name, terraform_template,
+                                              targeted, json_output)
+            if command is None:
+                return None
+            await self._select_stack_workspace(stack_name)
+            on_result = await asyncio.to_thread(self._track_stack_command, stack_name, command,
+                                                CrczpTerraformStackState.APPLYING, terraform_template)
+            return await self._execute_command(command, self.get_stack_dir(stack_name), on_result, stack_name)
+
+    async def delete_stack(self, stack_name: str, json_output: bool = False) -> Optional[AsyncTerraformProcess]:
+        """
+        Delete Terraform stack.
+
+        :param stack_name: Name of stack that is deleted
+        :param json_output: Produce machine-readable output, see AsyncTerraformProcess.events
+        :return: The process that is executing the deletion
+        :raise CrczpException: Stack deletion has failed
+        """
+        async with self._stack_lock(stack_name, exclusive=True):
+            self.state_cache.invalidate(stack_name)
+            stack_dir = self.get_stack_dir(stack_name)
+            try:
+                await self._select_stack_workspace(stack_name)
+            except (TerraformInitFailed, TerraformWorkspaceFailed):
+                return None
+            command = self._get_stack_command('destroy', json_output)
+            on_result = await asyncio.to_thread(self._track_stack_command, stack_name, command,
+                                                CrczpTerraformStackState.DESTROYING)
+            return await self._execute_command(command, stack_dir, on_result, stack_name)
+
+    async def delete_stack_directory(self, stack_name: str) -> None:
+        """
+        Delete the stack directory.
+
+        :param stack_name: Name of stack
+        :return: None
+        :raise CrczpException: Stack directory is not found
+        """
+        await self.run_locking(self.manager.delete_stack_directory, stack_name)
+
+    async def delete_terraform_workspace(self, stack_name: str) -> None:
+        """
+        Delete Terraform workspace, the state of the stack in the directory stack layout.
+
+        :param stack_name: Name of stack
+        :return: None
+        :raise CrczpException: Terraform workspace is not found
+        :raise TerraformWorkspaceFailed: The state of the stack could not be deleted
+        """
+        if not self.uses_workspaces:
+            async with self._stack_lock(stack_name, exclusive=True):
+                self.state_cache.invalidate(stack_name)
+                await asyncio.to_thread(self._delete_stack_state, stack_name)
+            await asyncio.to_thread(self._record_deleted_workspace, stack_name)
+            return
+        async with self._stack_lock(stack_name, exclusive=True):
+            self.state_cache.invalidate(stack_name)
+            stack_dir = self.get_stack_dir(stack_name)
+            await self._switch_terraform_workspace(TERRAFORM_DEFAULT_WORKSPACE, stack_dir)
+            command = ['tofu', 'workspace', 'delete', stack_name]
+            _, stderr, return_code = await self._run_command(command, stack_dir)
+        if return_code:
+            command_error_handler(TerraformWorkspaceFailed, 'Failed to delete Terraform workspace',
+                                  command=' '.join(command), stderr=stderr)
+        await asyncio.to_thread(self._record_deleted_workspace, stack_name)
+
+    async def list_stacks(self, states: List[CrczpTerraformStackState] = None, name_prefix: str = None,
+                          limit: int = None, after: str = None) -> List[str]:
+        """
+        List created Terraform stacks.
+
+        :param states: List only stacks in these states, all stacks if None
+        :param name_prefix: List only stacks whose name starts with the prefix
+        :param limit: The maximum number of listed stacks, all if None
+        :param after: List only stacks whose name follows this name, the last name of the previous page
+        :return: The list containing stack names
+        """
+        return await asyncio.to_thread(self.manager.list_stacks, states, name_prefix, limit, after)
+
+    async def list_stack_records(self, states: List[CrczpTerraformStackState] = None, name_prefix: str = None,
+                                 limit: int = None, after: str = None) -> List[TerraformStackRecord]:
+        """
+        List records of stacks in the stack registry ordered by name.
+
+        :param states: List only stacks in these states, all stacks if None
+        :param name_prefix: List only stacks whose name starts with the prefix
+        :param limit: The maximum number of listed stacks, all if None
+        :param after: List only stacks whose name follows this name, the last name of the previous page
+        :return: List of TerraformStackRecord objects
+        """
+        return await asyncio.to_thread(self.manager.list_stack_records, states, name_prefix, limit, after)
+
+    async def reconcile_stack_registry(self) -> Tuple[List[str], List[str]]:
+        """
+        Rebuild the stack registry from the stacks directory.
+
+        :return: Tuple of the names of registered and removed stacks
+        """
+        return await self.run_locking(self.manager.reconcile_stack_registry)
+
+    async def list_stack_resources(self, stack_name: str) -> List[dict]:
+        """
+        List stack resources and its attributes.
+
+        :param stack_name: The name of stack
+        :return: The list of dictionaries containing resources
+        """
+        state = await self._get_terraform_state(stack_name)
+        return list(state.resources)
+
+    async def get_stack_index(self, stack_name: str) -> StackResourceIndex:
+        """
+        Get index of stack resources.
+
+        :param stack_name: The name of stack
+        :return: StackResourceIndex object
+        """
+        state = await self._get_terraform_state(stack_name)
+        return state.get_index(stack_name)
+
+    async def get_resource_id(self, stack_name: str, node_name: str) -> str:
+        """
+        Get ID of stack's resource.
+
+        :param stack_name: The name of stack
+        :param node_name: The name of node
+        :return: The ID of resource
+        """
+        index = await self.get_stack_index(stack_name)
+        return index.get(node_name).id
+
+    async def get_node(self, stack_name: str, node_name: str) -> TerraformInstance:
+        """
+        Get data about node.
+
+        :param stack_name: The name of stack
+        :param node_name: The name of node
+        :return: TerraformInstance object
+        """
+        index = await self.get_stack_index(stack_name)
+        return await asyncio.to_thread(self._create_terraform_instance, node_name,
+                                       index.get(node_name))
+
+    async def get_nodes(self, stack_name: str, node_names: List[str] = None,
+                        max_workers: int = DEFAULT_BATCH_WORKERS) -> Dict[str, TerraformInstance]:
+        """
+        Get data about multiple nodes of the stack at once.
+
+        :param stack_name: The name of stack
+        :param node_names: The names of nodes, all nodes of the stack if None
+        :param max_workers: The maximum number of concurrent cloud requests
+        :return: Dictionary of TerraformInstance objects keyed by node name
+        :raise KeyError: A node does not exist
+        """
+        index = await self.get_stack_index(stack_name)
+        resources = self._select_node_resources(index, node_names)
+        return await asyncio.to_thread(self._create_terraform_instances, resources, max_workers)
+
+    async def get_console_url(self, stack_name: str, node_name: str, console_type: str) -> str:
+        """
+        Get console url of a node.
+
+        :param stack_name: The name of stack
+        :param node_name: The name of node
+        :param console_type: Type can be novnc, xvpvnc, spice-html5, rdp-html5, serial and webmks
+        :return: Url to console
+        """
+        node = await self.get_node(stack_name, node_name)
+        if node.status != 'active':
+            raise CrczpException(f'Cannot get {console_type} console from inactive machine')
+
+        return await asyncio.to_thread(self.cloud_client.get_console_url, node.id, console_type)
+
+    async def get_enriched_topology_instance(self, stack_name: str,
+                                             topology_instance: TopologyInstance) -> TopologyInstance:
+        """
+        Get enriched TopologyInstance.
+
+        :param stack_name: The name of stack
+        :param topology_instance: The TopologyInstance
+        :return: TopologyInstance with additional properties
+        """
+        index = await self.get_stack_index(stack_name)
+        return await asyncio.to_thread(self._enrich_topology_instance, stack_name, topology_instance, index)
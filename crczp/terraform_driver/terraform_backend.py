@@ -1,57 +1,113 @@
-import os
-
-from jinja2 import Environment, FileSystemLoader
+import hashlib
 
+from crczp.terraform_driver.terraform_artifacts import TerraformArtifactRegistry, ARTIFACT_REGISTRY, \
+    ARTIFACT_BACKEND, get_configuration_key
 from crczp.terraform_driver.terraform_client_elements import CrczpTerraformBackendType
 from crczp.terraform_driver.terraform_exceptions import TerraformImproperlyConfigured
 
 TERRAFORM_STATE_FILE_NAME = 'terraform.tfstate'
-TEMPLATES_DIR_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
 TERRAFORM_BACKEND_FILE_NAME = 'terraform_backend.j2'
+KUBERNETES_SECRET_SUFFIX = 'state'
+KUBERNETES_SECRET_NAME = 'tfstate-default-{}'
+STACK_SCHEMA_NAME = 'terraform_stack_{}'
+POSTGRES_MAX_IDENTIFIER_LENGTH = 63
 
 
 class CrczpTerraformBackend:
 
-    def __init__(self, backend_type: CrczpTerraformBackendType, db_configuration=None, kube_namespace=None):
+    def __init__(self, backend_type: CrczpTerraformBackendType, db_configuration=None, kube_namespace=None,
+                 artifact_registry: TerraformArtifactRegistry = ARTIFACT_REGISTRY):
         self.backend_type = backend_type
         self.db_configuration = db_configuration
         self.kube_namespace = kube_namespace
-        self.template_environment = Environment(loader=(FileSystemLoader(TEMPLATES_DIR_PATH)))
-        self.template = self._create_terraform_backend_template()
+        self.artifact_registry = artifact_registry
+        # Fail early on missing configuration, the template itself is rendered on first use
+        self._get_backend_settings()
+        self._configuration_key = get_configuration_key(backend_type.value, db_configuration, kube_namespace)
+
+    @property
+    def template(self) -> str:
+        """
+        Terraform backend configuration shared by all stacks, rendered once per process for the
+        same backend configuration.
+        """
+        return self.artifact_registry.get_artifact(ARTIFACT_BACKEND, self._configuration_key,
+                                                   self._create_terraform_backend_template)
+
+    @staticmethod
+    def get_stack_schema_name(stack_name: str) -> str:
+        """
+        Get name of the Postgres schema holding state of the stack in the directory stack layout.
+
+        :param stack_name: The name of stack
+        :return: The schema name
+        """
+        schema_name = STACK_SCHEMA_NAME.format(stack_name)
+        if len(schema_name) > POSTGRES_MAX_IDENTIFIER_LENGTH:
+            digest = hashlib.sha256(stack_name.encode()).hexdigest()[:16]
+            schema_name = schema_name[:POSTGRES_MAX_IDENTIFIER_LENGTH - len(digest) - 1] + '_' + digest
+        return schema_name
+
+    @staticmethod
+    def get_stack_secret_name(stack_name: str) -> str:
+        """
+        Get name of the Kubernetes secret holding state of the stack in the directory stack layout.
+
+        :param stack_name: The name of stack
+        :return: The secret name
+        """
+        return KUBERNETES_SECRET_NAME.format(stack_name)
+
+    def get_stack_template(self, stack_name: str) -> str:
+        """
+        Create Terraform backend configuration storing state of the stack under its own key,
+        used in the directory stack layout.
+
+        :param stack_name: The name of stack
+        :return: Terraform backend configuration
+        """
+        return self._create_terraform_backend_template(stack_name)
 
-    def _get_local_settings(self) -> str:
+    def _get_local_settings(self, stack_name: str = None) -> str:
+        # Every stack directory has its own state file
         return f'path = "{TERRAFORM_STATE_FILE_NAME}"'
 
-    def _get_postgres_settings(self) -> str:
+    def _get_postgres_settings(self, stack_name: str = None) -> str:
         if self.db_configuration is None:
             raise TerraformImproperlyConfigured('Provide database configuration when using the postgres backend.')
 
         conn_str = 'postgres://{0[user]}:{0[password]}@{0[host]}/{0[name]}?sslmode=disable'\
                    .format(self.db_configuration)
-        return f'conn_str = "{conn_str}"'
+        settings = f'conn_str = "{conn_str}"'
+        if stack_name is not None:
+            settings += f'\n    schema_name = "{self.get_stack_schema_name(stack_name)}"'
+        return settings
 
-    def _get_kubernetes_settings(self) -> str:
+    def _get_kubernetes_settings(self, stack_name: str = None) -> str:
         if self.kube_namespace is None:
             raise TerraformImproperlyConfigured('Provide Kubernetes namespace when using the kubernetes backend.')
 
-        return f'secret_suffix = "state"\nin_cluster_config = "true"\nnamespace = "{self.kube_namespace}"'
+        secret_suffix = KUBERNETES_SECRET_SUFFIX if stack_name is None else stack_name
+        return f'secret_suffix = "{secret_suffix}"\nin_cluster_config = "true"\nnamespace = "{self.kube_namespace}"'
 
-    def _get_backend_settings(self) -> str:
+    def _get_backend_settings(self, stack_name: str = None) -> str:
+        # Only settings of the configured backend are created, the others may be misconfigured
         backend_settings = {
-            CrczpTerraformBackendType.LOCAL: self._get_local_settings(),
-            CrczpTerraformBackendType.POSTGRES: self._get_postgres_settings(),
-            CrczpTerraformBackendType.KUBERNETES: self._get_kubernetes_settings(),
+            CrczpTerraformBackendType.LOCAL: self._get_local_settings,
+            CrczpTerraformBackendType.POSTGRES: self._get_postgres_settings,
+            CrczpTerraformBackendType.KUBERNETES: self._get_kubernetes_settings,
         }
 
-        return backend_settings[self.backend_type]
+        return backend_settings[self.backend_type](stack_name)
 
-    def _create_terraform_backend_template(self) -> str:
+    def _create_terraform_backend_template(self, stack_name: str = None) -> str:
         """
         Create Terraform backend configuration
+        :param stack_name: The name of stack with its own state key, the shared configuration if None
         :return: Terraform backend configuration
         """
-        template = self.template_environment.get_template(TERRAFORM_BACKEND_FILE_NAME)
+        template = self.artifact_registry.get_template(TERRAFORM_BACKEND_FILE_NAME)
         return template.render(
             tf_backend=self.backend_type.value,
-            tf_backend_settings=self._get_backend_settings(),
+            tf_backend_settings=self._get_backend_settings(stack_name),
         )
@@ -1,5 +1,6 @@
+import os
 from enum import Enum
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from crczp.cloud_commons import CrczpCloudClientBase, TopologyInstance, TransformationConfiguration, \
     Image, Limits, QuotaSet, HardwareUsage
@@ -8,10 +9,30 @@ from crczp.openstack_driver import CrczpOpenStackClient
 from crczp.aws_driver.aws_client import CrczpAwsClient
 from crczp.topology_definition.models import TopologyDefinition, DockerContainers
 
+from crczp.terraform_driver.terraform_artifacts import get_configuration_key
 from crczp.terraform_driver.terraform_backend import CrczpTerraformBackend
 from crczp.terraform_driver.terraform_client_elements import TerraformInstance, \
-    CrczpTerraformBackendType
-from crczp.terraform_driver.terraform_client_manager import CrczpTerraformClientManager
+    CrczpTerraformBackendType, TerraformStackResult, CrczpTerraformStackLayout, CrczpTerraformStackState, \
+    TerraformStackRecord, TerraformGarbageCollectionReport
+from crczp.terraform_driver.terraform_cloud_cache import CloudCatalogCache, DEFAULT_CLOUD_CACHE_SIZE
+from crczp.terraform_driver.terraform_client_manager import CrczpTerraformClientManager, \
+    DEFAULT_BATCH_WORKERS, STACKS_DIR
+from crczp.terraform_driver.terraform_instrumentation import Instrumentation, InstrumentationHook, \
+    InstrumentedCloudClient
+from crczp.terraform_driver.terraform_plugin_cache import TerraformPluginCache
+from crczp.terraform_driver.terraform_retry import RetryPolicy, RetryStats, DEFAULT_MAX_ATTEMPTS
+from crczp.terraform_driver.terraform_scheduler import TerraformCommandScheduler, SchedulerStats, \
+    DEFAULT_MAX_COMMANDS
+from crczp.terraform_driver.terraform_stack_gc import TerraformStackGarbageCollector, DEFAULT_GC_RETENTION, \
+    DEFAULT_GC_IDLE_TIME, DEFAULT_GC_MAX_ACTIONS, DEFAULT_GC_RATE
+from crczp.terraform_driver.terraform_stack_lock import TerraformStackLocks
+from crczp.terraform_driver.terraform_stack_registry import TerraformStackRegistry, STACK_REGISTRY_FILE_NAME
+from crczp.terraform_driver.terraform_state_reader import create_state_reader
+from crczp.terraform_driver.terraform_process import TerraformOutputLine, DEFAULT_OUTPUT_BUFFER_SIZE
+from crczp.terraform_driver.terraform_state_cache import TerraformStateCache, CacheStats, \
+    DEFAULT_STATE_CACHE_TTL, DEFAULT_STATE_CACHE_SIZE
+from crczp.terraform_driver.terraform_template_cache import TemplateRenderCache, DEFAULT_TEMPLATE_CACHE_SIZE
+from crczp.terraform_driver.terraform_template_diff import TemplateDiff
 
 
 class AvailableCloudLibraries(Enum):
@@ -27,13 +48,67 @@ class CrczpTerraformClient:
     def __init__(self, cloud_client: AvailableCloudLibraries, trc: TransformationConfiguration,
                  stacks_dir: str = None, template_file_name: str = None,
                  backend_type: CrczpTerraformBackendType = CrczpTerraformBackendType('local'),
-                 db_configuration=None, kube_namespace=None, *args, **kwargs):
+                 db_configuration=None, kube_namespace=None, *args,
+                 state_cache_ttl: float = DEFAULT_STATE_CACHE_TTL,
+                 state_cache_size: int = DEFAULT_STATE_CACHE_SIZE,
+                 plugin_cache_dir: str = None, provider_mirror: bool = False,
+                 spool_output: bool = False, output_buffer_size: int = DEFAULT_OUTPUT_BUFFER_SIZE,
+                 direct_state_reads: bool = True, state_attributes: List[str] = None,
+                 max_commands: int = DEFAULT_MAX_COMMANDS, command_class_limits: Dict[str, int] = None,
+                 command_queue_timeout: float = None, stack_lock_dir: str = None,
+                 stack_layout: CrczpTerraformStackLayout = CrczpTerraformStackLayout.WORKSPACE,
+                 max_command_attempts: int = DEFAULT_MAX_ATTEMPTS, cloud_cache_ttls: Dict[str, float] = None,
+                 cloud_cache_size: int = DEFAULT_CLOUD_CACHE_SIZE,
+                 template_cache_size: int = DEFAULT_TEMPLATE_CACHE_SIZE,
+                 instrumentation_hooks: List[InstrumentationHook] = None, stack_registry: bool = False,
+                 stack_registry_path: str = None, gc_interval: float = None,
+                 gc_retention: float = DEFAULT_GC_RETENTION, gc_idle_time: float = DEFAULT_GC_IDLE_TIME,
+                 gc_max_actions: int = DEFAULT_GC_MAX_ACTIONS, gc_rate: float = DEFAULT_GC_RATE,
+                 gc_delete_orphaned_workspaces: bool = False, **kwargs):
+        self.instrumentation = Instrumentation(instrumentation_hooks)
         self.cloud_client: CrczpCloudClientBase = cloud_client.value(trc=trc, *args, **kwargs)
+        if self.instrumentation.enabled:
+            self.cloud_client = InstrumentedCloudClient(self.cloud_client, self.instrumentation)
+        # The provider configuration depends only on the arguments of the cloud client
+        provider_key = get_configuration_key(cloud_client.name, type(trc).dump(trc), *args, **kwargs)
         terraform_backend = CrczpTerraformBackend(backend_type=backend_type,
                                                  db_configuration=db_configuration,
                                                  kube_namespace=kube_namespace)
+        self.cloud_cache = CloudCatalogCache(self.cloud_client, cloud_cache_ttls, cloud_cache_size)
+        state_cache = TerraformStateCache(ttl=state_cache_ttl, max_size=state_cache_size)
+        plugin_cache = TerraformPluginCache(plugin_cache_dir) if plugin_cache_dir else None
+        scheduler = TerraformCommandScheduler(max_commands, command_class_limits, command_queue_timeout)
+        state_reader = create_state_reader(terraform_backend, state_attributes, stack_layout) \
+            if direct_state_reads else None
+        registry = None
+        # The registry is opt-in, it is created and reconciled with the stacks directory on first use
+        if stack_registry:
+            registry = TerraformStackRegistry(
+                stack_registry_path or os.path.join(stacks_dir or STACKS_DIR, STACK_REGISTRY_FILE_NAME))
         self.client_manager = CrczpTerraformClientManager(stacks_dir, self.cloud_client, trc,
-                                                         template_file_name, terraform_backend)
+                                                         template_file_name, terraform_backend,
+                                                         state_cache=state_cache,
+                                                         plugin_cache=plugin_cache,
+                                                         spool_output=spool_output,
+                                                         output_buffer_size=output_buffer_size,
+                                                         state_reader=state_reader,
+                                                         state_attributes=state_attributes,
+                                                         scheduler=scheduler,
+                                                         stack_locks=TerraformStackLocks(stack_lock_dir),
+                                                         stack_layout=stack_layout,
+                                                         retry_policy=RetryPolicy(max_command_attempts),
+                                                         cloud_cache=self.cloud_cache,
+                                                         template_cache=TemplateRenderCache(template_cache_size),
+                                                         provider_key=provider_key,
+                                                         instrumentation=self.instrumentation,
+                                                         stack_registry=registry)
+        if provider_mirror:
+            self.client_manager.warm_provider_mirror()
+        self.garbage_collector = TerraformStackGarbageCollector(
+            self.client_manager, retention=gc_retention, idle_time=gc_idle_time, max_actions=gc_max_actions,
+            rate=gc_rate, delete_orphaned_workspaces=gc_delete_orphaned_workspaces)
+        if gc_interval:
+            self.garbage_collector.start(gc_interval)
         self.trc = trc
 
     def get_process_output(self, process):
@@ -45,6 +120,17 @@ class CrczpTerraformClient:
         """
         return self.client_manager.get_process_output(process)
 
+    def stream_process_output(self, process, timeout: float = None) -> Iterator[TerraformOutputLine]:
+        """
+        Stream stdout and stderr of process at the same time as TerraformOutputLine objects
+        tagged by stream name and timestamp. Only recent lines are kept in memory.
+
+        :param process: The process creating output
+        :param timeout: The timeout in seconds for the whole output
+        :return: TerraformOutputLine objects as they are produced
+        """
+        return self.client_manager.stream_process_output(process, timeout)
+
     def wait_for_process(self, process, timeout) -> Tuple[str, str, int]:
         """
         Wait for the process to finish. Close all file descriptors when proces is finished.
@@ -58,7 +144,7 @@ class CrczpTerraformClient:
     def create_stack(self, topology_definition: TopologyDefinition, stack_name: str = 'stack-name',
                      key_pair_name_ssh: str = 'dummy-ssh-key-pair',
                      key_pair_name_cert: str = 'dummy-cert-key-pair', dry_run: bool = False,
-                     *args, **kwargs):
+                     *args, json_output: bool = False, **kwargs):
         """
         Create Terraform stack on the cloud.
 
@@ -67,6 +153,8 @@ class CrczpTerraformClient:
         :param key_pair_name_ssh: Name of the SSH key pair
         :param key_pair_name_cert: Name of the certificate key pair
         :param dry_run: Create only Terraform plan without allocation
+        :param json_output: Run Terraform with machine-readable output, the typed progress
+            events are available via the events() method of the returned process
         :param args, kwargs: Can contain other attributes required for rendering of template
         :return: The process that is executing the creation
         :raise CrczpException: Stack creation has failed
@@ -74,7 +162,80 @@ class CrczpTerraformClient:
         topology_instance = self.get_topology_instance(topology_definition)
         return self.client_manager.create_stack(topology_instance, dry_run, stack_name,
                                                 key_pair_name_ssh, key_pair_name_cert, *args,
-                                                **kwargs)
+                                                json_output=json_output, **kwargs)
+
+    def create_stacks(self, topology_definition: TopologyDefinition, stack_names: List[str],
+                      key_pair_name_ssh: str = 'dummy-ssh-key-pair',
+                      key_pair_name_cert: str = 'dummy-cert-key-pair', dry_run: bool = False,
+                      max_workers: int = DEFAULT_BATCH_WORKERS, timeout: float = None,
+                      *args, json_output: bool = False, **kwargs) -> Dict[str, TerraformStackResult]:
+        """
+        Create multiple Terraform stacks from one topology definition concurrently.
+
+        The template is rendered once and only the resource prefix differs between stacks.
+        Failure of one stack does not abort the batch, it is reported in its result.
+
+        :param topology_definition: TopologyDefinition from which are the stacks created
+        :param stack_names: The names of the stacks
+        :param key_pair_name_ssh: Name of the SSH key pair
+        :param key_pair_name_cert: Name of the certificate key pair
+        :param dry_run: Create only Terraform plan without allocation
+        :param max_workers: The maximum number of stacks processed concurrently
+        :param timeout: Timeout in seconds of allocation of a single stack
+        :param json_output: Run Terraform with machine-readable output
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: Dictionary of TerraformStackResult objects keyed by stack name
+        :raise CrczpException: Template rendering has failed
+        """
+        topology_instance = self.get_topology_instance(topology_definition)
+        return self.client_manager.create_stacks(topology_instance, dry_run, stack_names,
+                                                 key_pair_name_ssh, key_pair_name_cert,
+                                                 max_workers, timeout, *args,
+                                                 json_output=json_output, **kwargs)
+
+    def update_stack(self, topology_definition: TopologyDefinition, stack_name: str,
+                     key_pair_name_ssh: str = 'dummy-ssh-key-pair',
+                     key_pair_name_cert: str = 'dummy-cert-key-pair', *args, targeted: bool = True,
+                     json_output: bool = False, **kwargs):
+        """
+        Update existing Terraform stack to the changed topology definition.
+
+        Only resources added, removed or changed in the rendered template and the resources
+        referring to them are planned and applied.
+
+        :param topology_definition: TopologyDefinition the stack is updated to
+        :param stack_name: The name of the stack
+        :param key_pair_name_ssh: Name of the SSH key pair
+        :param key_pair_name_cert: Name of the certificate key pair
+        :param targeted: Apply only the affected resources, the whole stack is applied if False
+        :param json_output: Run Terraform with machine-readable output
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: The process that is executing the update or None if the template is unchanged
+        :raise StackNotFound: The stack does not exist
+        :raise CrczpException: Stack update has failed
+        """
+        topology_instance = self.get_topology_instance(topology_definition)
+        return self.client_manager.update_stack(topology_instance, stack_name, key_pair_name_ssh,
+                                                key_pair_name_cert, *args, targeted=targeted,
+                                                json_output=json_output, **kwargs)
+
+    def get_stack_changes(self, topology_definition: TopologyDefinition, stack_name: str,
+                          key_pair_name_ssh: str = 'dummy-ssh-key-pair',
+                          key_pair_name_cert: str = 'dummy-cert-key-pair', *args, **kwargs) -> TemplateDiff:
+        """
+        Get resources of the stack which update_stack would add, remove or change.
+
+        :param topology_definition: TopologyDefinition the stack is updated to
+        :param stack_name: The name of the stack
+        :param key_pair_name_ssh: Name of the SSH key pair
+        :param key_pair_name_cert: Name of the certificate key pair
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: TemplateDiff object
+        :raise StackNotFound: The stack does not exist
+        """
+        topology_instance = self.get_topology_instance(topology_definition)
+        return self.client_manager.get_stack_changes(topology_instance, stack_name, key_pair_name_ssh,
+                                                     key_pair_name_cert, *args, **kwargs)
 
     def create_terraform_template(self, topology_definition: TopologyDefinition, *args, **kwargs)\
             -> str:
@@ -99,15 +260,72 @@ class CrczpTerraformClient:
         """
         self.create_terraform_template(topology_definition)
 
-    def delete_stack(self, stack_name: str):
+    def delete_stack(self, stack_name: str, json_output: bool = False):
         """
         Delete Terraform stack.
 
         :param stack_name: Name of stack that is deleted
+        :param json_output: Run Terraform with machine-readable output, the typed progress
+            events are available via the events() method of the returned process
         :return: The process that is executing the deletion
         :raise CrczpException: Stack deletion has failed
         """
-        return self.client_manager.delete_stack(stack_name)
+        return self.client_manager.delete_stack(stack_name, json_output)
+
+    def delete_stacks(self, stack_names: List[str], max_workers: int = DEFAULT_BATCH_WORKERS,
+                      timeout: float = None, delete_workspace: bool = True, delete_directory: bool = True,
+                      json_output: bool = False) -> Dict[str, TerraformStackResult]:
+        """
+        Delete multiple Terraform stacks concurrently.
+
+        Every stack is destroyed and then its workspace and directory are deleted, without
+        waiting for the other stacks. Failure of one stack does not abort the batch, it is
+        reported in its result and the workspace and directory of the stack are kept.
+
+        :param stack_names: The names of the stacks
+        :param max_workers: The maximum number of stacks processed concurrently
+        :param timeout: Timeout in seconds of destruction of a single stack
+        :param delete_workspace: Delete the workspace of every destroyed stack
+        :param delete_directory: Delete the directory of every destroyed stack
+        :param json_output: Run Terraform with machine-readable output
+        :return: Dictionary of TerraformStackResult objects keyed by stack name
+        """
+        return self.client_manager.delete_stacks(stack_names, max_workers, timeout, delete_workspace,
+                                                 delete_directory, json_output)
+
+    def warm_provider_mirror(self, force: bool = False) -> None:
+        """
+        Populate the shared local provider mirror used by 'tofu init' of all stacks.
+
+        :param force: Populate the mirror even if it is up to date
+        :return: None
+        :raise CrczpException: The provider mirror could not be populated
+        """
+        self.client_manager.warm_provider_mirror(force)
+
+    def reinitialize_stack(self, stack_name: str) -> None:
+        """
+        Force Terraform initialization of the stack directory, e.g. when it was modified
+        outside of this library.
+
+        :param stack_name: Name of stack
+        :return: None
+        :raise CrczpException: Terraform initialization has failed
+        """
+        self.client_manager.reinitialize_stack(stack_name)
+
+    def migrate_stack_to_directory_layout(self, stack_name: str, delete_workspace: bool = True) -> None:
+        """
+        Move state of a stack created in the workspace stack layout to its own backend key,
+        so it can be managed by a client using the directory stack layout.
+
+        :param stack_name: Name of stack
+        :param delete_workspace: Delete the workspace of the stack after the state is moved
+        :return: None
+        :raise StackNotFound: The stack directory does not exist
+        :raise CrczpException: The migration has failed
+        """
+        self.client_manager.migrate_stack_to_directory_layout(stack_name, delete_workspace)
 
     def delete_stack_directory(self, stack_name: str) -> None:
         """
@@ -123,9 +341,15 @@ class CrczpTerraformClient:
         """
         Delete the Terraform workspace.
 
+        In the directory stack layout, the stack has no workspace and its state in the remote
+        backend is deleted instead. The Postgres schema of the stack is dropped, which needs the
+        'postgres' extra. The Kubernetes secret of the stack, named by
+        CrczpTerraformBackend.get_stack_secret_name, has to be deleted by the caller.
+
         :param stack_name: Name of stack
         :return: None
         :raise CrczpException: Terraform workspace is not found
+        :raise TerraformWorkspaceFailed: The state of the stack could not be deleted
         """
         self.client_manager.delete_terraform_workspace(stack_name)
 
@@ -135,15 +359,98 @@ class CrczpTerraformClient:
 
         :return: List of Image objects.
         """
-        return self.cloud_client.list_images()
+        return self.cloud_cache.list_images()
 
-    def list_stacks(self) -> List[str]:
+    def list_stacks(self, states: List[CrczpTerraformStackState] = None, name_prefix: str = None,
+                    limit: int = None, after: str = None) -> List[str]:
         """
         List created Terraform stacks.
 
+        :param states: List only stacks in these states, all stacks if None
+        :param name_prefix: List only stacks whose name starts with the prefix
+        :param limit: The maximum number of listed stacks, all if None
+        :param after: List only stacks whose name follows this name, the last name of the previous page
         :return: The list containing stack names
+        :raise TerraformImproperlyConfigured: Stacks are filtered without the stack registry
+        """
+        return self.client_manager.list_stacks(states, name_prefix, limit, after)
+
+    def list_stack_records(self, states: List[CrczpTerraformStackState] = None, name_prefix: str = None,
+                           limit: int = None, after: str = None) -> List[TerraformStackRecord]:
+        """
+        List records of stacks in the stack registry ordered by name. The records contain state,
+        timestamps, template hash and the last read state serial of the stacks.
+
+        :param states: List only stacks in these states, all stacks if None
+        :param name_prefix: List only stacks whose name starts with the prefix
+        :param limit: The maximum number of listed stacks, all if None
+        :param after: List only stacks whose name follows this name, the last name of the previous page
+        :return: List of TerraformStackRecord objects
+        :raise TerraformImproperlyConfigured: The stack registry is disabled
+        """
+        return self.client_manager.list_stack_records(states, name_prefix, limit, after)
+
+    def get_stack_record(self, stack_name: str) -> Optional[TerraformStackRecord]:
         """
-        return self.client_manager.list_stacks()
+        Get record of the stack in the stack registry.
+
+        :param stack_name: The name of stack
+        :return: TerraformStackRecord object or None if the stack is not registered
+        :raise TerraformImproperlyConfigured: The stack registry is disabled
+        """
+        return self.client_manager.get_stack_record(stack_name)
+
+    def reconcile_stack_registry(self) -> Tuple[List[str], List[str]]:
+        """
+        Rebuild the stack registry from the stacks directory, e.g. after stack directories were
+        created or removed by other tools.
+
+        :return: Tuple of the names of registered and removed stacks
+        :raise TerraformImproperlyConfigured: The stack registry is disabled
+        """
+        return self.client_manager.reconcile_stack_registry()
+
+    def collect_garbage(self, dry_run: bool = False) -> TerraformGarbageCollectionReport:
+        """
+        Remove orphaned and stale stack directories and workspaces and reclaim Terraform data
+        and state copies of idle stacks.
+
+        :param dry_run: Only report what would be removed and cleaned
+        :return: TerraformGarbageCollectionReport object
+        :raise CrczpException: Workspaces of the shared backend could not be listed
+        """
+        return self.garbage_collector.collect(dry_run)
+
+    def start_garbage_collector(self, interval: float) -> None:
+        """
+        Collect garbage periodically in a background thread.
+
+        :param interval: Seconds between the runs
+        :return: None
+        """
+        self.garbage_collector.start(interval)
+
+    def stop_garbage_collector(self, timeout: float = None) -> None:
+        """
+        Stop the background garbage collection.
+
+        :param timeout: Seconds to wait for a running collection to stop
+        :return: None
+        """
+        self.garbage_collector.stop(timeout)
+
+    def close(self, timeout: float = None) -> None:
+        """
+        Stop the background garbage collection and close connections of the stack registry and
+        the state reader. They are opened again if the client is used later. A running collection
+        stops before its next action and results of commands which have already exited are
+        recorded first; running commands are not waited for.
+
+        :param timeout: Seconds to wait for each of the collection and the results, unlimited if None
+        :return: None
+        """
+        self.garbage_collector.stop(timeout)
+        self.client_manager.close(timeout)
 
     def get_topology_instance(self, topology_definition: TopologyDefinition,
                               containers: DockerContainers = None)\
@@ -180,7 +487,7 @@ class CrczpTerraformClient:
         :param image_id: The ID of image on the cloud
         :return: Image object
         """
-        return self.cloud_client.get_image(image_id)
+        return self.cloud_cache.get_image(image_id)
 
     def resume_node(self, stack_name: str, node_name: str) -> None:
         """
@@ -228,6 +535,19 @@ class CrczpTerraformClient:
         """
         return self.client_manager.get_node(stack_name, node_name)
 
+    def get_nodes(self, stack_name: str, node_names: List[str] = None,
+                  max_workers: int = DEFAULT_BATCH_WORKERS) -> Dict[str, TerraformInstance]:
+        """
+        Get data about multiple nodes of the stack at once.
+
+        :param stack_name: The name of stack
+        :param node_names: The names of nodes, all nodes of the stack if None
+        :param max_workers: The maximum number of concurrent cloud requests
+        :return: Dictionary of TerraformInstance objects keyed by node name
+        :raise KeyError: A node does not exist
+        """
+        return self.client_manager.get_nodes(stack_name, node_names, max_workers)
+
     def get_console_url(self, stack_name: str, node_name: str, console_type: str) -> str:
         """
         Get console url of a node.
@@ -248,6 +568,82 @@ class CrczpTerraformClient:
         """
         return self.client_manager.list_stack_resources(stack_name)
 
+    def list_resources_for_stacks(self, stack_names: List[str], max_workers: int = DEFAULT_BATCH_WORKERS,
+                                  resource_types: List[str] = None)\
+            -> Tuple[Dict[str, List[dict]], Dict[str, Exception]]:
+        """
+        List resources of multiple stacks at once. States are fetched concurrently and a failure
+        of one stack does not fail the others.
+
+        :param stack_names: The names of stacks
+        :param max_workers: The maximum number of states fetched concurrently
+        :param resource_types: Return only resources of these types, all managed resources if None
+        :return: Tuple of resources keyed by stack name and exceptions keyed by stack name
+        """
+        return self.client_manager.list_resources_for_stacks(stack_names, max_workers, resource_types)
+
+    def invalidate_stack_state(self, stack_name: str = None) -> None:
+        """
+        Drop cached Terraform state of the stack, so the next read pulls it from the backend.
+
+        :param stack_name: The name of stack, if None the whole cache is dropped
+        :return: None
+        """
+        if stack_name is None:
+            self.client_manager.state_cache.clear()
+        else:
+            self.client_manager.state_cache.invalidate(stack_name)
+
+    def get_state_cache_stats(self) -> CacheStats:
+        """
+        Get hit/miss counters of the Terraform state cache.
+
+        :return: CacheStats object
+        """
+        return self.client_manager.state_cache.get_stats()
+
+    def get_template_cache_stats(self) -> CacheStats:
+        """
+        Get hit/miss counters of the cache of rendered Terraform templates.
+
+        :return: CacheStats object
+        """
+        return self.client_manager.template_cache.get_stats()
+
+    def get_scheduler_stats(self) -> SchedulerStats:
+        """
+        Get queue depth, running commands and wait times of the 'tofu' command scheduler.
+
+        :return: SchedulerStats object
+        """
+        return self.client_manager.scheduler.get_stats()
+
+    def get_retry_stats(self) -> RetryStats:
+        """
+        Get counters of retried 'tofu' commands.
+
+        :return: RetryStats object
+        """
+        return self.client_manager.retry_policy.get_stats()
+
+    def invalidate_cloud_cache(self, kind: str = None, key: str = None) -> None:
+        """
+        Drop cached images, flavors, quotas or limits of the cloud project.
+
+        :param kind: One of 'image', 'images', 'flavors', 'quota_set' and 'limits', all if None
+        :param key: The ID of image if kind is 'image', all entries of the kind if None
+        :return: None
+        """
+        self.cloud_cache.invalidate(kind, key)
+
+    def get_cloud_cache_stats(self) -> Dict[str, CacheStats]:
+        """
+        Get hit/miss counters of the cloud catalog cache.
+
+        :return: Dictionary of CacheStats objects keyed by kind of lookup
+        """
+        return self.cloud_cache.get_stats()
+
     def create_keypair(self, name: str, public_key: str = None, key_type: str = 'ssh') -> None:
         """
         Create key pair in cloud.
@@ -280,13 +676,18 @@ class CrczpTerraformClient:
         """
         self.cloud_client.delete_keypair(name)
 
-    def get_quota_set(self) -> QuotaSet:
+    def get_quota_set(self, fresh: bool = True) -> QuotaSet:
         """
         Get quota set of cloud project.
 
+        :param fresh: Read the quota set from the cloud. If False, a quota set cached for up to
+            the 'quota_set' TTL of the cloud catalog cache may be returned, its usage may be stale,
+            so it must not be used for admission decisions
         :return: QuotaSet object
         """
-        return self.cloud_client.get_quota_set()
+        if fresh:
+            return self.cloud_client.get_quota_set()
+        return self.cloud_cache.get_quota_set()
 
     def get_project_name(self) -> str:
         """
@@ -306,7 +707,8 @@ class CrczpTerraformClient:
         :return: None
         :raise CrczpException: The cloud limits are exceeded
         """
-        quota_set = self.get_quota_set()
+        # Usage changes with every created or deleted stack, the cached quota set may be stale
+        quota_set = self.get_quota_set(fresh=True)
         hardware_usage = self.get_hardware_usage(topology_instance) * count
 
         quota_set.check_limits(hardware_usage)
@@ -326,7 +728,7 @@ class CrczpTerraformClient:
 
         :return: flavors dictionary
         """
-        return self.cloud_client.get_flavors_dict()
+        return self.cloud_cache.get_flavors_dict()
 
     def get_project_limits(self) -> Limits:
         """
@@ -334,4 +736,4 @@ class CrczpTerraformClient:
 
         :return: Limits object
         """
-        return self.cloud_client.get_project_limits()
+        return self.cloud_cache.get_project_limits()
@@ -1,8 +1,11 @@
 from enum import Enum
-from typing import Union, Dict
+from typing import Union, Dict, List, Optional
 
 from crczp.cloud_commons.cloud_client_elements import Image
 
+# Terraform resource types of compute instances created by the supported cloud clients
+INSTANCE_RESOURCE_TYPES = ('openstack_compute_instance_v2', 'aws_instance')
+
 
 class CrczpTerraformBackendType(Enum):
     LOCAL = 'local'
@@ -10,6 +13,26 @@ class CrczpTerraformBackendType(Enum):
     KUBERNETES = 'kubernetes'
 
 
+class CrczpTerraformStackLayout(Enum):
+    # Stacks share the backend configuration, every stack has its own Terraform workspace
+    WORKSPACE = 'workspace'
+    # Every stack directory has its own backend key or path, the default workspace is used
+    DIRECTORY = 'directory'
+
+
+class CrczpTerraformStackState(Enum):
+    # The stack directory is being prepared and initialized
+    INITIALIZING = 'initializing'
+    # 'tofu apply' of the stack is running
+    APPLYING = 'applying'
+    # The last 'tofu apply' succeeded
+    READY = 'ready'
+    # Initialization, 'tofu apply' or 'tofu destroy' of the stack failed
+    FAILED = 'failed'
+    # 'tofu destroy' of the stack is running or succeeded, the stack directory still exists
+    DESTROYING = 'destroying'
+
+
 class TerraformInstance:
     """
     Used to represent terraform stack instance
@@ -36,3 +59,206 @@ class TerraformInstance:
                "  image: {0.image},\n" \
                "  flavor_name: {0.flavor_name},\n" \
                "  links: {0.links}>\n".format(self)
+
+
+class TerraformState:
+    """
+    Used to represent parsed Terraform state of a stack
+    """
+
+    def __init__(self, serial: int, lineage: str, resources: List[dict]):
+        self.serial = serial
+        self.lineage = lineage
+        self.resources = resources
+        self._index: Optional[StackResourceIndex] = None
+
+    def get_index(self, stack_name: str) -> 'StackResourceIndex':
+        """
+        Get index of resources of the state, it is built only once.
+
+        :param stack_name: The name of stack the state belongs to
+        :return: StackResourceIndex object
+        """
+        index = self._index
+        if index is None or index.stack_name != stack_name:
+            index = StackResourceIndex(stack_name, self.resources)
+            self._index = index
+        return index
+
+    def __repr__(self):
+        return "<TerraformState\n" \
+               "  serial: {0.serial},\n" \
+               "  lineage: {0.lineage},\n" \
+               "  resources: {1}>\n".format(self, len(self.resources))
+
+
+class TerraformStackResult:
+    """
+    Used to represent result of an operation on a single stack of a batch
+    """
+
+    def __init__(self, stack_name: str, process=None, stdout: str = '', stderr: str = '',
+                 return_code: Optional[int] = None, error: Optional[Exception] = None):
+        self.stack_name = stack_name
+        self.process = process
+        self.stdout = stdout
+        self.stderr = stderr
+        self.return_code = return_code
+        self.error = error
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None and self.return_code == 0
+
+    def __repr__(self):
+        return "<TerraformStackResult\n" \
+               "  stack_name: {0.stack_name},\n" \
+               "  return_code: {0.return_code},\n" \
+               "  error: {0.error!r},\n" \
+               "  succeeded: {0.succeeded}>\n".format(self)
+
+
+class TerraformStackRecord:
+    """
+    Used to represent a stack in the stack registry
+    """
+
+    def __init__(self, name: str, state: CrczpTerraformStackState, created_at: float, updated_at: float,
+                 template_hash: Optional[str] = None, state_serial: Optional[int] = None,
+                 error: Optional[str] = None):
+        self.name = name
+        self.state = state
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.template_hash = template_hash
+        self.state_serial = state_serial
+        self.error = error
+
+    def __repr__(self):
+        return "<TerraformStackRecord\n" \
+               "  name: {0.name},\n" \
+               "  state: {0.state},\n" \
+               "  created_at: {0.created_at},\n" \
+               "  updated_at: {0.updated_at},\n" \
+               "  template_hash: {0.template_hash},\n" \
+               "  state_serial: {0.state_serial},\n" \
+               "  error: {0.error}>\n".format(self)
+
+
+class TerraformGarbageCollectionReport:
+    """
+    Used to represent result of a run of the garbage collector of stacks
+    """
+
+    def __init__(self, dry_run: bool = False):
+        self.dry_run = dry_run
+        self.scanned_stacks = 0
+        self.removed_stacks: List[str] = []
+        self.cleaned_stacks: List[str] = []
+        self.deleted_workspaces: List[str] = []
+        self.unregistered_stacks: List[str] = []
+        self.reclaimed_bytes = 0
+        self.errors: Dict[str, str] = {}
+        self.truncated = False
+        self.duration = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'dry_run': self.dry_run,
+            'scanned_stacks': self.scanned_stacks,
+            'removed_stacks': self.removed_stacks,
+            'cleaned_stacks': self.cleaned_stacks,
+            'deleted_workspaces': self.deleted_workspaces,
+            'unregistered_stacks': self.unregistered_stacks,
+            'reclaimed_bytes': self.reclaimed_bytes,
+            'errors': self.errors,
+            'truncated': self.truncated,
+            'duration': self.duration,
+        }
+
+    def __repr__(self):
+        return "<TerraformGarbageCollectionReport\n" \
+               "  dry_run: {0.dry_run},\n" \
+               "  scanned_stacks: {0.scanned_stacks},\n" \
+               "  removed_stacks: {0.removed_stacks},\n" \
+               "  cleaned_stacks: {0.cleaned_stacks},\n" \
+               "  deleted_workspaces: {0.deleted_workspaces},\n" \
+               "  unregistered_stacks: {0.unregistered_stacks},\n" \
+               "  reclaimed_bytes: {0.reclaimed_bytes},\n" \
+               "  errors: {0.errors},\n" \
+               "  truncated: {0.truncated},\n" \
+               "  duration: {0.duration}>\n".format(self)
+
+
+class IndexedResource:
+    """
+    Used to represent a Terraform resource with precomputed attributes used by the client
+    """
+
+    def __init__(self, resource: dict, local_name: str):
+        self.name = resource['name']
+        self.local_name = local_name
+        self.type = resource.get('type', '')
+        self.resource = resource
+        instances = resource.get('instances') or [{}]
+        self.attributes = instances[0].get('attributes', {})
+        self.id = self.attributes.get('id')
+        self.mac_address = self.attributes.get('mac_address')
+        self.networks = self.attributes.get('network') or []
+        block_device = self.attributes.get('block_device') or [{}]
+        self.block_device_uuid = block_device[0].get('uuid')
+
+    def __repr__(self):
+        return "<IndexedResource\n" \
+               "  name: {0.name},\n" \
+               "  type: {0.type},\n" \
+               "  id: {0.id}>\n".format(self)
+
+
+class StackResourceIndex:
+    """
+    Index of managed resources of a stack, built once per pulled Terraform state
+    """
+
+    def __init__(self, stack_name: str, resources: List[dict]):
+        self.stack_name = stack_name
+        prefix = f'{stack_name}-'
+        self.by_name: Dict[str, IndexedResource] = {}
+        self.by_local_name: Dict[str, IndexedResource] = {}
+        self.by_type: Dict[str, List[IndexedResource]] = {}
+        for resource in resources:
+            name = resource['name']
+            local_name = name[len(prefix):] if name.startswith(prefix) else None
+            indexed = IndexedResource(resource, local_name)
+            self.by_name[name] = indexed
+            if local_name is not None:
+                self.by_local_name[local_name] = indexed
+            self.by_type.setdefault(indexed.type, []).append(indexed)
+
+    def get(self, local_name: str) -> IndexedResource:
+        """
+        Get resource by the name of node or link without the stack prefix.
+
+        :param local_name: The name of node or link
+        :return: IndexedResource object
+        :raise KeyError: The resource does not exist
+        """
+        return self.by_local_name[local_name]
+
+    def list_by_type(self, resource_type: str) -> List[IndexedResource]:
+        """
+        List resources of the given type.
+
+        :param resource_type: Terraform resource type
+        :return: List of IndexedResource objects
+        """
+        return self.by_type.get(resource_type, [])
+
+    def list_instances(self) -> List[IndexedResource]:
+        """
+        List compute instances of the stack nodes.
+
+        :return: List of IndexedResource objects
+        """
+        return [resource for resource_type in INSTANCE_RESOURCE_TYPES
+                for resource in self.list_by_type(resource_type) if resource.local_name is not None]
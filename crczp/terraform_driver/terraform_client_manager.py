@@ -1,119 +1,1044 @@
-import json
+import contextlib
+import hashlib
 import os
 import shutil
+import sqlite3
 import subprocess
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
+import structlog
 from crczp.cloud_commons import CrczpCloudClientBase, StackNotFound, CrczpException, Image, TopologyInstance
 
-from crczp.terraform_driver.terraform_client_elements import TerraformInstance
+from crczp.terraform_driver.terraform_client_elements import TerraformInstance, TerraformState, \
+    TerraformStackResult, StackResourceIndex, IndexedResource, CrczpTerraformStackLayout, \
+    CrczpTerraformBackendType, CrczpTerraformStackState, TerraformStackRecord
+from crczp.terraform_driver.terraform_artifacts import TerraformArtifactRegistry, ARTIFACT_REGISTRY, \
+    ARTIFACT_PROVIDER
 from crczp.terraform_driver.terraform_backend import CrczpTerraformBackend, TERRAFORM_STATE_FILE_NAME
-from crczp.terraform_driver.terraform_exceptions import TerraformInitFailed, TerraformWorkspaceFailed
+from crczp.terraform_driver.terraform_cloud_cache import CloudCatalogCache
+from crczp.terraform_driver.terraform_exceptions import TerraformInitFailed, TerraformWorkspaceFailed, \
+    TerraformImproperlyConfigured
 from crczp.terraform_driver.terraform_exc_handlers import command_error_handler
+from crczp.terraform_driver.terraform_instrumentation import Instrumentation, NULL_INSTRUMENTATION, \
+    SPAN_KIND_STATE, CountingReader
+from crczp.terraform_driver.terraform_plugin_cache import TerraformPluginCache
+from crczp.terraform_driver.terraform_retry import RetryPolicy
+from crczp.terraform_driver.terraform_scheduler import TerraformCommandScheduler, PRIORITY_BULK
+from crczp.terraform_driver.terraform_process import TerraformProcess, TerraformOutputLine, STDOUT, \
+    DEFAULT_OUTPUT_BUFFER_SIZE, OUTPUT_LOG_FILE_NAME
+from crczp.terraform_driver.terraform_stack_lock import TerraformStackLocks, SingleFlight
+from crczp.terraform_driver.terraform_stack_registry import TerraformStackRegistry
+from crczp.terraform_driver.terraform_state_cache import TerraformStateCache
+from crczp.terraform_driver.terraform_template_cache import TemplateRenderCache, get_template_fingerprint, \
+    RESOURCE_PREFIX_ARGUMENT
+from crczp.terraform_driver.terraform_template_diff import TemplateDiff, diff_templates, get_init_dependencies
+from crczp.terraform_driver.terraform_state_parser import parse_terraform_state, STATE_READ_CHUNK_SIZE
+from crczp.terraform_driver.terraform_state_reader import PostgresTerraformStateReader
+
+LOG = structlog.get_logger()
 
 STACKS_DIR = '/var/tmp/crczp/terraform-stacks/'
 TEMPLATE_FILE_NAME = 'deploy.tf'
 TERRAFORM_BACKEND_FILE_NAME = 'backend.tf'
 TERRAFORM_PROVIDER_FILE_NAME = 'provider.tf'
+TERRAFORM_DATA_DIR = '.terraform'
+TERRAFORM_LOCK_FILE_NAME = '.terraform.lock.hcl'
+INIT_FINGERPRINT_FILE_NAME = 'crczp-init.fingerprint'
+# Copy of the template the stack was last successfully applied from, updates are compared with it
+APPLIED_TEMPLATE_FILE_NAME = 'crczp-applied.template'
 TERRAFORM_WORKSPACE_PATH = 'terraform.tfstate.d/{}/' + TERRAFORM_STATE_FILE_NAME
 TERRAFORM_DEFAULT_WORKSPACE = 'default'
-TERRAFORM_RETRY_NEW_WORKSPACE_COMMAND = 5
+TERRAFORM_ENVIRONMENT_FILE_NAME = 'environment'
+MIGRATION_STATE_FILE_NAME = 'crczp-migration.tfstate'
+# Directory configured only with the shared backend, used to manage workspaces of all stacks
+WORKSPACE_ADMIN_DIR_NAME = '.crczp-workspaces'
+DEFAULT_BATCH_WORKERS = 8
+STATE_SOURCE_BACKEND = 'backend'
+STATE_SOURCE_TOFU = 'tofu'
+# Commands changing the state of the stack, the cached state is invalidated when they exit
+STACK_MUTATING_COMMANDS = ('apply', 'destroy')
+
+
+def flatten_error_output(stderr: str) -> str:
+    """
+    Join lines of error output of a command into a single line.
+
+    :param stderr: The error output of the command
+    :return: The joined error output
+    """
+    return ''.join(stderr.split('\n'))
 
 
-class CrczpTerraformClientManager:
+class CrczpTerraformClientManagerBase:
     """
-    Manager class for CrczpTerraformClient
+    Base of the synchronous and asynchronous managers. Contains the steps of stack management
+    which do not execute 'tofu' commands, e.g. preparation of stack directories and commands and
+    records of stacks. The managers share components, so they can manage the same stacks.
     """
 
-    def __init__(self, stacks_dir, cloud_client: CrczpCloudClientBase, trc, template_file_name,
-                 terraform_backend: CrczpTerraformBackend):
+    def __init__(self, stacks_dir: str, cloud_client: CrczpCloudClientBase, trc, template_file_name: str,
+                 terraform_backend: CrczpTerraformBackend, state_cache: TerraformStateCache,
+                 plugin_cache: Optional[TerraformPluginCache], state_reader: Optional[PostgresTerraformStateReader],
+                 state_attributes: Optional[List[str]], scheduler: TerraformCommandScheduler,
+                 stack_locks: TerraformStackLocks, stack_layout: CrczpTerraformStackLayout,
+                 retry_policy: RetryPolicy, cloud_cache: CloudCatalogCache, template_cache: TemplateRenderCache,
+                 artifact_registry: TerraformArtifactRegistry, provider_key: Optional[str],
+                 instrumentation: Instrumentation, stack_registry: Optional[TerraformStackRegistry]):
+        self.stacks_dir = stacks_dir
         self.cloud_client = cloud_client
-        self.stacks_dir = stacks_dir if stacks_dir else STACKS_DIR
-        self.template_file_name = template_file_name if template_file_name else TEMPLATE_FILE_NAME
         self.trc = trc
-        self.create_directories(self.stacks_dir)
+        self.template_file_name = template_file_name
         self.terraform_backend = terraform_backend
+        self.state_cache = state_cache
+        self.plugin_cache = plugin_cache
+        self.state_reader = state_reader
+        self.state_attributes = state_attributes
+        self.scheduler = scheduler
+        self.stack_locks = stack_locks
+        self.stack_layout = stack_layout
+        self.retry_policy = retry_policy
+        self.cloud_cache = cloud_cache
+        self.template_cache = template_cache
+        self.artifact_registry = artifact_registry
+        self.provider_key = provider_key
+        self.instrumentation = instrumentation
+        self.stack_registry = stack_registry
+        self._terraform_provider: Optional[str] = None
+
+    def _record_stack_state(self, stack_name: str, state: CrczpTerraformStackState, template: str = None,
+                            error: str = None) -> None:
+        """
+        Record state of the stack in the stack registry. Failures of the registry are only logged,
+        the registry can be reconciled later.
+
+        :param stack_name: The name of Terraform stack
+        :param state: The new state
+        :param template: The template of the stack, its hash is recorded
+        :param error: Description of the failure of the stack
+        :return: None
+        """
+        if self.stack_registry is None:
+            return
+        template_hash = None if template is None else hashlib.sha256(template.encode()).hexdigest()
+        try:
+            self.stack_registry.set_state(stack_name, state, template_hash, error)
+        except sqlite3.Error as exc:
+            LOG.warning('Failed to record state of stack', stack_name=stack_name, state=state.value,
+                        error=str(exc))
+
+    def _track_stack_command(self, stack_name: str, command: List[str], state: CrczpTerraformStackState,
+                             template: str = None) -> Optional[Callable[[int], None]]:
+        """
+        Record that a long-running command of the stack starts.
+
+        :param stack_name: The name of Terraform stack
+        :param command: The command
+        :param state: State of the stack while the command runs, APPLYING or DESTROYING
+        :param template: The template the stack is applied from, stored as the applied template
+            if the command succeeds
+        :return: Callable recording the result of the command by its return code, None if there
+            is nothing to record
+        """
+        if self.stack_registry is None and template is None:
+            return None
+        self._record_stack_state(stack_name, state, template)
+
+        def on_result(return_code: int) -> None:
+            if not return_code and template is not None and state == CrczpTerraformStackState.APPLYING:
+                self._store_applied_template(stack_name, template)
+            if return_code:
+                self._update_stack_state(stack_name, CrczpTerraformStackState.FAILED,
+                                         error=f"'{' '.join(command[:2])}' exited with code {return_code}")
+            elif state == CrczpTerraformStackState.APPLYING:
+                self._update_stack_state(stack_name, CrczpTerraformStackState.READY)
+
+        return on_result
+
+    def _update_stack_state(self, stack_name: str, state: CrczpTerraformStackState, error: str = None) -> None:
+        """
+        Update state of the stack registered in the stack registry. Failures of the registry are
+        only logged, the registry can be reconciled later.
+
+        :param stack_name: The name of Terraform stack
+        :param state: The new state
+        :param error: Description of the failure of the stack
+        :return: None
+        """
+        if self.stack_registry is None:
+            return
+        try:
+            self.stack_registry.update_state(stack_name, state, error=error)
+        except sqlite3.Error as exc:
+            LOG.warning('Failed to record state of stack', stack_name=stack_name, state=state.value,
+                        error=str(exc))
+
+    def _store_applied_template(self, stack_name: str, template: str) -> None:
+        """
+        Store the template the stack was successfully applied from.
+
+        :param stack_name: The name of Terraform stack
+        :param template: The applied template
+        :return: None
+        """
+        try:
+            self.create_file(os.path.join(self.get_stack_dir(stack_name), APPLIED_TEMPLATE_FILE_NAME), template)
+        except OSError as exc:
+            LOG.warning('Failed to store applied template of stack', stack_name=stack_name, error=str(exc))
+
+    def _record_state_serial(self, stack_name: str, serial: int) -> None:
+        """
+        Record serial of the read Terraform state of the stack in the stack registry.
+
+        :param stack_name: The name of Terraform stack
+        :param serial: The serial of the state
+        :return: None
+        """
+        if self.stack_registry is None:
+            return
+        try:
+            self.stack_registry.set_state_serial(stack_name, serial)
+        except sqlite3.Error as exc:
+            LOG.warning('Failed to record serial of stack state', stack_name=stack_name, error=str(exc))
+
+    def _get_command_environment(self) -> Optional[Dict[str, str]]:
+        """
+        Get environment of 'tofu' commands.
+
+        :return: Dictionary of environment variables or None to inherit the current environment
+        """
+        if not self.plugin_cache:
+            return None
+        return dict(os.environ, **self.plugin_cache.get_environment())
+
+    @property
+    def uses_workspaces(self) -> bool:
+        return self.stack_layout == CrczpTerraformStackLayout.WORKSPACE
+
+    def _get_stack_backend(self, stack_name: str) -> str:
+        """
+        Get Terraform backend configuration of the stack according to the stack layout.
+
+        :param stack_name: The name of Terraform stack
+        :return: Terraform backend configuration
+        """
+        if self.uses_workspaces:
+            return self.terraform_backend.template
+        return self.terraform_backend.get_stack_template(stack_name)
+
+    def _create_terraform_backend_file(self, stack_dir: str, backend: str) -> None:
+        """
+        Create backend.tf file containing configuration for Terraform backend.
+
+        :param stack_dir: The path to the stack directory
+        :param backend: Terraform backend configuration
+        :return: None
+        """
+        self.create_file(os.path.join(stack_dir, TERRAFORM_BACKEND_FILE_NAME), backend)
+
+    def get_terraform_provider(self) -> str:
+        """
+        Get Terraform provider configuration of the cloud client. It is rendered once per process
+        for the same provider_key, or once per manager if the key is not set.
+
+        :return: Terraform provider configuration
+        """
+        if self.provider_key is not None:
+            return self.artifact_registry.get_artifact(ARTIFACT_PROVIDER, self.provider_key,
+                                                       self.cloud_client.get_terraform_provider)
+        if self._terraform_provider is None:
+            self._terraform_provider = self.cloud_client.get_terraform_provider()
+        return self._terraform_provider
+
+    def _create_terraform_provider(self, stack_dir: str, provider: str) -> None:
+        """
+        Create file with Terraform provider configuration.
+        :param stack_dir: The path to the stack directory
+        :param provider: Terraform provider configuration
+        :return: None
+        """
+        self.create_file(os.path.join(stack_dir, TERRAFORM_PROVIDER_FILE_NAME), provider)
+
+    def _get_init_fingerprint(self, stack_dir: str, backend: str, provider: str) -> str:
+        """
+        Get fingerprint of everything 'tofu init' depends on in the stack directory.
+
+        :param stack_dir: The path to the stack directory
+        :param backend: Terraform backend configuration
+        :param provider: Terraform provider configuration
+        :return: Hex digest of the fingerprint
+        """
+        digest = hashlib.sha256()
+        for content in (backend, provider):
+            digest.update(content.encode())
+            digest.update(b'\0')
+        try:
+            with open(os.path.join(stack_dir, self.template_file_name)) as file:
+                template = file.read()
+            # Only providers and modules of the template require 'tofu init' when changed
+            with contextlib.suppress(ValueError):
+                template = get_init_dependencies(template)
+            digest.update(template.encode())
+        except FileNotFoundError:
+            pass
+        digest.update(b'\0')
+        try:
+            with open(os.path.join(stack_dir, TERRAFORM_LOCK_FILE_NAME), 'rb') as file:
+                digest.update(file.read())
+        except FileNotFoundError:
+            pass
+        digest.update(b'\0')
+        return digest.hexdigest()
+
+    @staticmethod
+    def _read_init_fingerprint(stack_dir: str) -> str:
+        """
+        Read fingerprint stored by the last successful 'tofu init'.
+
+        :param stack_dir: The path to the stack directory
+        :return: The fingerprint or empty string if the directory is not initialized
+        """
+        try:
+            with open(os.path.join(stack_dir, TERRAFORM_DATA_DIR, INIT_FINGERPRINT_FILE_NAME)) as file:
+                return file.read()
+        except FileNotFoundError:
+            return ''
+
+    @staticmethod
+    def _remove_init_fingerprint(stack_dir: str) -> None:
+        """
+        Remove stored fingerprint, so the next initialization runs 'tofu init'.
+
+        :param stack_dir: The path to the stack directory
+        :return: None
+        """
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(stack_dir, TERRAFORM_DATA_DIR, INIT_FINGERPRINT_FILE_NAME))
+
+    def _prepare_stack_dir(self, stack_name: str, terraform_template: str = None,
+                           force_init: bool = False, provider: str = None)\
+            -> Optional[Tuple[str, str]]:
+        """
+        Create the stack directory and write Terraform configuration files which 'tofu init'
+        needs. Nothing but the template is written if the directory was already initialized
+        with the same configuration and lock file.
+
+        :param stack_name: The name of Terraform stack.
+        :param terraform_template: Terraform template specifying resources of the stack.
+        :param force_init: Require 'tofu init' even if the stack directory seems initialized.
+        :param provider: Already rendered Terraform provider configuration.
+        :return: Tuple of backend and provider configuration if 'tofu init' is required, else None
+        """
+        stack_dir = self.get_stack_dir(stack_name)
+        self.create_directories(stack_dir)
+        backend = self._get_stack_backend(stack_name)
+        if provider is None:
+            provider = self.get_terraform_provider()
+
+        if terraform_template:
+            self.create_file(os.path.join(stack_dir, self.template_file_name), terraform_template)
+
+        fingerprint = self._get_init_fingerprint(stack_dir, backend, provider)
+        if not force_init and fingerprint == self._read_init_fingerprint(stack_dir):
+            return None
+
+        self._remove_init_fingerprint(stack_dir)
+        self._create_terraform_backend_file(stack_dir, backend)
+        self._create_terraform_provider(stack_dir, provider)
+        return backend, provider
+
+    def _store_init_fingerprint(self, stack_dir: str, backend: str, provider: str) -> None:
+        """
+        Store fingerprint of the stack directory after successful 'tofu init'.
+
+        :param stack_dir: The path to the stack directory
+        :param backend: Terraform backend configuration
+        :param provider: Terraform provider configuration
+        :return: None
+        """
+        # 'tofu init' may create or update the lock file, so the fingerprint is computed again
+        self.create_directories(os.path.join(stack_dir, TERRAFORM_DATA_DIR))
+        self.create_file(os.path.join(stack_dir, TERRAFORM_DATA_DIR, INIT_FINGERPRINT_FILE_NAME),
+                         self._get_init_fingerprint(stack_dir, backend, provider))
+
+    def _is_stack_dir_selected(self, stack_name: str) -> bool:
+        """
+        Check, without changing the stack directory, that it is initialized with the current
+        configuration and the workspace of the stack is selected, so the state can be pulled
+        under the shared lock of the stack.
+
+        :param stack_name: The name of Terraform stack.
+        :return: True if the state can be pulled without initialization or switch of workspace
+        """
+        stack_dir = self.get_stack_dir(stack_name)
+        fingerprint = self._read_init_fingerprint(stack_dir)
+        if not fingerprint or fingerprint != self._get_init_fingerprint(
+                stack_dir, self._get_stack_backend(stack_name), self.get_terraform_provider()):
+            return False
+        if not self.uses_workspaces:
+            return True
+        try:
+            with open(os.path.join(stack_dir, TERRAFORM_DATA_DIR, TERRAFORM_ENVIRONMENT_FILE_NAME)) as file:
+                return file.read().strip() == stack_name
+        except FileNotFoundError:
+            return False
+
+    def _read_terraform_state_directly(self, stack_name: str) -> Optional[TerraformState]:
+        """
+        Read Terraform state of the stack from the backend storage without executing 'tofu'.
+
+        :param stack_name: The name of Terraform stack.
+        :return: TerraformState object or None if the state has to be pulled by 'tofu'
+        """
+        if self.state_reader is None:
+            return None
+        try:
+            return self.state_reader.read_state(stack_name)
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.warning('Failed to read Terraform state directly, falling back to tofu',
+                        stack_name=stack_name, error=str(exc))
+            return None
+
+    def _parse_pulled_state(self, stream) -> Tuple[Optional[TerraformState], Optional[ValueError]]:
+        """
+        Parse Terraform state from the output of 'tofu state pull'. If the state is invalid,
+        the rest of the output is read, so the command does not block on a full pipe.
+
+        :param stream: Text stream of the standard output of the command
+        :return: Tuple of TerraformState object and the parse error, one of them is None
+        """
+        try:
+            return parse_terraform_state(stream, self.state_attributes), None
+        except ValueError as exc:
+            while stream.read(STATE_READ_CHUNK_SIZE):
+                pass
+            return None, exc
+
+    @staticmethod
+    def _check_pulled_state(command: List[str], stack_name: str, stderr: str, return_code: int,
+                            parse_error: Optional[ValueError]) -> None:
+        """
+        Check result of 'tofu state pull'.
+
+        :param command: The executed command
+        :param stack_name: The name of Terraform stack
+        :param stderr: The error output of the command
+        :param return_code: The return code of the command
+        :param parse_error: The error raised by parsing of the output
+        :return: None
+        :raise CrczpException: The state could not be pulled or parsed
+        """
+        if return_code:
+            command_error_handler(CrczpException, 'Failed to pull Terraform state',
+                                  command=' '.join(command), stack_name=stack_name,
+                                  stderr=flatten_error_output(stderr))
+        if parse_error is not None:
+            command_error_handler(CrczpException, 'Failed to parse Terraform state',
+                                  command=' '.join(command), stack_name=stack_name,
+                                  error=str(parse_error))
+
+    @staticmethod
+    def _get_stack_command(action: str, json_output: bool = False) -> List[str]:
+        """
+        Get long-running command of the stack.
+
+        :param action: The 'tofu' subcommand, 'plan', 'apply' or 'destroy'
+        :param json_output: Produce machine-readable output
+        :return: The command
+        """
+        command = ['tofu', action]
+        if action in STACK_MUTATING_COMMANDS:
+            command += ['-auto-approve', '-no-color']
+        return command + (['-json'] if json_output else [])
 
     @staticmethod
-    def _execute_command(command: List[str], cwd: str, stdout=None, stderr=None)\
-            -> subprocess.Popen:
+    def create_directories(dir_path: str) -> None:
+        """
+        Create directory and all subdirectories defined in path.
+
+        :param dir_path: Directory path
+        :return: None
+        """
+        os.makedirs(dir_path, exist_ok=True)
+
+    @staticmethod
+    def create_file(file_path: str, content: str) -> None:
         """
-        Execute command in cwd and return subprocess.Popen object.
+        Create file and write content to it.
+
+        :param file_path: Path to the file
+        :param content: The content of the file
+        :return: None
+        """
+        with open(file_path, 'w') as file:
+            file.write(content)
+            file.flush()
+
+    def get_stack_dir(self, stack_name: str) -> str:
+        """
+        Get Terraform stack directory.
+
+        :param stack_name: The name of Terraform stack
+        :return: Path to the stack directory
+        """
+        return os.path.join(self.stacks_dir, stack_name)
+
+    def create_terraform_template(self, topology_instance: TopologyInstance, *args, **kwargs)\
+            -> str:
+        """
+        Create Terraform template.
+
+        :param topology_instance: The TopologyDefinition from which the template is created
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: Rendered Terraform template
+        :raise CrczpException: Invalid template of attributes.
+        """
+        fingerprint = get_template_fingerprint(topology_instance, self.trc, *args, **kwargs)
+        return self.template_cache.get_template(fingerprint, kwargs.get(RESOURCE_PREFIX_ARGUMENT),
+                                                self._get_template_renderer(topology_instance, *args, **kwargs))
+
+    def create_terraform_templates(self, topology_instance: TopologyInstance, stack_names: List[str],
+                                   *args, **kwargs) -> Dict[str, str]:
+        """
+        Create Terraform templates of multiple stacks. The template is rendered only once and
+        the resource prefix is substituted for every stack.
+
+        :param topology_instance: The TopologyDefinition from which the templates are created
+        :param stack_names: The names of stacks used as resource prefixes
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: Dictionary of rendered Terraform templates keyed by stack name
+        :raise CrczpException: Invalid template of attributes.
+        """
+        fingerprint = get_template_fingerprint(topology_instance, self.trc, *args, **kwargs)
+        return self.template_cache.get_templates(fingerprint, stack_names,
+                                                 self._get_template_renderer(topology_instance, *args, **kwargs))
+
+    def _get_template_renderer(self, topology_instance: TopologyInstance, *args, **kwargs)\
+            -> Callable[[Optional[str]], str]:
+        """
+        Get callable rendering Terraform template with the given resource prefix.
+
+        :param topology_instance: The TopologyDefinition from which the template is created
+        :param args, kwargs: Other attributes required for rendering of template
+        :return: Callable taking resource prefix, the default of the cloud client if None
+        """
+        attributes = {key: value for key, value in kwargs.items() if key != RESOURCE_PREFIX_ARGUMENT}
+
+        def render(resource_prefix: Optional[str]) -> str:
+            prefix = {} if resource_prefix is None else {RESOURCE_PREFIX_ARGUMENT: resource_prefix}
+            return self.cloud_client.create_terraform_template(topology_instance, *args, **attributes, **prefix)
+
+        return render
+
+    def _read_applied_template(self, stack_name: str) -> Optional[str]:
+        """
+        Read the template the stack was last successfully applied from.
+
+        :param stack_name: The name of the stack
+        :return: The template or None if no apply of the stack is known to have succeeded
+        :raise StackNotFound: The stack directory does not exist
+        """
+        stack_dir = self.get_stack_dir(stack_name)
+        try:
+            with open(os.path.join(stack_dir, APPLIED_TEMPLATE_FILE_NAME)) as file:
+                return file.read()
+        except FileNotFoundError as exc:
+            if not os.path.isdir(stack_dir):
+                raise StackNotFound(f'Stack {stack_name} does not exist') from exc
+            return None
+
+    def _prepare_stack_update(self, stack_name: str, terraform_template: str, targeted: bool,
+                              json_output: bool) -> Optional[List[str]]:
+        """
+        Store the new template of the stack and create the apply command of the update.
+
+        :param stack_name: The name of the stack
+        :param terraform_template: The new template of the stack
+        :param targeted: Apply only the affected resources
+        :param json_output: Produce machine-readable output
+        :return: The apply command or None if the template is unchanged
+        :raise StackNotFound: The stack directory does not exist
+        """
+        # The stored template is written before the apply, which may have failed since
+        old_template = self._read_applied_template(stack_name)
+        if old_template is None:
+            LOG.info('No applied template of the stack, the whole stack is applied', stack_name=stack_name)
+            diff = None
+        else:
+            try:
+                diff = diff_templates(old_template, terraform_template)
+            except ValueError as exc:
+                LOG.warning('Failed to compare templates, the whole stack is applied', stack_name=stack_name,
+                            error=str(exc))
+                diff = None
+        if diff is not None and diff.is_empty and targeted:
+            LOG.info('Template of the stack is unchanged', stack_name=stack_name)
+            return None
+
+        self.state_cache.invalidate(stack_name)
+        self.create_file(os.path.join(self.get_stack_dir(stack_name), self.template_file_name), terraform_template)
+        command = self._get_stack_command('apply', json_output)
+        if not targeted or diff is None or diff.requires_full_apply:
+            LOG.info('Updating the whole stack', stack_name=stack_name)
+            return command
+
+        command += [f'-target={target}' for target in diff.targets]
+        if diff.only_additions:
+            command.append('-refresh=false')
+        LOG.info('Updating stack resources', stack_name=stack_name, targets=diff.targets)
+        return command
+
+    def _delete_stack_state(self, stack_name: str) -> None:
+        """
+        Delete state of the stack of the directory stack layout stored in the remote backend.
+
+        The Postgres schema of the stack is dropped, which needs the psycopg2 driver. The state
+        of the local backend is removed with the stack directory. The Kubernetes secret named by
+        CrczpTerraformBackend.get_stack_secret_name is not deleted, the client has no access to
+        the Kubernetes API, so it has to be deleted by the caller.
+
+        :param stack_name: The name of Terraform stack
+        :return: None
+        :raise TerraformWorkspaceFailed: The schema of the stack could not be dropped
+        """
+        backend_type = self.terraform_backend.backend_type
+        if backend_type == CrczpTerraformBackendType.KUBERNETES:
+            LOG.warning('State secret of the stack has to be deleted by the caller', stack_name=stack_name,
+                        secret=self.terraform_backend.get_stack_secret_name(stack_name),
+                        namespace=self.terraform_backend.kube_namespace)
+            return
+        if backend_type != CrczpTerraformBackendType.POSTGRES:
+            return
+
+        schema = self.terraform_backend.get_stack_schema_name(stack_name)
+        state_reader = self.state_reader or PostgresTerraformStateReader.from_db_configuration(
+            self.terraform_backend.db_configuration, stack_schema=self.terraform_backend.get_stack_schema_name)
+        if state_reader is None:
+            LOG.warning('psycopg2 is not installed, schema of the stack is not dropped', stack_name=stack_name,
+                        schema=schema)
+            return
+        try:
+            state_reader.drop_stack_schema(stack_name)
+        except Exception as exc:  # pylint: disable=broad-except
+            command_error_handler(TerraformWorkspaceFailed, 'Failed to drop schema of the stack',
+                                  stack_name=stack_name, schema=schema, error=str(exc))
+        finally:
+            if state_reader is not self.state_reader:
+                state_reader.close()
+
+    def _record_deleted_workspace(self, stack_name: str) -> None:
+        """
+        Record in the stack registry that the state of the stack was deleted with its workspace,
+        only the stack directory remains.
+
+        :param stack_name: The name of Terraform stack
+        :return: None
+        """
+        self._update_stack_state(stack_name, CrczpTerraformStackState.DESTROYING)
+
+    def get_image(self, image_id) -> Image:
+        """
+        Get image data from cloud.
+
+        :param image_id: ID of image
+        :return: The image data as Image object
+        """
+        return self.cloud_cache.get_image(image_id)
+
+    @staticmethod
+    def _select_node_resources(index: StackResourceIndex, node_names: Optional[List[str]])\
+            -> Dict[str, IndexedResource]:
+        """
+        Select indexed resources of nodes.
+
+        :param index: Resource index of the stack
+        :param node_names: The names of nodes, all compute instances of the stack if None
+        :return: Dictionary of IndexedResource objects keyed by node name
+        :raise KeyError: A node does not exist
+        """
+        if node_names is None:
+            return {resource.local_name: resource for resource in index.list_instances()}
+        return {node_name: index.get(node_name) for node_name in node_names}
+
+    def _create_terraform_instances(self, resources: Dict[str, IndexedResource],
+                                    max_workers: int = DEFAULT_BATCH_WORKERS) -> Dict[str, TerraformInstance]:
+        """
+        Create TerraformInstance objects of multiple nodes, requesting node details concurrently
+        and every distinct image only once.
+
+        :param resources: Indexed Terraform resources keyed by node name
+        :param max_workers: The maximum number of concurrent cloud requests
+        :return: Dictionary of TerraformInstance objects keyed by node name
+        """
+        if not resources:
+            return {}
+
+        workers = max(1, min(max_workers, len(resources)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            details = dict(zip(resources, executor.map(
+                lambda resource: self.cloud_client.get_node_details(resource.attributes), resources.values())))
+            image_ids = {node_name: self._get_node_image_id(resources[node_name], node_details)
+                         for node_name, node_details in details.items()}
+            distinct_image_ids = list(dict.fromkeys(image_ids.values()))
+            images = dict(zip(distinct_image_ids, executor.map(self.get_image, distinct_image_ids)))
+
+        return {node_name: self._build_terraform_instance(node_name, resource, details[node_name],
+                                                          images[image_ids[node_name]])
+                for node_name, resource in resources.items()}
+
+    def _create_terraform_instance(self, node_name: str, resource: IndexedResource) -> TerraformInstance:
+        """
+        Create TerraformInstance from Terraform attributes of the node and its cloud details.
+
+        :param node_name: The name of node
+        :param resource: Indexed Terraform resource of the node
+        :return: TerraformInstance object
+        """
+        node_details = self.cloud_client.get_node_details(resource.attributes)
+        image = self.get_image(self._get_node_image_id(resource, node_details))
+        return self._build_terraform_instance(node_name, resource, node_details, image)
+
+    @staticmethod
+    def _get_node_image_id(resource: IndexedResource, node_details) -> str:
+        """
+        Get ID of the image the node was booted from.
+
+        :param resource: Indexed Terraform resource of the node
+        :param node_details: Details of the node returned by the cloud client
+        :return: The ID of image
+        :raise CrczpException: The image ID could not be retrieved
+        """
+        image_id = node_details.image_id
+        if image_id == "Attempt to boot from volume - no image supplied":
+            if resource.block_device_uuid:
+                image_id = resource.block_device_uuid
+            else:
+                raise CrczpException('Image id could not be retrieved from the node')
+        return image_id
+
+    @staticmethod
+    def _build_terraform_instance(node_name: str, resource: IndexedResource, node_details,
+                                  image: Image) -> TerraformInstance:
+        """
+        Build TerraformInstance from the indexed resource, cloud details and image of the node.
+
+        :param node_name: The name of node
+        :param resource: Indexed Terraform resource of the node
+        :param node_details: Details of the node returned by the cloud client
+        :param image: Image of the node
+        :return: TerraformInstance object
+        """
+        status = node_details.status
+        flavor = node_details.flavor
+        instance = TerraformInstance(name=node_name, instance_id=resource.id,
+                                     status=status, image=image,
+                                     flavor_name=flavor)
+
+        for network in resource.networks:
+            name = network['name']
+            link = {key: value for key, value in network.items() if key != 'name'}
+            instance.add_link(name, link)
+
+        return instance
+
+    def _enrich_topology_instance(self, stack_name: str, topology_instance: TopologyInstance,
+                                  index: StackResourceIndex) -> TopologyInstance:
+        """
+        Enrich TopologyInstance with data of stack resources.
+
+        :param stack_name: The name of stack
+        :param topology_instance: The TopologyInstance
+        :param index: Index of resources of the stack
+        :return: TopologyInstance with additional properties
+        """
+        topology_instance.name = stack_name
+
+        man_out_port = index.get(self.trc.man_out_port)
+        topology_instance.ip = self.cloud_client.get_private_ip(man_out_port.attributes)
+
+        for link in topology_instance.get_links():
+            port = index.get(link.name)
+            link.ip = self.cloud_client.get_private_ip(port.attributes)
+            link.mac = port.mac_address
+
+        return topology_instance
+
+
+class CrczpTerraformClientManager(CrczpTerraformClientManagerBase):
+    """
+    Manager class for CrczpTerraformClient
+    """
+
+    def __init__(self, stacks_dir, cloud_client: CrczpCloudClientBase, trc, template_file_name,
+                 terraform_backend: CrczpTerraformBackend, state_cache: TerraformStateCache = None,
+                 plugin_cache: TerraformPluginCache = None, spool_output: bool = False,
+                 output_buffer_size: int = DEFAULT_OUTPUT_BUFFER_SIZE,
+                 state_reader: PostgresTerraformStateReader = None, state_attributes: List[str] = None,
+                 scheduler: TerraformCommandScheduler = None, stack_locks: TerraformStackLocks = None,
+                 stack_layout: CrczpTerraformStackLayout = CrczpTerraformStackLayout.WORKSPACE,
+                 retry_policy: RetryPolicy = None, cloud_cache: CloudCatalogCache = None,
+                 template_cache: TemplateRenderCache = None,
+                 artifact_registry: TerraformArtifactRegistry = ARTIFACT_REGISTRY, provider_key: str = None,
+                 instrumentation: Instrumentation = None, stack_registry: TerraformStackRegistry = None):
+        stacks_dir = stacks_dir if stacks_dir else STACKS_DIR
+        self.create_directories(stacks_dir)
+        super().__init__(
+            stacks_dir, cloud_client, trc, template_file_name if template_file_name else TEMPLATE_FILE_NAME,
+            terraform_backend, state_cache if state_cache is not None else TerraformStateCache(), plugin_cache,
+            state_reader, state_attributes, scheduler if scheduler is not None else TerraformCommandScheduler(),
+            stack_locks if stack_locks is not None else TerraformStackLocks(), stack_layout,
+            retry_policy if retry_policy is not None else RetryPolicy(),
+            cloud_cache if cloud_cache is not None else CloudCatalogCache(cloud_client),
+            template_cache if template_cache is not None else TemplateRenderCache(), artifact_registry,
+            provider_key, instrumentation if instrumentation is not None else NULL_INSTRUMENTATION, stack_registry)
+        self.spool_output = spool_output
+        self.output_buffer_size = output_buffer_size
+        self._state_loads = SingleFlight()
+        if self.stack_registry is not None and self.stack_registry.initialize():
+            # Stacks created before the registry existed
+            self.reconcile_stack_registry()
+
+    def _execute_command(self, command: List[str], cwd: str, stdout=None, stderr=None,
+                         on_exit: Callable[[subprocess.Popen], None] = None) -> subprocess.Popen:
+        """
+        Execute command in cwd and return subprocess.Popen object. The command is started
+        once the scheduler has a free slot for it.
 
         :param command: Command to execute
         :param cwd: Working directory
         :param stdout: Redirect stdout to file
         :param stderr: Redirect stderr to file
+        :param on_exit: Callable called with the process after it exits
         :return: subprocess.Popen object
+        :raise TerraformCommandQueueTimeout: No slot of the scheduler was free in time
         """
-        return subprocess.Popen(command + ['-no-color'], cwd=cwd, stdout=stdout, stderr=stderr,
-                                text=True)
+        env = self._get_command_environment()
+        return self.scheduler.start(
+            command, lambda: subprocess.Popen(command + ['-no-color'], cwd=cwd, stdout=stdout,
+                                              stderr=stderr, text=True, env=env),
+            on_exit=on_exit)
 
-    def _create_terraform_backend_file(self, stack_dir: str) -> None:
+    def _run_command(self, command: List[str], cwd: str, **log_context) -> Tuple[str, str, int]:
         """
-        Create backend.tf file containing configuration for Terraform backend.
+        Execute command in cwd and wait for it to finish. The command is repeated according to
+        the retry policy if it fails with a transient error.
 
-        :param stack_dir: The path to the stack directory
-        :return: None
+        :param command: Command to execute
+        :param cwd: Working directory
+        :param log_context: Values logged with retries
+        :return: Tuple of stdout, stderr and return code of the last attempt
         """
-        template = self.terraform_backend.template
+        def attempt() -> Tuple[str, str, int]:
+            with self.instrumentation.command_span(command, **log_context) as span:
+                process = self._execute_command(command, cwd=cwd, stdout=subprocess.PIPE,
+                                                stderr=subprocess.PIPE)
+                stdout, stderr, return_code = self._communicate(process)
+                span.set(exit_code=return_code, output_bytes=len(stdout) + len(stderr))
+                return stdout, stderr, return_code
+
+        # Errors are classified before their lines are joined, which would merge words across lines
+        stdout, stderr, return_code = self.retry_policy.execute(attempt, command=' '.join(command), **log_context)
+        return stdout, flatten_error_output(stderr), return_code
+
+    def _start_stack_command(self, command: List[str], stack_name: str,
+                             on_result: Callable[[int], None] = None) -> TerraformProcess:
+        """
+        Start long-running command in the stack directory.
 
-        self.create_file(os.path.join(stack_dir, TERRAFORM_BACKEND_FILE_NAME), template)
+        :param command: Command to execute
+        :param stack_name: The name of Terraform stack
+        :param on_result: Callable called with the return code after the process exits
+        :return: TerraformProcess object
+        """
+        stack_dir = self.get_stack_dir(stack_name)
+        log_path = None
+        if self.spool_output:
+            log_path = os.path.join(stack_dir, OUTPUT_LOG_FILE_NAME.format(command[1]))
+        on_exit = None
+        span = self.instrumentation.command_span(command, stack_name=stack_name)
+        started: List[TerraformProcess] = []
+        mutates_stack = command[1] in STACK_MUTATING_COMMANDS
+        if self.instrumentation.enabled or on_result is not None or mutates_stack:
+            def on_exit(process: subprocess.Popen) -> None:
+                if mutates_stack:
+                    # State read while the command was running is partial
+                    self.state_cache.invalidate(stack_name)
+                # Output read by the time the process exited
+                span.finish(exit_code=process.returncode,
+                            output_bytes=started[0].output_bytes if started else None)
+                if on_result is not None:
+                    on_result(process.returncode)
 
-    def _create_terraform_provider(self, stack_dir) -> None:
+        process = self._execute_command(command, cwd=stack_dir, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, on_exit=on_exit)
+        terraform_process = TerraformProcess(process, command, stack_name, self.output_buffer_size, log_path)
+        started.append(terraform_process)
+        return terraform_process
+
+    def _initialize_stack_dir(self, stack_name: str, terraform_template: str = None,
+                              force_init: bool = False, provider: str = None) -> bool:
         """
-        Create file with Terraform provider configuration.
-        :param stack_dir: The path to the stack directory
+        Create Terraform configuration files and initialize the stack directory.
+
+        Writing of backend and provider files and 'tofu init' are skipped if the directory
+        was already initialized with the same configuration and lock file.
+
+        :param stack_name: The name of Terraform stack.
+        :param terraform_template: Terraform template specifying resources of the stack.
+        :param force_init: Run 'tofu init' even if the stack directory seems initialized.
+        :param provider: Already rendered Terraform provider configuration.
+        :return: True if 'tofu init' was executed, False if it was skipped
+        :raise TerraformInitFailed: The 'terraform init' command fails.
+        """
+        configuration = self._prepare_stack_dir(stack_name, terraform_template, force_init, provider)
+        if configuration is None:
+            return False
+
+        stack_dir = self.get_stack_dir(stack_name)
+        self.init_terraform(stack_dir, stack_name)
+        self._store_init_fingerprint(stack_dir, *configuration)
+        return True
+
+    def _select_stack_workspace(self, stack_name: str) -> None:
+        """
+        Initialize the stack directory and switch to the workspace of the stack. If the switch
+        fails in a directory whose initialization was skipped, it is initialized again.
+        In the directory stack layout, the directory is only initialized.
+
+        :param stack_name: The name of Terraform stack.
         :return: None
+        :raise TerraformInitFailed: The 'terraform init' command fails.
+        :raise TerraformWorkspaceFailed: Could not switch the workspace.
         """
-        provider = self.cloud_client.get_terraform_provider()
+        stack_dir = self.get_stack_dir(stack_name)
+        initialized = self._initialize_stack_dir(stack_name)
+        if not self.uses_workspaces:
+            return
+        try:
+            self._switch_terraform_workspace(stack_name, stack_dir)
+        except TerraformWorkspaceFailed:
+            if initialized:
+                raise
+            self._initialize_stack_dir(stack_name, force_init=True)
+            self._switch_terraform_workspace(stack_name, stack_dir)
 
-        self.create_file(os.path.join(stack_dir, TERRAFORM_PROVIDER_FILE_NAME), provider)
+    def _prepare_state_pull(self, stack_name: str) -> None:
+        """
+        Initialize the stack directory and switch to the workspace of the stack, the caller holds
+        the write lock of the stack.
+
+        :param stack_name: The name of Terraform stack.
+        :return: None
+        :raise TerraformInitFailed: The 'terraform init' command fails.
+        :raise CrczpException: Could not switch the workspace.
+        """
+        try:
+            self._select_stack_workspace(stack_name)
+        except TerraformWorkspaceFailed:
+            raise CrczpException('Failed to switch Terraform workspace')
+
+    def _pull_terraform_state(self, stack_name: str, select_workspace: bool = True) -> TerraformState:
+        """
+        Pull Terraform state from remote backend. The state is parsed directly from the output
+        of 'tofu state pull', only managed resources are kept.
+
+        :param stack_name: The name of Terraform stack.
+        :param select_workspace: Initialize the stack directory and switch to the workspace of the
+            stack first, it requires the write lock of the stack
+        :return: TerraformState object
+        """
+        stack_dir = self.get_stack_dir(stack_name)
+        if select_workspace:
+            self._prepare_state_pull(stack_name)
+
+        command = ['tofu', 'state', 'pull']
+
+        def attempt() -> Tuple[tuple, str, int]:
+            with self.instrumentation.command_span(command, stack_name=stack_name) as span:
+                process = self._execute_command(command, cwd=stack_dir, stdout=subprocess.PIPE,
+                                                stderr=subprocess.PIPE)
+                stream = CountingReader(process.stdout) if self.instrumentation.enabled else process.stdout
+                pulled_state, error = self._parse_pulled_state(stream)
+                _, pull_stderr, pull_return_code = self._communicate(process)
+                span.set(exit_code=pull_return_code, output_bytes=getattr(stream, 'count', None),
+                         parse_error=None if error is None else str(error))
+                return (pulled_state, error), pull_stderr, pull_return_code
+
+        (state, parse_error), stderr, return_code = self.retry_policy.execute(
+            attempt, command=' '.join(command), stack_name=stack_name)
+        self._check_pulled_state(command, stack_name, stderr, return_code, parse_error)
+        return state
+
+    def _get_terraform_state(self, stack_name: str) -> TerraformState:
+        """
+        Get parsed Terraform state of the stack. The state is pulled from the remote backend
+        only if it is not cached.
+
+        :param stack_name: The name of Terraform stack.
+        :return: TerraformState object
+        """
+        state = self.state_cache.get(stack_name)
+        if state is not None:
+            return state
+        return self._load_terraform_state(stack_name)
 
-    def _initialize_stack_dir(self, stack_name: str, terraform_template: str = None) -> None:
+    def _load_terraform_state(self, stack_name: str) -> TerraformState:
         """
+        Read Terraform state of the stack from the backend and store it in the cache.
+        Concurrent loads of the same stack share a single read.
 
         :param stack_name: The name of Terraform stack.
-        :param terraform_template: Terraform template specifying resources of the stack.
-        :return: None
-        :raise CrczpException: If should_raise is True and Terraform command fails.
+        :return: TerraformState object
         """
-        stack_dir = self.get_stack_dir(stack_name)
-        self.create_directories(stack_dir)
-        self._create_terraform_backend_file(stack_dir)
-        self._create_terraform_provider(stack_dir)
-
-        if terraform_template:
-            self.create_file(os.path.join(stack_dir, self.template_file_name), terraform_template)
-
-        self.init_terraform(stack_dir, stack_name)
+        return self._state_loads.run(stack_name, self._read_terraform_state, stack_name)
 
-    def _pull_terraform_state(self, stack_name: str) -> None:
+    def _read_terraform_state(self, stack_name: str) -> TerraformState:
         """
-        Pull Terraform state from remote backend.
+        Read Terraform state of the stack under the shared lock of the stack and cache it.
+        If the stack directory has to be initialized or switched to the workspace of the stack
+        first, it is done under the write lock of the stack.
 
         :param stack_name: The name of Terraform stack.
-        :return: None
+        :return: TerraformState object
         """
-        self._initialize_stack_dir(stack_name)
-        stack_dir = self.get_stack_dir(stack_name)
-        try:
-            self._switch_terraform_workspace(stack_name, stack_dir)
-        except TerraformWorkspaceFailed:
-            raise CrczpException('Failed to switch Terraform workspace')
-
-        terraform_state_file_path = os.path.join(stack_dir, TERRAFORM_STATE_FILE_NAME)
-        terraform_state_file = open(terraform_state_file_path, 'w')
-        command = ['tofu', 'state', 'pull']
-        process = self._execute_command(command, cwd=stack_dir, stdout=terraform_state_file,
-                                        stderr=subprocess.PIPE)
-        _, stderr, return_code = self.wait_for_process(process)
-        if return_code:
-            command_error_handler(CrczpException, 'Failed to pull Terraform state',
-                                  command=' '.join(command), stack_name=stack_name, stderr=stderr)
+        with self.instrumentation.span('load state', SPAN_KIND_STATE, stack_name=stack_name) as span:
+            with self.stack_locks.read(stack_name):
+                state, source = self._read_terraform_state_locked(stack_name)
+            if state is None:
+                # 'tofu init' and the switch of workspace change the stack directory
+                with self.stack_locks.write(stack_name):
+                    self._prepare_state_pull(stack_name)
+                with self.stack_locks.read(stack_name):
+                    state, source = self._read_terraform_state_locked(stack_name)
+            if state is None:
+                # The stack directory was changed again meanwhile
+                with self.stack_locks.write(stack_name):
+                    self._prepare_state_pull(stack_name)
+                    state, source = self._read_terraform_state_locked(stack_name, prepared=True)
+            span.set(source=source, resources=len(state.resources))
+        self._record_state_serial(stack_name, state.serial)
+        return state
+
+    def _read_terraform_state_locked(self, stack_name: str, prepared: bool = False)\
+            -> Tuple[Optional[TerraformState], str]:
+        """
+        Read Terraform state of the stack and cache it, the caller holds a lock of the stack.
 
-        terraform_state_file.flush()
-        terraform_state_file.close()
+        :param stack_name: The name of Terraform stack.
+        :param prepared: The stack directory was prepared for the pull under the held lock
+        :return: Tuple of TerraformState object and its source, the state is None if the stack
+            directory has to be prepared first
+        """
+        generation = self.state_cache.generation(stack_name)
+        state = self._read_terraform_state_directly(stack_name)
+        if state is not None:
+            self.state_cache.put(stack_name, state, generation)
+            return state, STATE_SOURCE_BACKEND
+        if not prepared and not self._is_stack_dir_selected(stack_name):
+            return None, STATE_SOURCE_TOFU
+        state = self._pull_terraform_state(stack_name, select_workspace=False)
+        self.state_cache.put(stack_name, state, generation)
+        return state, STATE_SOURCE_TOFU
 
     def _switch_terraform_workspace(self, workspace: str, stack_dir: str) -> None:
         """
@@ -124,36 +1049,11 @@ class CrczpTerraformClientManager:
         :return: None
         """
         command = ['tofu', 'workspace', 'select', workspace]
-        process = self._execute_command(command, cwd=stack_dir, stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE)
-        _, stderr, return_code = self.wait_for_process(process)
+        _, stderr, return_code = self._run_command(command, stack_dir, workspace=workspace)
         if return_code:
             command_error_handler(TerraformWorkspaceFailed, 'Failed to switch Terraform workspace',
                                   command=' '.join(command), workspace=workspace, stderr=stderr)
 
-    @staticmethod
-    def create_directories(dir_path: str) -> None:
-        """
-        Create directory and all subdirectories defined in path.
-
-        :param dir_path: Directory path
-        :return: None
-        """
-        os.makedirs(dir_path, exist_ok=True)
-
-    @staticmethod
-    def create_file(file_path: str, content: str) -> None:
-        """
-        Create file and write content to it.
-
-        :param file_path: Path to the file
-        :param content: The content of the file
-        :return: None
-        """
-        with open(file_path, 'w') as file:
-            file.write(content)
-            file.flush()
-
     @staticmethod
     def remove_directory(dir_path: str) -> None:
         """
@@ -172,12 +1072,23 @@ class CrczpTerraformClientManager:
     def wait_for_process(process, timeout=None) -> Tuple[str, str, int]:
         """
         Wait for process to finish and return stdout, stderr and return code.
+        :param process: The process to wait for
+        :param timeout: The timeout in seconds
+        :return: Tuple of stdout, stderr and return code
+        """
+        stdout, stderr, return_code = CrczpTerraformClientManager._communicate(process, timeout)
+        return stdout, flatten_error_output(stderr), return_code
+
+    @staticmethod
+    def _communicate(process, timeout=None) -> Tuple[str, str, int]:
+        """
+        Wait for process to finish and return stdout, stderr with its lines kept and return code.
+
         :param process: The process to wait for
         :param timeout: The timeout in seconds
         :return: Tuple of stdout, stderr and return code
         """
         stdout, stderr = process.communicate(timeout=timeout)
-        stderr = ''.join(stderr.split('\n'))
         return_code = process.returncode
         if process.stdout:
             process.stdout.close()
@@ -196,36 +1107,85 @@ class CrczpTerraformClientManager:
         :param process: The process creating output
         :return: Standard output of process line by line
         """
+        if isinstance(process, TerraformProcess):
+            # Stderr is consumed at the same time, so the process cannot block on it
+            for output_line in process.stream_output():
+                if output_line.stream == STDOUT:
+                    yield output_line.line + '\n'
+            return
         for stdout_line in iter(process.stdout.readline, ''):
             yield stdout_line
 
-    def get_stack_dir(self, stack_name: str) -> str:
+    @staticmethod
+    def stream_process_output(process, timeout: float = None) -> Iterator[TerraformOutputLine]:
         """
-        Get Terraform stack directory.
+        Stream stdout and stderr of process at the same time.
 
-        :param stack_name: The name of Terraform stack
-        :return: Path to the stack directory
+        :param process: The process creating output
+        :param timeout: The timeout in seconds for the whole output
+        :return: TerraformOutputLine objects as they are produced
         """
-        return os.path.join(self.stacks_dir, stack_name)
+        if not isinstance(process, TerraformProcess):
+            process = TerraformProcess(process)
+        return process.stream_output(timeout)
 
-    def init_terraform(self, stack_dir: str, stack_name: str) -> None:
+    def init_terraform(self, stack_dir: str, stack_name: str, reconfigure: bool = False) -> None:
         """
         Initialize Terraform properties in stack directory.
 
         :param stack_dir: Path to the stack directory
         :param stack_name: The name of Terraform stack
+        :param reconfigure: Ignore the previous backend configuration of the directory
         :return: None
         :raise TerraformInitFailed: The 'terraform init' command fails.
         :raise TerraformWorkspaceFailed: Could not create new workspace.
         """
-        command = ['tofu', 'init']
-        process = self._execute_command(command, cwd=stack_dir,
-                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _, stderr, return_code = self.wait_for_process(process)
+        command = ['tofu', 'init'] + (['-reconfigure'] if reconfigure else [])
+        _, stderr, return_code = self._run_command(command, stack_dir, stack_name=stack_name)
         if return_code:
             command_error_handler(TerraformInitFailed, 'Failed to initialize Terraform',
                                   command=' '.join(command), stack_name=stack_name, stderr=stderr)
 
+    def warm_provider_mirror(self, force: bool = False) -> None:
+        """
+        Populate the local provider mirror of the plugin cache, so 'tofu init' of new stacks
+        does not download any provider. The mirror is populated only once for the same provider
+        configuration.
+
+        :param force: Populate the mirror even if it is up to date
+        :return: None
+        :raise TerraformInitFailed: The 'tofu providers mirror' command fails.
+        """
+        if not self.plugin_cache:
+            return
+
+        provider = self.get_terraform_provider()
+        with self.plugin_cache.lock:
+            if not force and self.plugin_cache.is_mirror_current(provider):
+                return
+            workdir = self.plugin_cache.mirror_workdir
+            self.create_directories(workdir)
+            self._create_terraform_provider(workdir, provider)
+            command = ['tofu', 'providers', 'mirror', self.plugin_cache.mirror_dir]
+            _, stderr, return_code = self._run_command(command, workdir)
+            if return_code:
+                command_error_handler(TerraformInitFailed, 'Failed to populate provider mirror',
+                                      command=' '.join(command), stderr=stderr)
+            self.plugin_cache.mark_mirror_current(provider)
+            self.plugin_cache.write_cli_config()
+
+    def reinitialize_stack(self, stack_name: str) -> None:
+        """
+        Force 'tofu init' in the stack directory regardless of the stored fingerprint.
+
+        :param stack_name: The name of Terraform stack
+        :return: None
+        :raise TerraformInitFailed: The 'terraform init' command fails.
+        """
+        with self.stack_locks.write(stack_name):
+            self.state_cache.invalidate(stack_name)
+            self._initialize_stack_dir(stack_name, force_init=True)
+
     def create_terraform_workspace(self, stack_dir: str, stack_name: str,
                                    should_raise: bool = True) -> None:
         """
@@ -237,35 +1197,65 @@ class CrczpTerraformClientManager:
         :return: None
         :raise TerraformWorkspaceFailed: Could not create new workspace.
         """
-        retry_count = 1
-        stderr = ""
         command = ['tofu', 'workspace', 'new', stack_name]
-        while retry_count <= TERRAFORM_RETRY_NEW_WORKSPACE_COMMAND:
-            process = self._execute_command(command, cwd=stack_dir, stdout=subprocess.PIPE,
-                                            stderr=subprocess.PIPE)
-            _, stderr, return_code = self.wait_for_process(process)
-            if not (return_code and should_raise) or ('already exists' in stderr):
-                break
-            retry_count += 1
-        if retry_count > TERRAFORM_RETRY_NEW_WORKSPACE_COMMAND:
-            command_error_handler(TerraformWorkspaceFailed, 'Failed to create new workspace: '
-                                                            'command retry limit exceeded',
-                                  command=' '.join(command), stack_name=stack_name, stderr=stderr)
 
-    def create_terraform_template(self, topology_instance: TopologyInstance, *args, **kwargs)\
-            -> str:
+        def attempt() -> Tuple[str, str, int]:
+            with self.instrumentation.command_span(command, stack_name=stack_name) as span:
+                process = self._execute_command(command, cwd=stack_dir, stdout=subprocess.PIPE,
+                                                stderr=subprocess.PIPE)
+                stdout, stderr, return_code = self._communicate(process)
+                span.set(exit_code=return_code, output_bytes=len(stdout) + len(stderr))
+            if 'already exists' in stderr:
+                return stdout, stderr, 0
+            return stdout, stderr, return_code
+
+        if not should_raise:
+            attempt()
+            return
+        _, stderr, return_code = self.retry_policy.execute(attempt, command=' '.join(command),
+                                                           stack_name=stack_name)
+        if return_code:
+            command_error_handler(TerraformWorkspaceFailed, 'Failed to create new workspace',
+                                  command=' '.join(command), stack_name=stack_name,
+                                  stderr=flatten_error_output(stderr))
+
+    def _create_stack_from_template(self, stack_name: str, terraform_template: str, dry_run,
+                                    provider: str = None, json_output: bool = False) -> TerraformProcess:
         """
-        Create Terraform template.
+        Prepare the stack directory and start allocation of the stack.
 
-        :param topology_instance: The TopologyDefinition from which the template is created
-        :param args, kwargs: Can contain other attributes required for rendering of template
-        :return: Rendered Terraform template
-        :raise CrczpException: Invalid template of attributes.
+        :param stack_name: The name of the stack
+        :param terraform_template: Rendered Terraform template of the stack
+        :param dry_run: Create only Terraform plan without allocation
+        :param provider: Already rendered Terraform provider configuration
+        :param json_output: Produce machine-readable output, see TerraformProcess.events
+        :return: The process that is executing the creation
+        :raise CrczpException: Stack creation has failed
         """
-        return self.cloud_client.create_terraform_template(topology_instance, *args, **kwargs)
+        with self.stack_locks.write(stack_name):
+            self.state_cache.invalidate(stack_name)
+            stack_dir = self.get_stack_dir(stack_name)
+            self._record_stack_state(stack_name, CrczpTerraformStackState.INITIALIZING, terraform_template)
+            try:
+                self._initialize_stack_dir(stack_name, terraform_template, provider=provider)
+                if self.uses_workspaces:
+                    self.create_terraform_workspace(stack_dir, stack_name)
+            except Exception as exc:
+                self._record_stack_state(stack_name, CrczpTerraformStackState.FAILED, error=str(exc))
+                raise
+
+            if dry_run:
+                # Nothing is allocated, the stack stays initializing
+                return self._start_stack_command(self._get_stack_command('plan', json_output), stack_name)
+
+            command = self._get_stack_command('apply', json_output)
+            on_result = self._track_stack_command(stack_name, command, CrczpTerraformStackState.APPLYING,
+                                                  terraform_template)
+            return self._start_stack_command(command, stack_name, on_result)
 
     def create_stack(self, topology_instance: TopologyInstance, dry_run, stack_name: str,
-                     key_pair_name_ssh: str, key_pair_name_cert: str, *args, **kwargs):
+                     key_pair_name_ssh: str, key_pair_name_cert: str, *args,
+                     json_output: bool = False, **kwargs):
         """
         Create Terraform stack on the cloud.
 
@@ -274,6 +1264,7 @@ class CrczpTerraformClientManager:
         :param stack_name: The name of the stack
         :param key_pair_name_ssh: Name of the SSH key pair
         :param key_pair_name_cert: Name of the certificate key pair
+        :param json_output: Produce machine-readable output, see TerraformProcess.events
         :param args, kwargs: Can contain other attributes required for rendering of template
         :return: The process that is executing the creation
         :raise CrczpException: Stack creation has failed
@@ -283,33 +1274,229 @@ class CrczpTerraformClientManager:
                                                             key_pair_name_cert=key_pair_name_cert,
                                                             resource_prefix=stack_name, *args,
                                                             **kwargs)
-        stack_dir = self.get_stack_dir(stack_name)
-        self._initialize_stack_dir(stack_name, terraform_template)
-        self.create_terraform_workspace(stack_dir, stack_name)
+        return self._create_stack_from_template(stack_name, terraform_template, dry_run,
+                                                json_output=json_output)
+
+    def create_stacks(self, topology_instance: TopologyInstance, dry_run, stack_names: List[str],
+                      key_pair_name_ssh: str, key_pair_name_cert: str,
+                      max_workers: int = DEFAULT_BATCH_WORKERS, timeout=None, *args,
+                      json_output: bool = False, **kwargs)\
+            -> Dict[str, TerraformStackResult]:
+        """
+        Create multiple Terraform stacks from one topology concurrently.
+
+        At most max_workers stacks are prepared and allocated at the same time. A failure of
+        one stack does not abort the others.
+
+        :param topology_instance: TopologyInstance from which are the stacks created
+        :param dry_run: Create only Terraform plan without allocation
+        :param stack_names: The names of the stacks
+        :param key_pair_name_ssh: Name of the SSH key pair
+        :param key_pair_name_cert: Name of the certificate key pair
+        :param max_workers: The maximum number of stacks processed concurrently
+        :param timeout: Timeout in seconds of allocation of a single stack
+        :param json_output: Produce machine-readable output, see TerraformProcess.events
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: Dictionary of TerraformStackResult objects keyed by stack name
+        :raise CrczpException: Template rendering has failed
+        """
+        terraform_templates = self.create_terraform_templates(topology_instance, stack_names,
+                                                              *args, key_pair_name_ssh=key_pair_name_ssh,
+                                                              key_pair_name_cert=key_pair_name_cert, **kwargs)
+        provider = self.get_terraform_provider()
+
+        def create(stack_name: str) -> TerraformStackResult:
+            result = TerraformStackResult(stack_name)
+            try:
+                # Commands of bulk allocations give way to interactive ones
+                with self.scheduler.priority(PRIORITY_BULK):
+                    result.process = self._create_stack_from_template(
+                        stack_name, terraform_templates[stack_name], dry_run, provider=provider,
+                        json_output=json_output)
+                # The apply is not repeated, a partially applied stack is left to the caller
+                result.stdout, result.stderr, result.return_code = result.process.drain(timeout)
+            except subprocess.TimeoutExpired as exc:
+                result.process.kill()
+                result.process.drain()
+                result.error = exc
+            except Exception as exc:  # pylint: disable=broad-except
+                result.error = exc
+            return result
+
+        results = {}
+        pending = list(dict.fromkeys(stack_names))
+        if pending and self.plugin_cache:
+            # The first initialization fills the shared plugin cache which is not safe
+            # to be filled concurrently
+            first = create(pending.pop(0))
+            results[first.stack_name] = first
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            for result in executor.map(create, pending):
+                results[result.stack_name] = result
+        return results
+
+    def get_stack_changes(self, topology_instance: TopologyInstance, stack_name: str,
+                          key_pair_name_ssh: str, key_pair_name_cert: str, *args, **kwargs) -> TemplateDiff:
+        """
+        Compare the template of the existing stack with the template rendered from the topology.
+
+        :param topology_instance: TopologyInstance the stack is updated to
+        :param stack_name: The name of the stack
+        :param key_pair_name_ssh: Name of the SSH key pair
+        :param key_pair_name_cert: Name of the certificate key pair
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: TemplateDiff object
+        :raise StackNotFound: The stack directory does not exist
+        :raise CrczpException: A template cannot be compared
+        """
+        terraform_template = self.create_terraform_template(topology_instance, *args,
+                                                            key_pair_name_ssh=key_pair_name_ssh,
+                                                            key_pair_name_cert=key_pair_name_cert,
+                                                            resource_prefix=stack_name, **kwargs)
+        try:
+            old_template = self._read_applied_template(stack_name) or self._read_stack_template(stack_name)
+            return diff_templates(old_template, terraform_template)
+        except ValueError as exc:
+            raise CrczpException(f'Failed to compare templates of stack {stack_name}: {exc}') from exc
+
+    def update_stack(self, topology_instance: TopologyInstance, stack_name: str,
+                     key_pair_name_ssh: str, key_pair_name_cert: str, *args, targeted: bool = True,
+                     json_output: bool = False, **kwargs) -> Optional[TerraformProcess]:
+        """
+        Update existing Terraform stack to the topology.
+
+        The new template is compared with the one of the last successful apply of the stack and
+        only the added, removed and changed resources and the resources referring to them are
+        applied. The whole stack is applied if no apply is known to have succeeded. Refresh of
+        the state is skipped if resources are only added.
 
-        if dry_run:
-            return self._execute_command(['tofu', 'plan'], cwd=stack_dir,
-                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        :param topology_instance: TopologyInstance the stack is updated to
+        :param stack_name: The name of the stack
+        :param key_pair_name_ssh: Name of the SSH key pair
+        :param key_pair_name_cert: Name of the certificate key pair
+        :param targeted: Apply only the affected resources, the whole stack is applied if False,
+            e.g. to retry an update whose apply has failed
+        :param json_output: Produce machine-readable output, see TerraformProcess.events
+        :param args, kwargs: Can contain other attributes required for rendering of template
+        :return: The process that is executing the update or None if the template is unchanged
+        :raise StackNotFound: The stack directory does not exist
+        :raise CrczpException: Stack update has failed
+        """
+        terraform_template = self.create_terraform_template(topology_instance, *args,
+                                                            key_pair_name_ssh=key_pair_name_ssh,
+                                                            key_pair_name_cert=key_pair_name_cert,
+                                                            resource_prefix=stack_name, **kwargs)
+        with self.stack_locks.write(stack_name):
+            command = self._prepare_stack_update(stack_name, terraform_template, targeted, json_output)
+            if command is None:
+                return None
+            self._select_stack_workspace(stack_name)
+            on_result = self._track_stack_command(stack_name, command, CrczpTerraformStackState.APPLYING,
+                                                  terraform_template)
+            return self._start_stack_command(command, stack_name, on_result)
+
+    def _read_stack_template(self, stack_name: str) -> str:
+        """
+        Read Terraform template stored in the stack directory.
 
-        return self._execute_command(['tofu', 'apply', '-auto-approve', '-no-color'],
-                                     cwd=stack_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        :param stack_name: The name of the stack
+        :return: The template
+        :raise StackNotFound: The stack directory does not exist
+        """
+        try:
+            with open(os.path.join(self.get_stack_dir(stack_name), self.template_file_name)) as file:
+                return file.read()
+        except FileNotFoundError as exc:
+            raise StackNotFound(f'Template of stack {stack_name} does not exist') from exc
 
-    def delete_stack(self, stack_name):
+    def delete_stack(self, stack_name, json_output: bool = False):
         """
         Delete Terraform stack.
 
         :param stack_name: Name of stack that is deleted
+        :param json_output: Produce machine-readable output, see TerraformProcess.events
         :return: The process that is executing the deletion
         :raise CrczpException: Stack deletion has failed
         """
-        stack_dir = self.get_stack_dir(stack_name)
         try:
-            self._initialize_stack_dir(stack_name)
-            self._switch_terraform_workspace(stack_name, stack_dir)
+            return self._start_stack_destroy(stack_name, json_output)
         except (TerraformInitFailed, TerraformWorkspaceFailed):
             return None
-        return self._execute_command(['tofu', 'destroy', '-auto-approve', '-no-color'],
-                                     cwd=stack_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def _start_stack_destroy(self, stack_name: str, json_output: bool = False) -> TerraformProcess:
+        """
+        Switch to the workspace of the stack and start destruction of its resources.
+
+        :param stack_name: Name of stack that is deleted
+        :param json_output: Produce machine-readable output, see TerraformProcess.events
+        :return: The process that is executing the deletion
+        :raise TerraformInitFailed: The stack directory could not be initialized
+        :raise TerraformWorkspaceFailed: Could not switch to the workspace of the stack
+        """
+        with self.stack_locks.write(stack_name):
+            self.state_cache.invalidate(stack_name)
+            self._select_stack_workspace(stack_name)
+            command = self._get_stack_command('destroy', json_output)
+            on_result = self._track_stack_command(stack_name, command, CrczpTerraformStackState.DESTROYING)
+            return self._start_stack_command(command, stack_name, on_result)
+
+    def delete_stacks(self, stack_names: List[str], max_workers: int = DEFAULT_BATCH_WORKERS, timeout=None,
+                      delete_workspace: bool = True, delete_directory: bool = True,
+                      json_output: bool = False) -> Dict[str, TerraformStackResult]:
+        """
+        Delete multiple Terraform stacks concurrently.
+
+        At most max_workers stacks are destroyed at the same time. As soon as resources of
+        a stack are destroyed, its workspace and directory are deleted. A failure of one stack
+        does not abort the others, the workspace and directory of a stack whose destruction
+        failed are kept.
+
+        :param stack_names: The names of the stacks
+        :param max_workers: The maximum number of stacks processed concurrently
+        :param timeout: Timeout in seconds of destruction of a single stack
+        :param delete_workspace: Delete the workspace of every destroyed stack
+        :param delete_directory: Delete the directory of every destroyed stack
+        :param json_output: Produce machine-readable output, see TerraformProcess.events
+        :return: Dictionary of TerraformStackResult objects keyed by stack name
+        """
+        # Workspaces of the local backend are stored in the stack directory, they are removed with it
+        delete_workspace = delete_workspace and not (
+            delete_directory and self.terraform_backend.backend_type == CrczpTerraformBackendType.LOCAL)
+
+        def delete(stack_name: str) -> TerraformStackResult:
+            result = TerraformStackResult(stack_name)
+            try:
+                # Commands of bulk deletions give way to interactive ones
+                with self.scheduler.priority(PRIORITY_BULK):
+                    result.process = self._start_stack_destroy(stack_name, json_output)
+                # The destroy is not repeated, a failed one is left to the caller
+                result.stdout, result.stderr, result.return_code = result.process.drain(timeout)
+                if result.return_code:
+                    return result
+                with self.scheduler.priority(PRIORITY_BULK):
+                    if delete_workspace:
+                        self.delete_terraform_workspace(stack_name)
+                if delete_directory:
+                    self.delete_stack_directory(stack_name)
+            except subprocess.TimeoutExpired as exc:
+                result.process.kill()
+                result.process.drain()
+                result.error = exc
+            except Exception as exc:  # pylint: disable=broad-except
+                result.error = exc
+            return result
+
+        results = {}
+        pending = list(dict.fromkeys(stack_names))
+        if pending and self.plugin_cache:
+            # Stack directories cleaned by garbage collection are initialized again, the first
+            # initialization fills the shared plugin cache which is not safe to be filled concurrently
+            first = delete(pending.pop(0))
+            results[first.stack_name] = first
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            for result in executor.map(delete, pending):
+                results[result.stack_name] = result
+        return results
 
     def delete_stack_directory(self, stack_name) -> None:
         """
@@ -319,43 +1506,363 @@ class CrczpTerraformClientManager:
         :return: None
         :raise CrczpException: Stack directory is not found
         """
-        stack_dir = self.get_stack_dir(stack_name)
-        self.remove_directory(stack_dir)
+        with self.stack_locks.write(stack_name):
+            self._remove_stack_directory(stack_name)
+
+    def _remove_stack_directory(self, stack_name: str) -> None:
+        """
+        Remove the stack directory and its record, the caller holds the write lock of the stack.
+
+        :param stack_name: Name of stack
+        :return: None
+        :raise StackNotFound: Terraform stack directory not found
+        """
+        self.state_cache.invalidate(stack_name)
+        try:
+            self.remove_directory(self.get_stack_dir(stack_name))
+        finally:
+            self._unregister_stack(stack_name)
+
+    def _unregister_stack(self, stack_name: str) -> None:
+        """
+        Remove the stack from the stack registry.
+
+        :param stack_name: The name of Terraform stack
+        :return: None
+        """
+        if self.stack_registry is None:
+            return
+        try:
+            self.stack_registry.remove(stack_name)
+        except sqlite3.Error as exc:
+            LOG.warning('Failed to remove stack from the registry', stack_name=stack_name, error=str(exc))
 
     def delete_terraform_workspace(self, stack_name) -> None:
         """
-        Delete Terraform workspace.
+        Delete Terraform workspace. Stacks of the directory stack layout have no workspace,
+        their state stored in the remote backend is deleted instead, see _delete_stack_state.
 
         :param stack_name: Name of stack
         :return: None
         :raise CrczpException: Terraform workspace is not found
+        :raise TerraformWorkspaceFailed: The state of the stack could not be deleted
         """
-        stack_dir = self.get_stack_dir(stack_name)
-        self._switch_terraform_workspace(TERRAFORM_DEFAULT_WORKSPACE, stack_dir)
-        command = ['tofu', 'workspace', 'delete', stack_name]
-        process = self._execute_command(command, cwd=stack_dir, stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE)
-        _, stderr, return_code = self.wait_for_process(process)
+        if not self.uses_workspaces:
+            with self.stack_locks.write(stack_name):
+                self.state_cache.invalidate(stack_name)
+                self._delete_stack_state(stack_name)
+            self._record_deleted_workspace(stack_name)
+            return
+        with self.stack_locks.write(stack_name):
+            self.state_cache.invalidate(stack_name)
+            stack_dir = self.get_stack_dir(stack_name)
+            self._switch_terraform_workspace(TERRAFORM_DEFAULT_WORKSPACE, stack_dir)
+            command = ['tofu', 'workspace', 'delete', stack_name]
+            _, stderr, return_code = self._run_command(command, stack_dir, stack_name=stack_name)
         if return_code:
             command_error_handler(TerraformWorkspaceFailed, 'Failed to delete Terraform workspace',
                                   command=' '.join(command), stderr=stderr)
+        self._record_deleted_workspace(stack_name)
 
-    def get_image(self, image_id) -> Image:
+    def _get_workspace_admin_dir(self) -> str:
         """
-        Get image data from cloud.
+        Get directory configured only with the shared backend, it is created and initialized
+        on the first use. Workspaces of stacks without a directory can be managed from it.
 
-        :param image_id: ID of image
-        :return: The image data as Image object
+        :return: The path to the directory
+        :raise TerraformInitFailed: The directory could not be initialized
+        """
+        admin_dir = os.path.join(self.stacks_dir, WORKSPACE_ADMIN_DIR_NAME)
+        with self.stack_locks.write(WORKSPACE_ADMIN_DIR_NAME):
+            if not os.path.isdir(os.path.join(admin_dir, TERRAFORM_DATA_DIR)):
+                self.create_directories(admin_dir)
+                self._create_terraform_backend_file(admin_dir, self.terraform_backend.template)
+                self.init_terraform(admin_dir, WORKSPACE_ADMIN_DIR_NAME)
+        return admin_dir
+
+    def list_terraform_workspaces(self) -> List[str]:
+        """
+        List Terraform workspaces of stacks in the shared backend of the workspace stack layout.
+        Workspaces of the local backend are stored in stack directories, they are not listed.
+
+        :return: The list of workspace names without the default workspace
+        :raise TerraformImproperlyConfigured: Stacks do not share a remote backend
+        :raise TerraformWorkspaceFailed: Workspaces could not be listed
+        """
+        if not self.uses_workspaces or self.terraform_backend.backend_type == CrczpTerraformBackendType.LOCAL:
+            raise TerraformImproperlyConfigured('Workspaces can be listed only in a shared remote backend')
+        command = ['tofu', 'workspace', 'list']
+        with self.scheduler.priority(PRIORITY_BULK):
+            stdout, stderr, return_code = self._run_command(command, self._get_workspace_admin_dir())
+        if return_code:
+            command_error_handler(TerraformWorkspaceFailed, 'Failed to list Terraform workspaces',
+                                  command=' '.join(command), stderr=stderr)
+        workspaces = (line.lstrip('* ').strip() for line in stdout.splitlines())
+        return [workspace for workspace in workspaces if workspace and workspace != TERRAFORM_DEFAULT_WORKSPACE]
+
+    def delete_empty_terraform_workspace(self, workspace: str) -> None:
+        """
+        Delete Terraform workspace of the shared remote backend without using the stack directory.
+        Terraform refuses to delete a workspace whose state manages resources.
+
+        :param workspace: The name of the workspace
+        :return: None
+        :raise TerraformWorkspaceFailed: The workspace could not be deleted
+        """
+        command = ['tofu', 'workspace', 'delete', workspace]
+        with self.scheduler.priority(PRIORITY_BULK):
+            _, stderr, return_code = self._run_command(command, self._get_workspace_admin_dir(),
+                                                       workspace=workspace)
+        if return_code:
+            command_error_handler(TerraformWorkspaceFailed, 'Failed to delete Terraform workspace',
+                                  command=' '.join(command), workspace=workspace, stderr=stderr)
+
+    def migrate_stack_to_directory_layout(self, stack_name: str, delete_workspace: bool = True) -> None:
+        """
+        Move state of a stack created in the workspace stack layout to its own backend key of the
+        directory stack layout. The state is pulled from the workspace of the stack, the stack
+        directory is initialized with the backend configuration of the stack and the state is
+        pushed to its default workspace. If the migration fails, the previous configuration
+        of the directory is restored and the workspace is kept.
+
+        :param stack_name: The name of Terraform stack
+        :param delete_workspace: Delete the workspace of the stack after the state is moved
+        :return: None
+        :raise StackNotFound: The stack directory does not exist
+        :raise CrczpException: The migration has failed
+        """
+        stack_dir = self.get_stack_dir(stack_name)
+        if not os.path.isdir(stack_dir):
+            raise StackNotFound(f'Stack directory of {stack_name} does not exist')
+
+        with self.stack_locks.write(stack_name):
+            self.state_cache.invalidate(stack_name)
+            state_file_path = os.path.join(stack_dir, MIGRATION_STATE_FILE_NAME)
+            workspace_backend = self.terraform_backend.template
+            stack_backend = self.terraform_backend.get_stack_template(stack_name)
+
+            # A copy of pulled state was stored here by older versions, it would collide
+            # with the state of the default workspace of the local backend
+            stale_state_path = os.path.join(stack_dir, TERRAFORM_STATE_FILE_NAME)
+            if os.path.isfile(stale_state_path):
+                os.remove(stale_state_path)
+
+            self._remove_init_fingerprint(stack_dir)
+            self._create_terraform_backend_file(stack_dir, workspace_backend)
+            self.init_terraform(stack_dir, stack_name, reconfigure=True)
+            self._switch_terraform_workspace(stack_name, stack_dir)
+            self.create_file(state_file_path,
+                             self._run_migration_command(['tofu', 'state', 'pull'], stack_dir, stack_name))
+
+            try:
+                self._remove_file(os.path.join(stack_dir, TERRAFORM_DATA_DIR, TERRAFORM_ENVIRONMENT_FILE_NAME))
+                self._create_terraform_backend_file(stack_dir, stack_backend)
+                self.init_terraform(stack_dir, stack_name, reconfigure=True)
+                self._run_migration_command(['tofu', 'state', 'push', MIGRATION_STATE_FILE_NAME],
+                                            stack_dir, stack_name)
+            except Exception:
+                LOG.error('Failed to migrate stack, restoring workspace configuration',
+                          stack_name=stack_name, state_file=state_file_path)
+                self._create_terraform_backend_file(stack_dir, workspace_backend)
+                self.init_terraform(stack_dir, stack_name, reconfigure=True)
+                raise
+
+            with open(os.path.join(stack_dir, TERRAFORM_PROVIDER_FILE_NAME)) as file:
+                self._store_init_fingerprint(stack_dir, stack_backend, file.read())
+            if delete_workspace:
+                self._delete_migrated_workspace(stack_name)
+            os.remove(state_file_path)
+            LOG.info('Stack migrated to the directory stack layout', stack_name=stack_name)
+
+    def _delete_migrated_workspace(self, stack_name: str) -> None:
+        """
+        Delete workspace of a stack migrated to the directory stack layout.
+
+        :param stack_name: The name of Terraform stack
+        :return: None
+        :raise CrczpException: The workspace could not be deleted
+        """
+        stack_dir = self.get_stack_dir(stack_name)
+        if self.terraform_backend.backend_type == CrczpTerraformBackendType.LOCAL:
+            workspace_path = os.path.join(stack_dir, TERRAFORM_WORKSPACE_PATH.format(stack_name))
+            self.remove_directory(os.path.dirname(workspace_path))
+            return
+
+        # The stack directory is configured with the new backend key, so the workspace is
+        # deleted from a directory containing only the shared backend configuration
+        workspace_dir = os.path.join(stack_dir, TERRAFORM_DATA_DIR, 'crczp-migration')
+        self.create_directories(workspace_dir)
+        try:
+            self._create_terraform_backend_file(workspace_dir, self.terraform_backend.template)
+            self.init_terraform(workspace_dir, stack_name)
+            self._run_migration_command(['tofu', 'workspace', 'delete', '-force', stack_name],
+                                        workspace_dir, stack_name)
+        finally:
+            self.remove_directory(workspace_dir)
+
+    def _run_migration_command(self, command: List[str], cwd: str, stack_name: str) -> str:
+        """
+        Execute command of the stack migration and wait for it.
+
+        :param command: Command to execute
+        :param cwd: Working directory
+        :param stack_name: The name of Terraform stack
+        :return: Standard output of the command
+        :raise CrczpException: The command has failed
+        """
+        stdout, stderr, return_code = self._run_command(command, cwd, stack_name=stack_name)
+        if return_code:
+            command_error_handler(CrczpException, 'Failed to migrate stack to the directory stack layout',
+                                  command=' '.join(command), stack_name=stack_name, stderr=stderr)
+        return stdout
+
+    @staticmethod
+    def _remove_file(file_path: str) -> None:
+        """
+        Remove file if it exists.
+
+        :param file_path: The path to the file
+        :return: None
+        """
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(file_path)
+
+    def close(self, timeout: float = None) -> None:
         """
-        return self.cloud_client.get_image(image_id)
+        Wait for results of commands which have already exited to be recorded and close connections
+        of the stack registry and the state reader. Running commands are not waited for, their
+        results are recorded when they exit.
 
-    def list_stacks(self) -> List[str]:
+        :param timeout: Seconds to wait for the results to be recorded, unlimited if None
+        :return: None
+        """
+        self.scheduler.wait_for_exit_callbacks(timeout)
+        if self.stack_registry is not None:
+            self.stack_registry.close()
+        if self.state_reader is not None:
+            self.state_reader.close()
+
+    def list_stacks(self, states: List[CrczpTerraformStackState] = None, name_prefix: str = None,
+                    limit: int = None, after: str = None) -> List[str]:
         """
-        List created Terraform stacks.
+        List created Terraform stacks. Without filters, the stacks directory is listed. Filtered
+        stacks are listed from the stack registry.
 
+        :param states: List only stacks in these states, all stacks if None
+        :param name_prefix: List only stacks whose name starts with the prefix
+        :param limit: The maximum number of listed stacks, all if None
+        :param after: List only stacks whose name follows this name, the last name of the previous page
         :return: The list containing stack names
+        :raise TerraformImproperlyConfigured: Stacks are filtered without the stack registry
+        """
+        if states is None and not name_prefix and limit is None and after is None:
+            return [name for name in os.listdir(self.stacks_dir) if not self._is_internal_entry(name)]
+        if self.stack_registry is None:
+            raise TerraformImproperlyConfigured('Filtering of stacks requires the stack registry')
+        return [record.name for record in self.list_stack_records(states, name_prefix, limit, after)]
+
+    def list_stack_records(self, states: List[CrczpTerraformStackState] = None, name_prefix: str = None,
+                           limit: int = None, after: str = None) -> List[TerraformStackRecord]:
+        """
+        List records of stacks in the stack registry ordered by name.
+
+        :param states: List only stacks in these states, all stacks if None
+        :param name_prefix: List only stacks whose name starts with the prefix
+        :param limit: The maximum number of listed stacks, all if None
+        :param after: List only stacks whose name follows this name, the last name of the previous page
+        :return: List of TerraformStackRecord objects
+        :raise TerraformImproperlyConfigured: There is no stack registry
+        """
+        return self._get_stack_registry().list_stacks(states, name_prefix, limit, after)
+
+    def get_stack_record(self, stack_name: str) -> Optional[TerraformStackRecord]:
+        """
+        Get record of the stack in the stack registry.
+
+        :param stack_name: The name of stack
+        :return: TerraformStackRecord object or None if the stack is not registered
+        :raise TerraformImproperlyConfigured: There is no stack registry
+        """
+        return self._get_stack_registry().get(stack_name)
+
+    def _get_stack_registry(self) -> TerraformStackRegistry:
+        if self.stack_registry is None:
+            raise TerraformImproperlyConfigured('The stack registry is disabled')
+        return self.stack_registry
+
+    def _is_internal_entry(self, name: str) -> bool:
         """
-        return os.listdir(self.stacks_dir)
+        Check whether the entry of the stacks directory was created by the client and is not a stack.
+
+        :param name: The name of the entry
+        :return: True for the workspace administration directory and the stack registry database
+        """
+        if name == WORKSPACE_ADMIN_DIR_NAME:
+            return True
+        if self.stack_registry is None:
+            return False
+        registry_dir, registry_file = os.path.split(os.path.abspath(self.stack_registry.path))
+        # The database and its temporary files, e.g. the journal
+        return registry_dir == os.path.abspath(self.stacks_dir) and name.startswith(registry_file)
+
+    def _list_stack_directories(self) -> List[str]:
+        """
+        List names of stack directories, files and hidden entries of the stacks directory are skipped.
+
+        :return: The list of stack names
+        """
+        with os.scandir(self.stacks_dir) as entries:
+            return [entry.name for entry in entries
+                    if not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False)]
+
+    def _get_stack_state_on_disk(self, stack_name: str) -> Tuple[CrczpTerraformStackState, Optional[str]]:
+        """
+        Guess state of the stack from its directory.
+
+        :param stack_name: The name of stack
+        :return: Tuple of the state and the template of the stack, READY if the directory was
+            initialized, FAILED if its creation did not finish
+        """
+        stack_dir = self.get_stack_dir(stack_name)
+        try:
+            with open(os.path.join(stack_dir, self.template_file_name)) as file:
+                template = file.read()
+        except FileNotFoundError:
+            return CrczpTerraformStackState.FAILED, None
+        if not self._read_init_fingerprint(stack_dir):
+            return CrczpTerraformStackState.FAILED, template
+        return CrczpTerraformStackState.READY, template
+
+    def reconcile_stack_registry(self) -> Tuple[List[str], List[str]]:
+        """
+        Rebuild the stack registry from the stacks directory. Stack directories missing in the
+        registry are registered with the state guessed from their content and stacks without
+        a directory are removed. Records of stacks with a directory are kept.
+
+        :return: Tuple of the names of registered and removed stacks
+        :raise TerraformImproperlyConfigured: There is no stack registry
+        """
+        stack_registry = self._get_stack_registry()
+        on_disk = set(self._list_stack_directories())
+        registered = {record.name for record in stack_registry.list_stacks()}
+        added, removed = [], []
+        # Only the differing stacks are locked, so concurrent creation or deletion is not undone
+        for stack_name in sorted(on_disk - registered):
+            stack_dir = self.get_stack_dir(stack_name)
+            with self.stack_locks.write(stack_name):
+                if not os.path.isdir(stack_dir) or stack_registry.get(stack_name) is not None:
+                    continue
+                state, template = self._get_stack_state_on_disk(stack_name)
+                template_hash = None if template is None else hashlib.sha256(template.encode()).hexdigest()
+                stack_registry.set_state(stack_name, state, template_hash, created_at=os.path.getmtime(stack_dir))
+                added.append(stack_name)
+        for stack_name in sorted(registered - on_disk):
+            with self.stack_locks.write(stack_name):
+                if not os.path.isdir(self.get_stack_dir(stack_name)):
+                    stack_registry.remove(stack_name)
+                    removed.append(stack_name)
+        LOG.info('Stack registry reconciled', registered=len(added), removed=len(removed))
+        return added, removed
 
     def list_stack_resources(self, stack_name: str) -> List[dict]:
         """
@@ -364,11 +1871,61 @@ class CrczpTerraformClientManager:
         :param stack_name: The name of stack
         :return: The list of dictionaries containing resources
         """
-        self._pull_terraform_state(stack_name)
-        stack_dir = self.get_stack_dir(stack_name)
-        with open(os.path.join(stack_dir, TERRAFORM_STATE_FILE_NAME), 'r')\
-                as file:
-            return list(filter(lambda res: res['mode'] == 'managed', json.load(file)['resources']))
+        return list(self._get_terraform_state(stack_name).resources)
+
+    def list_resources_for_stacks(self, stack_names: List[str], max_workers: int = DEFAULT_BATCH_WORKERS,
+                                  resource_types: List[str] = None)\
+            -> Tuple[Dict[str, List[dict]], Dict[str, Exception]]:
+        """
+        List resources of multiple stacks. Cached states are used first, states of the remaining
+        stacks are read in a single query if the backend supports it, otherwise they are pulled
+        concurrently.
+
+        :param stack_names: The names of stacks
+        :param max_workers: The maximum number of states pulled concurrently
+        :param resource_types: Return only resources of these types, all managed resources if None
+        :return: Tuple of resources keyed by stack name and exceptions keyed by stack name
+        """
+        states: Dict[str, TerraformState] = {}
+        errors: Dict[str, Exception] = {}
+        pending = []
+        for stack_name in dict.fromkeys(stack_names):
+            state = self.state_cache.get(stack_name)
+            if state is None:
+                pending.append(stack_name)
+            else:
+                states[stack_name] = state
+
+        if pending and self.state_reader is not None:
+            generations = {stack_name: self.state_cache.generation(stack_name) for stack_name in pending}
+            try:
+                read_states = self.state_reader.read_states(pending)
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.warning('Failed to read Terraform states directly, falling back to tofu',
+                            error=str(exc))
+                read_states = {}
+            for stack_name, state in read_states.items():
+                self.state_cache.put(stack_name, state, generations[stack_name])
+                self._record_state_serial(stack_name, state.serial)
+                states[stack_name] = state
+            pending = [stack_name for stack_name in pending if stack_name not in read_states]
+
+        def pull(stack_name: str) -> None:
+            try:
+                states[stack_name] = self._load_terraform_state(stack_name)
+            except Exception as exc:  # pylint: disable=broad-except
+                errors[stack_name] = exc
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                list(executor.map(pull, pending))
+
+        resources = {}
+        for stack_name in dict.fromkeys(stack_names):
+            if stack_name in states:
+                resources[stack_name] = [res for res in states[stack_name].resources
+                                         if resource_types is None or res['type'] in resource_types]
+        return resources, errors
 
     def get_resource_dict(self, stack_name) -> dict:
         """
@@ -380,6 +1937,15 @@ class CrczpTerraformClientManager:
         list_of_resources = self.list_stack_resources(stack_name)
         return {res['name']: res['instances'] for res in list_of_resources}
 
+    def get_stack_index(self, stack_name: str) -> StackResourceIndex:
+        """
+        Get index of stack resources. At most one state read is done per call.
+
+        :param stack_name: The name of stack
+        :return: StackResourceIndex object
+        """
+        return self._get_terraform_state(stack_name).get_index(stack_name)
+
     def get_resource_id(self, stack_name, node_name) -> str:
         """
         Get ID of stack's resource.
@@ -388,8 +1954,7 @@ class CrczpTerraformClientManager:
         :param node_name: The name of node
         :return: The ID of resource
         """
-        resource_dict = self.get_resource_dict(stack_name)
-        return resource_dict[f'{stack_name}-{node_name}'][0]['attributes']['id']
+        return self.get_stack_index(stack_name).get(node_name).id
 
     def get_node(self, stack_name, node_name) -> TerraformInstance:
         """
@@ -399,30 +1964,23 @@ class CrczpTerraformClientManager:
         :param node_name: The name of node
         :return: TerraformInstance object
         """
-        resource_dict = self.get_resource_dict(stack_name)
-        resource_dict = resource_dict[f'{stack_name}-{node_name}'][0]['attributes']
-        node_details = self.cloud_client.get_node_details(resource_dict)
-        image_id = node_details.image_id
-        if image_id == "Attempt to boot from volume - no image supplied":
-            if 'block_device' in resource_dict and len(resource_dict['block_device']) \
-                    and 'uuid' in resource_dict['block_device'][0]:
-                image_id = resource_dict['block_device'][0]['uuid']
-            else:
-                raise CrczpException('Image id could not be retrieved from the node')
-
-        image = self.get_image(image_id)
-        status = node_details.status
-        flavor = node_details.flavor
-        instance = TerraformInstance(name=node_name, instance_id=resource_dict['id'],
-                                     status=status, image=image,
-                                     flavor_name=flavor)
+        resource = self.get_stack_index(stack_name).get(node_name)
+        return self._create_terraform_instance(node_name, resource)
 
-        for network in resource_dict.get('network', []):
-            name = network['name']
-            link = {key: value for key, value in network.items() if key != 'name'}
-            instance.add_link(name, link)
+    def get_nodes(self, stack_name: str, node_names: List[str] = None,
+                  max_workers: int = DEFAULT_BATCH_WORKERS) -> Dict[str, TerraformInstance]:
+        """
+        Get data about multiple nodes of the stack. The state is read once, node details are
+        requested concurrently and every distinct image is requested only once.
 
-        return instance
+        :param stack_name: The name of stack
+        :param node_names: The names of nodes, all nodes of the stack if None
+        :param max_workers: The maximum number of concurrent cloud requests
+        :return: Dictionary of TerraformInstance objects keyed by node name
+        :raise KeyError: A node does not exist
+        """
+        resources = self._select_node_resources(self.get_stack_index(stack_name), node_names)
+        return self._create_terraform_instances(resources, max_workers)
 
     def get_console_url(self, stack_name, node_name, console_type: str) -> str:
         """
@@ -433,12 +1991,12 @@ class CrczpTerraformClientManager:
         :param console_type: Type can be novnc, xvpvnc, spice-html5, rdp-html5, serial and webmks
         :return: Url to console
         """
-        node = self.get_node(stack_name, node_name)
+        resource = self.get_stack_index(stack_name).get(node_name)
+        node = self._create_terraform_instance(node_name, resource)
         if node.status != 'active':
             raise CrczpException(f'Cannot get {console_type} console from inactive machine')
 
-        resource_id = self.get_resource_id(stack_name, node_name)
-        return self.cloud_client.get_console_url(resource_id, console_type)
+        return self.cloud_client.get_console_url(resource.id, console_type)
 
     def get_enriched_topology_instance(self, stack_name: str,
                                        topology_instance: TopologyInstance) -> TopologyInstance:
@@ -452,16 +2010,5 @@ class CrczpTerraformClientManager:
         :param topology_instance: The TopologyInstance
         :return: TopologyInstance with additional properties
         """
-        topology_instance.name = stack_name
-        list_of_resources = self.list_stack_resources(stack_name)
-        resources_dict = {res['name']: res for res in list_of_resources}
-
-        man_out_port_dict = resources_dict[f'{stack_name}-{self.trc.man_out_port}']['instances'][0]['attributes']
-        topology_instance.ip = self.cloud_client.get_private_ip(man_out_port_dict)
-
-        for link in topology_instance.get_links():
-            port_dict = resources_dict[f'{stack_name}-{link.name}']['instances'][0]['attributes']
-            link.ip = self.cloud_client.get_private_ip(port_dict)
-            link.mac = port_dict['mac_address']
-
-        return topology_instance
+        index = self.get_stack_index(stack_name)
+        return self._enrich_topology_instance(stack_name, topology_instance, index)
@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Tuple
+
+from crczp.cloud_commons import CrczpCloudClientBase, Image, Limits, QuotaSet
+
+from crczp.terraform_driver.terraform_stack_lock import SingleFlight
+from crczp.terraform_driver.terraform_state_cache import CacheStats
+
+CATALOG_IMAGE = 'image'
+CATALOG_IMAGES = 'images'
+CATALOG_FLAVORS = 'flavors'
+CATALOG_QUOTA_SET = 'quota_set'
+CATALOG_LIMITS = 'limits'
+CATALOG_KINDS = (CATALOG_IMAGE, CATALOG_IMAGES, CATALOG_FLAVORS, CATALOG_QUOTA_SET, CATALOG_LIMITS)
+
+# Time to live in seconds, quotas contain the current usage of the project, so they expire sooner
+DEFAULT_CLOUD_CACHE_TTLS = {
+    CATALOG_IMAGE: 600,
+    CATALOG_IMAGES: 300,
+    CATALOG_FLAVORS: 600,
+    CATALOG_QUOTA_SET: 30,
+    CATALOG_LIMITS: 60,
+}
+DEFAULT_CLOUD_CACHE_SIZE = 1024
+
+
+class CloudCatalogCache:
+    """
+    Caches rarely changing catalogs of the cloud project: images, flavors, quotas and limits.
+
+    Every kind of lookup has its own TTL, a TTL of 0 disables caching of the kind. Concurrent
+    misses of the same entry share one call of the cloud client and failed calls are not cached.
+    Every kind has a generation which is increased on invalidation, a value fetched before the
+    invalidation is not stored.
+    """
+
+    def __init__(self, cloud_client: CrczpCloudClientBase, ttls: Dict[str, float] = None,
+                 max_size: int = DEFAULT_CLOUD_CACHE_SIZE, clock: Callable[[], float] = time.monotonic):
+        """
+        :param cloud_client: The cloud client
+        :param ttls: TTLs in seconds per kind, overriding DEFAULT_CLOUD_CACHE_TTLS
+        :param max_size: The maximum number of cached entries
+        :param clock: Source of time used for expiration
+        """
+        self.cloud_client = cloud_client
+        self.ttls = dict(DEFAULT_CLOUD_CACHE_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_size = max_size
+        self._clock = clock
+        self._entries: OrderedDict[Tuple[str, Hashable], tuple] = OrderedDict()
+        self._generations: Dict[str, int] = {kind: 0 for kind in CATALOG_KINDS}
+        self._stats: Dict[str, CacheStats] = {kind: CacheStats() for kind in CATALOG_KINDS}
+        self._lock = threading.Lock()
+        self._loads = SingleFlight()
+
+    def get_image(self, image_id: str) -> Image:
+        """
+        Get Image object based on its ID.
+
+        :param image_id: The ID of image on the cloud
+        :return: Image object
+        """
+        return self._get(CATALOG_IMAGE, image_id, self.cloud_client.get_image, image_id)
+
+    def list_images(self) -> List[Image]:
+        """
+        List all available images on the cloud project.
+
+        :return: List of Image objects
+        """
+        return list(self._get(CATALOG_IMAGES, None, self.cloud_client.list_images))
+
+    def get_flavors_dict(self) -> dict:
+        """
+        Get flavors of the cloud project with their vcpu and ram usage.
+
+        :return: Flavors dictionary
+        """
+        return dict(self._get(CATALOG_FLAVORS, None, self.cloud_client.get_flavors_dict))
+
+    def get_quota_set(self) -> QuotaSet:
+        """
+        Get quota set of the cloud project.
+
+        :return: QuotaSet object
+        """
+        return self._get(CATALOG_QUOTA_SET, None, self.cloud_client.get_quota_set)
+
+    def get_project_limits(self) -> Limits:
+        """
+        Get resources limits of the cloud project.
+
+        :return: Limits object
+        """
+        return self._get(CATALOG_LIMITS, None, self.cloud_client.get_project_limits)
+
+    def invalidate(self, kind: str = None, key: Hashable = None) -> None:
+        """
+        Drop cached entries.
+
+        :param kind: One of CATALOG_KINDS, all kinds if None
+        :param key: The key of the entry, e.g. image ID, all entries of the kind if None
+        :return: None
+        """
+        kinds = CATALOG_KINDS if kind is None else (kind,)
+        with self._lock:
+            for entry_kind in kinds:
+                self._generations[entry_kind] += 1
+                if key is not None:
+                    dropped = [(entry_kind, key)] if (entry_kind, key) in self._entries else []
+                else:
+                    dropped = [entry_key for entry_key in self._entries if entry_key[0] == entry_kind]
+                for entry_key in dropped:
+                    del self._entries[entry_key]
+                self._stats[entry_kind].invalidations += len(dropped)
+
+    def get_stats(self) -> Dict[str, CacheStats]:
+        """
+        Get snapshot of cache counters.
+
+        :return: Dictionary of CacheStats objects per kind
+        """
+        with self._lock:
+            return {kind: CacheStats(**vars(stats)) for kind, stats in self._stats.items()}
+
+    def _get(self, kind: str, key: Hashable, fetch: Callable, *args):
+        if self.ttls.get(kind, 0) <= 0 or self.max_size <= 0:
+            return fetch(*args)
+
+        entry_key = (kind, key)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None:
+                value, expires_at = entry
+                if self._clock() < expires_at:
+                    self._entries.move_to_end(entry_key)
+                    self._stats[kind].hits += 1
+                    return value
+                del self._entries[entry_key]
+                self._stats[kind].expirations += 1
+            self._stats[kind].misses += 1
+
+        return self._loads.run(repr(entry_key), self._load, kind, entry_key, fetch, *args)
+
+    def _load(self, kind: str, entry_key: Tuple[str, Hashable], fetch: Callable, *args):
+        with self._lock:
+            generation = self._generations[kind]
+        value = fetch(*args)
+        with self._lock:
+            if generation != self._generations[kind]:
+                self._stats[kind].rejected += 1
+                return value
+            self._entries[entry_key] = (value, self._clock() + self.ttls[kind])
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_size:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._stats[evicted_key[0]].evictions += 1
+        return value
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,143 @@
+"""
+Module containing parser of the machine-readable output of 'tofu apply -json' and 'tofu destroy -json'.
+"""
+
+import json
+from typing import Iterable, Iterator, Optional
+
+APPLY_START = 'apply_start'
+APPLY_PROGRESS = 'apply_progress'
+APPLY_COMPLETE = 'apply_complete'
+APPLY_ERRORED = 'apply_errored'
+CHANGE_SUMMARY = 'change_summary'
+DIAGNOSTIC = 'diagnostic'
+RESOURCE_EVENT_TYPES = (APPLY_START, APPLY_PROGRESS, APPLY_COMPLETE, APPLY_ERRORED)
+
+
+class TerraformEvent:
+    """
+    Used to represent a single message of the machine-readable 'tofu' output
+    """
+
+    def __init__(self, event_type: str, message: str, level: str, timestamp: str, raw: dict):
+        self.type = event_type
+        self.message = message
+        self.level = level
+        self.timestamp = timestamp
+        self.raw = raw
+
+    def __repr__(self):
+        return "<TerraformEvent\n" \
+               "  type: {0.type},\n" \
+               "  level: {0.level},\n" \
+               "  message: {0.message}>\n".format(self)
+
+
+class TerraformResourceEvent(TerraformEvent):
+    """
+    Used to represent start, progress, completion or failure of an operation on a resource
+    """
+
+    def __init__(self, event_type: str, message: str, level: str, timestamp: str, raw: dict):
+        super().__init__(event_type, message, level, timestamp, raw)
+        hook = raw.get('hook', {})
+        resource = hook.get('resource', {})
+        self.address = resource.get('addr', '')
+        self.resource_type = resource.get('resource_type', '')
+        self.resource_name = resource.get('resource_name', '')
+        self.action = hook.get('action', '')
+        self.id_value = hook.get('id_value')
+        self.elapsed_seconds = hook.get('elapsed_seconds')
+
+    @property
+    def failed(self) -> bool:
+        return self.type == APPLY_ERRORED
+
+    def __repr__(self):
+        return "<TerraformResourceEvent\n" \
+               "  type: {0.type},\n" \
+               "  address: {0.address},\n" \
+               "  action: {0.action},\n" \
+               "  elapsed_seconds: {0.elapsed_seconds}>\n".format(self)
+
+
+class TerraformChangeSummaryEvent(TerraformEvent):
+    """
+    Used to represent the final summary of changes
+    """
+
+    def __init__(self, event_type: str, message: str, level: str, timestamp: str, raw: dict):
+        super().__init__(event_type, message, level, timestamp, raw)
+        changes = raw.get('changes', {})
+        self.add = changes.get('add', 0)
+        self.change = changes.get('change', 0)
+        self.remove = changes.get('remove', 0)
+        self.operation = changes.get('operation', '')
+
+    def __repr__(self):
+        return "<TerraformChangeSummaryEvent\n" \
+               "  operation: {0.operation},\n" \
+               "  add: {0.add},\n" \
+               "  change: {0.change},\n" \
+               "  remove: {0.remove}>\n".format(self)
+
+
+class TerraformDiagnosticEvent(TerraformEvent):
+    """
+    Used to represent a warning or an error reported by 'tofu'
+    """
+
+    def __init__(self, event_type: str, message: str, level: str, timestamp: str, raw: dict):
+        super().__init__(event_type, message, level, timestamp, raw)
+        diagnostic = raw.get('diagnostic', {})
+        self.severity = diagnostic.get('severity', level)
+        self.summary = diagnostic.get('summary', message)
+        self.detail = diagnostic.get('detail', '')
+        self.address = diagnostic.get('address', '')
+
+    def __repr__(self):
+        return "<TerraformDiagnosticEvent\n" \
+               "  severity: {0.severity},\n" \
+               "  address: {0.address},\n" \
+               "  summary: {0.summary}>\n".format(self)
+
+
+EVENT_CLASSES = {
+    **{event_type: TerraformResourceEvent for event_type in RESOURCE_EVENT_TYPES},
+    CHANGE_SUMMARY: TerraformChangeSummaryEvent,
+    DIAGNOSTIC: TerraformDiagnosticEvent,
+}
+
+
+def parse_event(line: str) -> Optional[TerraformEvent]:
+    """
+    Parse single line of the machine-readable output.
+
+    :param line: The line of output
+    :return: TerraformEvent object or None if the line is not a JSON message
+    """
+    line = line.strip()
+    if not line.startswith('{'):
+        return None
+    try:
+        raw = json.loads(line)
+    except ValueError:
+        return None
+
+    event_type = raw.get('type', '')
+    event_class = EVENT_CLASSES.get(event_type, TerraformEvent)
+    return event_class(event_type, raw.get('@message', ''), raw.get('@level', ''),
+                       raw.get('@timestamp', ''), raw)
+
+
+def iter_events(lines: Iterable[str]) -> Iterator[TerraformEvent]:
+    """
+    Parse the machine-readable output incrementally.
+
+    :param lines: The lines of output
+    :return: TerraformEvent objects in the order of the output
+    """
+    for line in lines:
+        event = parse_event(line)
+        if event is not None:
+            yield event
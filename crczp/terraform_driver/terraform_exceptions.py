@@ -23,3 +23,10 @@ class TerraformWorkspaceFailed(CrczpException):
     This exception is raised if `terraform workspace` command fails.
     """
     pass
+
+
+class TerraformCommandQueueTimeout(CrczpException):
+    """
+    This exception is raised if a 'tofu' command waits for a free slot of the scheduler too long.
+    """
+    pass
@@ -0,0 +1,341 @@
+"""
+Module containing instrumentation of 'tofu' commands, state reads and cloud client calls.
+
+Finished spans are emitted to pluggable hooks. Without hooks the instrumentation is disabled,
+returns a shared no-op span and the cloud client is not wrapped, so it adds no measurable
+overhead to the hot paths.
+"""
+
+import functools
+import time
+from typing import Callable, Dict, List, Optional
+
+import structlog
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+from crczp.terraform_driver.terraform_exceptions import TerraformImproperlyConfigured
+
+LOG = structlog.get_logger()
+
+SPAN_KIND_COMMAND = 'command'
+SPAN_KIND_CLOUD = 'cloud'
+SPAN_KIND_STATE = 'state'
+OUTCOME_OK = 'ok'
+OUTCOME_ERROR = 'error'
+INSTRUMENTATION_NAME = 'crczp.terraform_driver'
+SUBCOMMAND_GROUPS = ('workspace', 'state', 'providers')
+
+
+def get_children_cpu_time() -> Optional[float]:
+    """
+    Get user and system CPU time of all terminated and waited-for child processes.
+
+    :return: CPU time in seconds or None if not supported by the platform
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Span:
+    """
+    Used to represent a timed operation. The span is emitted to the hooks when it finishes.
+
+    CPU time of commands is the difference of CPU time of waited-for child processes of the
+    whole process, it is exact only if no other child process finishes in the meantime.
+    """
+
+    def __init__(self, instrumentation: 'Instrumentation', name: str, kind: str, measure_cpu: bool,
+                 attributes: dict):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.duration: Optional[float] = None
+        self.cpu_time: Optional[float] = None
+        self._start = time.perf_counter()
+        self._cpu_start = get_children_cpu_time() if measure_cpu else None
+        self._finished = False
+
+    @property
+    def outcome(self) -> str:
+        return OUTCOME_ERROR if self.error is not None else OUTCOME_OK
+
+    def set(self, **attributes) -> None:
+        """
+        Set attributes of the span.
+
+        :param attributes: The attributes
+        :return: None
+        """
+        self.attributes.update(attributes)
+
+    def finish(self, error: str = None, **attributes) -> None:
+        """
+        Finish the span and emit it, only the first call has an effect.
+
+        :param error: Description of the error the operation failed with
+        :param attributes: Other attributes of the span
+        :return: None
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self.duration = time.perf_counter() - self._start
+        if self._cpu_start is not None:
+            self.cpu_time = max(0.0, get_children_cpu_time() - self._cpu_start)
+        if error is not None:
+            self.error = error
+        self.attributes.update(attributes)
+        self.instrumentation.emit(self)
+
+    def __enter__(self) -> 'Span':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.finish(error=None if exc_type is None else exc_type.__name__)
+
+    def __repr__(self):
+        return "<Span\n" \
+               "  name: {0.name},\n" \
+               "  kind: {0.kind},\n" \
+               "  duration: {0.duration},\n" \
+               "  cpu_time: {0.cpu_time},\n" \
+               "  outcome: {0.outcome},\n" \
+               "  attributes: {0.attributes}>\n".format(self)
+
+
+class _NullSpan:
+    """
+    Span of disabled instrumentation, all operations are no-op
+    """
+
+    name = kind = error = duration = cpu_time = None
+    attributes: dict = {}
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def finish(self, error: str = None, **attributes) -> None:
+        pass
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class InstrumentationHook:
+    """
+    Base class of receivers of finished spans
+    """
+
+    def emit(self, span: Span) -> None:
+        """
+        Receive finished span.
+
+        :param span: The finished span
+        :return: None
+        """
+        raise NotImplementedError
+
+
+class StructlogInstrumentationHook(InstrumentationHook):
+    """
+    Logs every finished span.
+    """
+
+    def __init__(self, logger=None):
+        """
+        :param logger: structlog logger, the logger of this module if None
+        """
+        self.logger = logger if logger is not None else LOG
+
+    def emit(self, span: Span) -> None:
+        self.logger.info('Span finished', span=span.name, kind=span.kind, duration=round(span.duration, 6),
+                         cpu_time=span.cpu_time, outcome=span.outcome, error=span.error, **span.attributes)
+
+
+class PrometheusInstrumentationHook(InstrumentationHook):
+    """
+    Records spans in metrics of a Prometheus registry, requires the prometheus_client package.
+    """
+
+    def __init__(self, registry=None, namespace: str = 'crczp_terraform'):
+        """
+        :param registry: prometheus_client CollectorRegistry, the default registry if None
+        :param namespace: Namespace of the metrics
+        :raise TerraformImproperlyConfigured: The prometheus_client package is not installed
+        """
+        try:
+            import prometheus_client
+        except ImportError as exc:
+            raise TerraformImproperlyConfigured(
+                'Prometheus instrumentation requires the prometheus_client package') from exc
+
+        registry = registry if registry is not None else prometheus_client.REGISTRY
+        labels = ['kind', 'name', 'outcome']
+        self.duration = prometheus_client.Histogram('span_duration_seconds', 'Duration of operations',
+                                                    labels, namespace=namespace, registry=registry)
+        self.cpu_time = prometheus_client.Counter('span_cpu_seconds', 'CPU time of tofu commands',
+                                                  labels, namespace=namespace, registry=registry)
+        self.output_bytes = prometheus_client.Counter('command_output_bytes', 'Output of tofu commands',
+                                                      ['name'], namespace=namespace, registry=registry)
+
+    def emit(self, span: Span) -> None:
+        labels = (span.kind, span.name, span.outcome)
+        self.duration.labels(*labels).observe(span.duration)
+        if span.cpu_time is not None:
+            self.cpu_time.labels(*labels).inc(span.cpu_time)
+        if span.attributes.get('output_bytes'):
+            self.output_bytes.labels(span.name).inc(span.attributes['output_bytes'])
+
+
+class OpenTelemetryInstrumentationHook(InstrumentationHook):
+    """
+    Exports spans as OpenTelemetry spans, requires the opentelemetry-api package.
+    """
+
+    def __init__(self, tracer=None):
+        """
+        :param tracer: OpenTelemetry tracer, the tracer of the global tracer provider if None
+        :raise TerraformImproperlyConfigured: The opentelemetry-api package is not installed
+        """
+        try:
+            from opentelemetry import trace
+        except ImportError as exc:
+            raise TerraformImproperlyConfigured(
+                'OpenTelemetry instrumentation requires the opentelemetry-api package') from exc
+
+        self._trace = trace
+        self.tracer = tracer if tracer is not None else trace.get_tracer(INSTRUMENTATION_NAME)
+
+    def emit(self, span: Span) -> None:
+        attributes = {f'crczp.{key}': value for key, value in span.attributes.items()
+                      if isinstance(value, (str, bool, int, float))}
+        attributes['crczp.kind'] = span.kind
+        if span.cpu_time is not None:
+            attributes['crczp.cpu_time'] = span.cpu_time
+        start_time = int(span.started_at * 1e9)
+        otel_span = self.tracer.start_span(span.name, start_time=start_time, attributes=attributes)
+        if span.error is not None:
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=start_time + int(span.duration * 1e9))
+
+
+class Instrumentation:
+    """
+    Creates spans and emits the finished ones to the hooks. Failures of hooks are logged and
+    do not affect the instrumented operations.
+    """
+
+    def __init__(self, hooks: List[InstrumentationHook] = None):
+        """
+        :param hooks: Receivers of finished spans, the instrumentation is disabled if empty
+        """
+        self.hooks = list(hooks or [])
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.hooks)
+
+    def span(self, name: str, kind: str, measure_cpu: bool = False, **attributes):
+        """
+        Start span, usable as a context manager finishing the span at the end of the block.
+
+        :param name: The name of the operation, e.g. 'tofu init' or 'get_image'
+        :param kind: SPAN_KIND_COMMAND, SPAN_KIND_CLOUD or SPAN_KIND_STATE
+        :param measure_cpu: Measure CPU time of child processes
+        :param attributes: Attributes of the span
+        :return: Span object, or a no-op span if the instrumentation is disabled
+        """
+        if not self.hooks:
+            return NULL_SPAN
+        return Span(self, name, kind, measure_cpu, attributes)
+
+    def command_span(self, command: List[str], **attributes):
+        """
+        Start span of a 'tofu' command.
+
+        :param command: The command
+        :param attributes: Attributes of the span, e.g. stack_name
+        :return: Span object, or a no-op span if the instrumentation is disabled
+        """
+        if not self.hooks:
+            return NULL_SPAN
+        # The name contains the subcommand, e.g. 'tofu workspace select', but no values
+        name = ' '.join(command[:3] if len(command) > 1 and command[1] in SUBCOMMAND_GROUPS else command[:2])
+        return Span(self, name, SPAN_KIND_COMMAND, True, dict(attributes, command=' '.join(command)))
+
+    def emit(self, span: Span) -> None:
+        """
+        Emit finished span to all hooks.
+
+        :param span: The finished span
+        :return: None
+        """
+        for hook in self.hooks:
+            try:
+                hook.emit(span)
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.warning('Instrumentation hook failed', hook=type(hook).__name__, error=str(exc))
+
+
+NULL_INSTRUMENTATION = Instrumentation()
+
+
+class CountingReader:
+    """
+    Text stream wrapper counting characters read from the stream
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size: int = -1) -> str:
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+class InstrumentedCloudClient:
+    """
+    Proxy of a cloud client measuring every call of its methods
+    """
+
+    def __init__(self, cloud_client, instrumentation: Instrumentation):
+        self._cloud_client = cloud_client
+        self._instrumentation = instrumentation
+        self._methods: Dict[str, Callable] = {}
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cloud_client, name)
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+        method = self._methods.get(name)
+        if method is None:
+            method = self._instrument(name)
+            self._methods[name] = method
+        return method
+
+    def _instrument(self, name: str) -> Callable:
+        method = getattr(self._cloud_client, name)
+
+        @functools.wraps(method)
+        def instrumented(*args, **kwargs):
+            with self._instrumentation.span(name, SPAN_KIND_CLOUD):
+                return method(*args, **kwargs)
+
+        return instrumented
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+PLUGIN_CACHE_DIR = '/var/tmp/crczp/terraform-plugin-cache/'
+PLUGINS_DIR_NAME = 'plugins'
+PROVIDER_MIRROR_DIR_NAME = 'mirror'
+MIRROR_WORKDIR_NAME = 'mirror-workdir'
+MIRROR_FINGERPRINT_FILE_NAME = '.crczp-mirror.fingerprint'
+CLI_CONFIG_FILE_NAME = 'tofurc'
+# CLI configuration files of the user in the order 'tofu' looks them up
+USER_CLI_CONFIG_PATHS = ('~/.tofurc', '~/.terraformrc')
+# Settings of the user configuration replaced by the generated ones
+CACHE_SETTING_PATTERN = re.compile(r'^\s*(plugin_cache_dir|plugin_cache_may_break_dependency_lock_file)\s*=.*$',
+                                   re.MULTILINE)
+PROVIDER_INSTALLATION_PATTERN = re.compile(r'^\s*provider_installation\s*\{', re.MULTILINE)
+
+
+class TerraformPluginCache:
+    """
+    Shared provider plugin cache and local filesystem mirror used by 'tofu init' of all stacks.
+
+    The cache is configured through a generated CLI configuration file, so provider binaries
+    are downloaded once and only linked into '.terraform/' of every stack directory. The file
+    extends the CLI configuration of the user, e.g. credentials or network mirrors.
+    """
+
+    def __init__(self, cache_dir: str = PLUGIN_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.plugins_dir = os.path.join(cache_dir, PLUGINS_DIR_NAME)
+        self.mirror_dir = os.path.join(cache_dir, PROVIDER_MIRROR_DIR_NAME)
+        self.mirror_workdir = os.path.join(cache_dir, MIRROR_WORKDIR_NAME)
+        self.cli_config_path = os.path.join(cache_dir, CLI_CONFIG_FILE_NAME)
+        self.base_cli_config_path = self._find_user_cli_config()
+        self.lock = threading.Lock()
+        os.makedirs(self.plugins_dir, exist_ok=True)
+        os.makedirs(self.mirror_dir, exist_ok=True)
+        self.write_cli_config()
+
+    def get_environment(self) -> Dict[str, str]:
+        """
+        Get environment variables pointing 'tofu' to the shared cache.
+
+        :return: Dictionary of environment variables
+        """
+        return {
+            'TF_CLI_CONFIG_FILE': self.cli_config_path,
+            'TF_PLUGIN_CACHE_DIR': self.plugins_dir,
+        }
+
+    def list_mirrored_providers(self) -> List[str]:
+        """
+        List provider source addresses available in the local mirror.
+
+        :return: List of addresses in the form hostname/namespace/type
+        """
+        providers = []
+        for hostname in self._list_dirs(self.mirror_dir):
+            for namespace in self._list_dirs(os.path.join(self.mirror_dir, hostname)):
+                for provider_type in self._list_dirs(os.path.join(self.mirror_dir, hostname, namespace)):
+                    providers.append(f'{hostname}/{namespace}/{provider_type}')
+        return sorted(providers)
+
+    def write_cli_config(self) -> None:
+        """
+        Write the CLI configuration file. Providers present in the mirror are installed only from
+        the mirror, all other providers are downloaded directly into the plugin cache. If the user
+        configures provider installation, it is kept and the mirror is not used.
+
+        The file is replaced atomically, so concurrent 'tofu' commands never read it partially.
+
+        :return: None
+        """
+        base_config = self._read_base_cli_config()
+        lines = [base_config.strip()] if base_config.strip() else []
+        lines += [
+            f'plugin_cache_dir = "{self.plugins_dir}"',
+            # New stack directories have no lock file, the cache would not be used otherwise
+            'plugin_cache_may_break_dependency_lock_file = true',
+        ]
+        mirrored = ', '.join(f'"{provider}"' for provider in self.list_mirrored_providers())
+        if mirrored and not PROVIDER_INSTALLATION_PATTERN.search(base_config):
+            lines += [
+                'provider_installation {',
+                '  filesystem_mirror {',
+                f'    path    = "{self.mirror_dir}"',
+                f'    include = [{mirrored}]',
+                '  }',
+                '  direct {',
+                f'    exclude = [{mirrored}]',
+                '  }',
+                '}',
+            ]
+        fd, temp_path = tempfile.mkstemp(prefix=f'.{CLI_CONFIG_FILE_NAME}-', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as file:
+                file.write('\n'.join(lines) + '\n')
+            os.replace(temp_path, self.cli_config_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _find_user_cli_config(self) -> Optional[str]:
+        """
+        Find the CLI configuration file 'tofu' would use without the cache.
+
+        :return: The path to the file or None if the user has none
+        """
+        path = os.environ.get('TF_CLI_CONFIG_FILE')
+        if path and os.path.abspath(path) != os.path.abspath(self.cli_config_path):
+            return path
+        for path in USER_CLI_CONFIG_PATHS:
+            path = os.path.expanduser(path)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _read_base_cli_config(self) -> str:
+        """
+        Read the CLI configuration of the user without settings of the plugin cache.
+
+        :return: The configuration, empty if the user has none
+        """
+        if self.base_cli_config_path is None:
+            return ''
+        try:
+            with open(self.base_cli_config_path) as file:
+                return CACHE_SETTING_PATTERN.sub('', file.read())
+        except FileNotFoundError:
+            return ''
+
+    def is_mirror_current(self, provider: str) -> bool:
+        """
+        Check whether the mirror was populated for the given provider configuration.
+
+        :param provider: Terraform provider configuration
+        :return: True if the mirror is populated
+        """
+        try:
+            with open(os.path.join(self.mirror_dir, MIRROR_FINGERPRINT_FILE_NAME)) as file:
+                return file.read() == self._get_fingerprint(provider)
+        except FileNotFoundError:
+            return False
+
+    def mark_mirror_current(self, provider: str) -> None:
+        """
+        Store fingerprint of the provider configuration the mirror was populated for.
+
+        :param provider: Terraform provider configuration
+        :return: None
+        """
+        with open(os.path.join(self.mirror_dir, MIRROR_FINGERPRINT_FILE_NAME), 'w') as file:
+            file.write(self._get_fingerprint(provider))
+
+    @staticmethod
+    def _get_fingerprint(provider: str) -> str:
+        return hashlib.sha256(provider.encode()).hexdigest()
+
+    @staticmethod
+    def _list_dirs(path: str) -> List[str]:
+        try:
+            return [entry.name for entry in os.scandir(path) if entry.is_dir()]
+        except FileNotFoundError:
+            return []
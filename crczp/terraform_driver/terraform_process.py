@@ -0,0 +1,227 @@
+import contextlib
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from crczp.cloud_commons import CrczpException
+
+from crczp.terraform_driver.terraform_events import TerraformEvent, TerraformResourceEvent, \
+    TerraformChangeSummaryEvent, APPLY_COMPLETE, APPLY_ERRORED, parse_event
+
+STDOUT = 'stdout'
+STDERR = 'stderr'
+DEFAULT_OUTPUT_BUFFER_SIZE = 200
+OUTPUT_QUEUE_SIZE = 1000
+OUTPUT_LOG_FILE_NAME = 'tofu-{}.log'
+
+
+class TerraformOutputLine:
+    """
+    Used to represent a single line of output of a 'tofu' command
+    """
+
+    def __init__(self, stream: str, line: str, timestamp: float):
+        self.stream = stream
+        self.line = line
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return "<TerraformOutputLine\n" \
+               "  stream: {0.stream},\n" \
+               "  timestamp: {0.timestamp},\n" \
+               "  line: {0.line}>\n".format(self)
+
+
+class TerraformProcess:
+    """
+    Wrapper of subprocess.Popen executing a 'tofu' command.
+
+    Stdout and stderr are read at the same time by background threads, so the process never
+    blocks on a full pipe. Only a bounded buffer of recent lines is kept in memory, the full
+    output can be spooled to a log file. Attributes not defined here are delegated to the
+    wrapped Popen object, so the wrapper can be used in place of it.
+    """
+
+    def __init__(self, process: subprocess.Popen, command: List[str] = None, stack_name: str = None,
+                 buffer_size: int = DEFAULT_OUTPUT_BUFFER_SIZE, log_path: str = None):
+        self.process = process
+        self.command = command
+        self.stack_name = stack_name
+        self.log_path = log_path
+        self.recent_lines: deque = deque(maxlen=buffer_size)
+        self.recent_stderr: deque = deque(maxlen=buffer_size)
+        self.output_bytes = 0
+        self.resource_timings: Dict[str, float] = {}
+        self.failed_resources: List[str] = []
+        self.change_summary: Optional[TerraformChangeSummaryEvent] = None
+        self._queue: queue.Queue = queue.Queue(maxsize=OUTPUT_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._readers: List[threading.Thread] = []
+        self._open_readers = 0
+        self._log_file = None
+        self._streamed = False
+        self._detached = False
+
+    def __getattr__(self, name):
+        return getattr(self.process, name)
+
+    def stream_output(self, timeout: float = None) -> Iterator[TerraformOutputLine]:
+        """
+        Stream stdout and stderr of the process as they are produced. The output can be
+        streamed only once.
+
+        :param timeout: The timeout in seconds for the whole output
+        :return: Iterator of TerraformOutputLine objects
+        :raise subprocess.TimeoutExpired: The output was not finished in time
+        """
+        with self._lock:
+            if self._streamed:
+                raise CrczpException('Output of the process is already being streamed')
+            self._streamed = True
+        self._start_readers()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        finished_streams = 0
+        try:
+            while finished_streams < len(self._readers):
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    event = self._queue.get(timeout=remaining)
+                except queue.Empty as exc:
+                    raise subprocess.TimeoutExpired(self.process.args, timeout) from exc
+                if event is None:
+                    finished_streams += 1
+                    continue
+                yield event
+        finally:
+            self._detached = True
+
+    def events(self, timeout: float = None) -> Iterator[TerraformEvent]:
+        """
+        Stream typed events of a command executed with the '-json' option. Elapsed times of
+        completed resources and the final change summary are also recorded on the process.
+
+        :param timeout: The timeout in seconds for the whole output
+        :return: Iterator of TerraformEvent objects
+        :raise subprocess.TimeoutExpired: The output was not finished in time
+        """
+        for output_line in self.stream_output(timeout):
+            if output_line.stream != STDOUT:
+                continue
+            event = parse_event(output_line.line)
+            if event is None:
+                continue
+            if isinstance(event, TerraformResourceEvent):
+                if event.type == APPLY_COMPLETE and event.elapsed_seconds is not None:
+                    self.resource_timings[event.address] = event.elapsed_seconds
+                elif event.type == APPLY_ERRORED:
+                    self.failed_resources.append(event.address)
+            elif isinstance(event, TerraformChangeSummaryEvent):
+                self.change_summary = event
+            yield event
+
+    def get_slowest_resources(self, count: int = 10) -> List[Tuple[str, float]]:
+        """
+        Get resources whose operation took the longest time, known after streaming events.
+
+        :param count: The number of resources
+        :return: List of tuples of resource address and elapsed seconds
+        """
+        return sorted(self.resource_timings.items(), key=lambda item: item[1], reverse=True)[:count]
+
+    def drain(self, timeout: float = None) -> Tuple[str, str, int]:
+        """
+        Consume the output of the process and wait for it to finish, keeping only recent lines.
+
+        :param timeout: The timeout in seconds
+        :return: Tuple of recent stdout, recent stderr and return code
+        :raise subprocess.TimeoutExpired: The process was not finished in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._streamed:
+            for _ in self.stream_output(timeout):
+                pass
+        self._join_readers(deadline)
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        return_code = self.process.wait(remaining)
+        return self.get_recent_output(STDOUT), self.get_recent_output(STDERR), return_code
+
+    def communicate(self, input=None, timeout=None):  # pylint: disable=redefined-builtin
+        """
+        Same as subprocess.Popen.communicate. If the output was streamed, only the recent
+        lines of stderr are returned.
+        """
+        if not self._streamed:
+            return self.process.communicate(input, timeout)
+        _, stderr, _ = self.drain(timeout)
+        return '', stderr
+
+    def get_recent_output(self, stream: str = None) -> str:
+        """
+        Get recent lines of the output.
+
+        :param stream: STDOUT or STDERR, both streams if None
+        :return: Recent lines joined by newline
+        """
+        with self._lock:
+            lines = self.recent_stderr if stream == STDERR else self.recent_lines
+            return '\n'.join(line.line for line in lines if stream is None or line.stream == stream)
+
+    def _start_readers(self) -> None:
+        streams = [(STDOUT, self.process.stdout), (STDERR, self.process.stderr)]
+        streams = [(name, stream) for name, stream in streams if stream is not None]
+        self._open_readers = len(streams)
+        with contextlib.ExitStack() as stack:
+            if self.log_path and streams:
+                # Closed by the last finished reader, or here if the readers cannot be started
+                self._log_file = stack.enter_context(open(self.log_path, 'a'))
+                stack.callback(self._detach_log_file)
+            for name, stream in streams:
+                reader = threading.Thread(target=self._read_stream, args=(name, stream), daemon=True)
+                self._readers.append(reader)
+                reader.start()
+            stack.pop_all()
+
+    def _read_stream(self, name: str, stream) -> None:
+        try:
+            for line in iter(stream.readline, ''):
+                event = TerraformOutputLine(name, line.rstrip('\n'), time.time())
+                with self._lock:
+                    self.output_bytes += len(line)
+                    self.recent_lines.append(event)
+                    if name == STDERR:
+                        self.recent_stderr.append(event)
+                    if self._log_file:
+                        self._log_file.write(f'{event.timestamp:.3f} {name} {line}')
+                self._publish(event)
+        finally:
+            # The log file is closed even if reading or writing of the output fails
+            with self._lock:
+                self._open_readers -= 1
+                if not self._open_readers and self._log_file:
+                    self._log_file.close()
+                    self._log_file = None
+            self._publish(None)
+
+    def _detach_log_file(self) -> None:
+        with self._lock:
+            self._log_file = None
+
+    def _publish(self, event: Optional[TerraformOutputLine]) -> None:
+        while not self._detached:
+            try:
+                self._queue.put(event, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _join_readers(self, deadline: Optional[float]) -> None:
+        self._detached = True
+        for reader in self._readers:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            reader.join(remaining)
+            if reader.is_alive():
+                raise subprocess.TimeoutExpired(self.process.args, remaining)
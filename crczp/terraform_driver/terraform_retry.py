@@ -0,0 +1,252 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+import structlog
+
+LOG = structlog.get_logger()
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_BACKOFF_MULTIPLIER = 2.0
+DEFAULT_RETRY_BUDGET_SIZE = 20
+DEFAULT_RETRY_BUDGET_RATIO = 0.2
+
+# Failures caused by contention or by an overloaded or unreachable service
+RETRYABLE_ERROR_PATTERNS = re.compile('|'.join([
+    r'error acquiring the state lock',
+    r'state (is )?locked',
+    r'lock(ed)? by another',
+    r'too many requests',
+    r'rate ?limit',
+    r'throttl',
+    r'request limit exceeded',
+    r'service unavailable',
+    r'temporarily unavailable',
+    # HTTP status codes only, other numbers in the output are ports, identifiers or counts
+    r'(status|status ?code|response code)[:=]? ?(429|50[234])\b',
+    r'HTTP(/\S+)? (429|50[234])\b',
+    r'but got (429|50[234]) instead',
+    r'bad gateway',
+    r'gateway time-?out',
+    r'connection (refused|reset|timed out)',
+    r'i/o timeout',
+    r'tls handshake timeout',
+    r'context deadline exceeded',
+    r'unexpected eof',
+    r'text file busy',
+    r'could not serialize access',
+    r'deadlock detected',
+    r'pq: .*(connection|terminating|shutting down|too many clients|starting up)',
+]), re.IGNORECASE)
+# Failures which are not fixed by repeating the command, they win over retryable ones
+FATAL_ERROR_PATTERNS = re.compile('|'.join([
+    r'unauthori[sz]ed',
+    r'authentication (failed|required)',
+    r'invalid credentials',
+    r'forbidden',
+    r'quota exceeded',
+    r'unsupported argument',
+    r'invalid (value|reference|resource|configuration)',
+    r'syntax error',
+]), re.IGNORECASE)
+
+
+def is_retryable_error(stderr: str) -> bool:
+    """
+    Classify error output of a failed 'tofu' command.
+
+    :param stderr: The error output of the command
+    :return: True if the failure is transient and the command can be repeated
+    """
+    if not stderr or FATAL_ERROR_PATTERNS.search(stderr):
+        return False
+    return RETRYABLE_ERROR_PATTERNS.search(stderr) is not None
+
+
+class RetryStats:
+    """
+    Used to represent counters of the retry policy
+    """
+
+    def __init__(self, retries: int = 0, recovered: int = 0, exhausted: int = 0, budget_exhausted: int = 0,
+                 fatal: int = 0):
+        self.retries = retries
+        self.recovered = recovered
+        self.exhausted = exhausted
+        self.budget_exhausted = budget_exhausted
+        self.fatal = fatal
+
+    def as_dict(self) -> dict:
+        return {
+            'retries': self.retries,
+            'recovered': self.recovered,
+            'exhausted': self.exhausted,
+            'budget_exhausted': self.budget_exhausted,
+            'fatal': self.fatal,
+        }
+
+    def __repr__(self):
+        return "<RetryStats\n" \
+               "  retries: {0.retries},\n" \
+               "  recovered: {0.recovered},\n" \
+               "  exhausted: {0.exhausted},\n" \
+               "  budget_exhausted: {0.budget_exhausted},\n" \
+               "  fatal: {0.fatal}>\n".format(self)
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries of all commands. Every retry takes one token and every
+    successful command returns a fraction of a token, so retries stay a bounded share of
+    the traffic when a backend is overloaded.
+    """
+
+    def __init__(self, size: float = DEFAULT_RETRY_BUDGET_SIZE, ratio: float = DEFAULT_RETRY_BUDGET_RATIO):
+        """
+        :param size: The maximum number of tokens, the bucket is full at the start
+        :param ratio: Tokens returned by a successful command
+        """
+        self.size = size
+        self.ratio = ratio
+        self._tokens = float(size)
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.size, self._tokens + self.ratio)
+
+
+class RetryPolicy:
+    """
+    Repeats 'tofu' commands failing with a transient error, with exponential backoff and full
+    jitter, so concurrent callers failing at the same time do not retry at the same time.
+    """
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY, multiplier: float = DEFAULT_BACKOFF_MULTIPLIER,
+                 budget: RetryBudget = None, classifier: Callable[[str], bool] = is_retryable_error,
+                 sleep: Callable[[float], None] = time.sleep, rand: Callable[[], float] = random.random):
+        """
+        :param max_attempts: The maximum number of executions of a command, 1 disables retries
+        :param base_delay: The maximum delay in seconds before the first retry
+        :param max_delay: The upper limit of the delay in seconds
+        :param multiplier: The growth of the delay with every attempt
+        :param budget: Retry budget shared by all commands, a new one if None
+        :param classifier: Callable deciding whether an error output is retryable
+        :param sleep: Function used to wait
+        :param rand: Source of random numbers in [0, 1)
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.budget = budget if budget is not None else RetryBudget()
+        self.classifier = classifier
+        self._sleep = sleep
+        self._rand = rand
+        self._stats = RetryStats()
+        self._lock = threading.Lock()
+
+    def get_delay(self, attempt: int) -> float:
+        """
+        Get delay before the next attempt.
+
+        :param attempt: The number of the failed attempt, starting at 1
+        :return: Random delay in seconds between 0 and the exponential backoff
+        """
+        backoff = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return self._rand() * backoff
+
+    def get_stats(self) -> RetryStats:
+        """
+        Get counters of the policy.
+
+        :return: Copy of RetryStats
+        """
+        with self._lock:
+            return RetryStats(**self._stats.as_dict())
+
+    def execute(self, attempt: Callable[[], Tuple[Any, str, int]], **log_context) -> Tuple[Any, str, int]:
+        """
+        Execute the attempt until it succeeds, fails with a fatal error or retries are exhausted.
+
+        :param attempt: Callable executing the command, returns tuple of result, stderr and
+                        return code
+        :param log_context: Values logged with retries
+        :return: Tuple of result, stderr and return code of the last attempt
+        """
+        attempt_number = 1
+        while True:
+            result, stderr, return_code = attempt()
+            delay = self._next_delay(attempt_number, stderr, return_code, log_context)
+            if delay is None:
+                return result, stderr, return_code
+            self._sleep(delay)
+            attempt_number += 1
+
+    async def execute_async(self, attempt: Callable[[], Awaitable[Tuple[Any, str, int]]], **log_context)\
+            -> Tuple[Any, str, int]:
+        """
+        Asynchronous variant of execute.
+
+        :param attempt: Callable returning awaitable of tuple of result, stderr and return code
+        :param log_context: Values logged with retries
+        :return: Tuple of result, stderr and return code of the last attempt
+        """
+        attempt_number = 1
+        while True:
+            result, stderr, return_code = await attempt()
+            delay = self._next_delay(attempt_number, stderr, return_code, log_context)
+            if delay is None:
+                return result, stderr, return_code
+            await asyncio.sleep(delay)
+            attempt_number += 1
+
+    def _next_delay(self, attempt: int, stderr: str, return_code: int, log_context: dict) -> Optional[float]:
+        """
+        Decide whether a command is repeated.
+
+        :return: Delay in seconds before the next attempt or None if the command is not repeated
+        """
+        if not return_code:
+            self.budget.deposit()
+            if attempt > 1:
+                with self._lock:
+                    self._stats.recovered += 1
+            return None
+        if not self.classifier(stderr):
+            with self._lock:
+                self._stats.fatal += 1
+            return None
+        if attempt >= self.max_attempts:
+            with self._lock:
+                self._stats.exhausted += 1
+            return None
+        if not self.budget.withdraw():
+            with self._lock:
+                self._stats.budget_exhausted += 1
+            LOG.warning('Retry budget of tofu commands exhausted', **log_context)
+            return None
+
+        delay = self.get_delay(attempt)
+        with self._lock:
+            self._stats.retries += 1
+        LOG.info('Retrying tofu command after transient failure', attempt=attempt, delay=round(delay, 2),
+                 stderr=stderr, **log_context)
+        return delay
@@ -0,0 +1,340 @@
+import bisect
+import contextlib
+import contextvars
+import itertools
+import threading
+import time
+from typing import Callable, Dict, Generator, List, Optional
+
+import structlog
+
+from crczp.terraform_driver.terraform_exceptions import TerraformCommandQueueTimeout
+
+LOG = structlog.get_logger()
+
+COMMAND_INIT = 'init'
+COMMAND_PLAN = 'plan'
+COMMAND_APPLY = 'apply'
+COMMAND_DESTROY = 'destroy'
+COMMAND_STATE = 'state'
+COMMAND_OTHER = 'other'
+COMMAND_CLASSES = {
+    'init': COMMAND_INIT,
+    'providers': COMMAND_INIT,
+    'plan': COMMAND_PLAN,
+    'apply': COMMAND_APPLY,
+    'destroy': COMMAND_DESTROY,
+    'state': COMMAND_STATE,
+    'workspace': COMMAND_STATE,
+}
+
+# Lower value is served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 10
+PRIORITY_BULK = 20
+DEFAULT_PRIORITIES = {
+    COMMAND_STATE: PRIORITY_INTERACTIVE,
+}
+
+# Commands are not limited unless the limits are set, see TerraformCommandScheduler
+DEFAULT_MAX_COMMANDS = None
+DEFAULT_COMMAND_CLASS_LIMITS: Dict[str, int] = {}
+
+_current_priority: contextvars.ContextVar = contextvars.ContextVar('tofu_command_priority', default=None)
+
+
+def get_command_class(command: List[str]) -> str:
+    """
+    Get class of a 'tofu' command.
+
+    :param command: The command, e.g. ['tofu', 'apply', '-auto-approve']
+    :return: One of COMMAND_INIT, COMMAND_PLAN, COMMAND_APPLY, COMMAND_DESTROY, COMMAND_STATE
+             and COMMAND_OTHER
+    """
+    if len(command) < 2:
+        return COMMAND_OTHER
+    return COMMAND_CLASSES.get(command[1], COMMAND_OTHER)
+
+
+class CommandSlot:
+    """
+    Used to represent a request for execution of a command, granted by the scheduler
+    """
+
+    def __init__(self, command_class: str, priority: int, enqueued_at: float):
+        self.command_class = command_class
+        self.priority = priority
+        self.enqueued_at = enqueued_at
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def wait_time(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        return self.started_at - self.enqueued_at
+
+    def __repr__(self):
+        return "<CommandSlot\n" \
+               "  command_class: {0.command_class},\n" \
+               "  priority: {0.priority},\n" \
+               "  wait_time: {0.wait_time}>\n".format(self)
+
+
+class SchedulerStats:
+    """
+    Used to represent the current load and counters of the command scheduler
+    """
+
+    def __init__(self, queued: int = 0, running: int = 0, started: int = 0, completed: int = 0,
+                 timed_out: int = 0, total_wait_time: float = 0.0, max_wait_time: float = 0.0,
+                 queued_by_class: Dict[str, int] = None, running_by_class: Dict[str, int] = None):
+        self.queued = queued
+        self.running = running
+        self.started = started
+        self.completed = completed
+        self.timed_out = timed_out
+        self.total_wait_time = total_wait_time
+        self.max_wait_time = max_wait_time
+        self.queued_by_class = queued_by_class or {}
+        self.running_by_class = running_by_class or {}
+
+    @property
+    def average_wait_time(self) -> float:
+        return self.total_wait_time / self.started if self.started else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'queued': self.queued,
+            'running': self.running,
+            'started': self.started,
+            'completed': self.completed,
+            'timed_out': self.timed_out,
+            'total_wait_time': self.total_wait_time,
+            'max_wait_time': self.max_wait_time,
+            'average_wait_time': self.average_wait_time,
+            'queued_by_class': dict(self.queued_by_class),
+            'running_by_class': dict(self.running_by_class),
+        }
+
+    def __repr__(self):
+        return "<SchedulerStats\n" \
+               "  queued: {0.queued},\n" \
+               "  running: {0.running},\n" \
+               "  started: {0.started},\n" \
+               "  completed: {0.completed},\n" \
+               "  timed_out: {0.timed_out},\n" \
+               "  average_wait_time: {0.average_wait_time:.3f},\n" \
+               "  max_wait_time: {0.max_wait_time:.3f}>\n".format(self)
+
+
+class TerraformCommandScheduler:
+    """
+    Central scheduler of 'tofu' processes.
+
+    At most max_commands processes run at the same time and each command class has its own
+    limit. Waiting commands are started in the order of priority and arrival; a command whose
+    class is saturated does not hold back commands of other classes. A slot is held until the
+    process exits, so long-running commands returned to callers are counted as well.
+
+    The limits are opt-in. Stack operations wait for a slot while holding the lock of the stack,
+    so callers keeping processes running without waiting for them can exhaust the slots of
+    a class; set queue_timeout to fail such commands instead of waiting for them indefinitely.
+    """
+
+    def __init__(self, max_commands: int = DEFAULT_MAX_COMMANDS, class_limits: Dict[str, int] = None,
+                 queue_timeout: float = None, clock: Callable[[], float] = time.monotonic):
+        """
+        :param max_commands: The maximum number of running processes, unlimited if None
+        :param class_limits: The maximum number of running processes per command class,
+                             unlimited if None
+        :param queue_timeout: The maximum time in seconds a command waits for a slot
+        :param clock: Source of time used for wait times
+        """
+        self.max_commands = max_commands
+        self.class_limits = dict(DEFAULT_COMMAND_CLASS_LIMITS if class_limits is None else class_limits)
+        self.queue_timeout = queue_timeout
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._waiting: List[tuple] = []
+        self._sequence = itertools.count()
+        self._running: Dict[str, int] = {}
+        self._running_total = 0
+        self._stats = SchedulerStats()
+        self._watchers: Dict[threading.Thread, object] = {}
+
+    @staticmethod
+    @contextlib.contextmanager
+    def priority(priority: int) -> Generator[None, None, None]:
+        """
+        Set priority of commands started in the current thread or task within the block.
+
+        :param priority: PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BULK or other integer
+        :return: Context manager
+        """
+        token = _current_priority.set(priority)
+        try:
+            yield
+        finally:
+            _current_priority.reset(token)
+
+    @staticmethod
+    def get_priority(command_class: str) -> int:
+        """
+        Get priority of a command started in the current context.
+
+        :param command_class: The class of the command
+        :return: Priority set by the priority context manager or the default of the class
+        """
+        priority = _current_priority.get()
+        if priority is None:
+            return DEFAULT_PRIORITIES.get(command_class, PRIORITY_NORMAL)
+        return priority
+
+    def acquire(self, command_class: str, priority: int = None, timeout: float = None) -> CommandSlot:
+        """
+        Wait for a free slot for a command of the class.
+
+        :param command_class: The class of the command
+        :param priority: Priority of the command, see get_priority if None
+        :param timeout: The maximum wait time in seconds, queue_timeout if None
+        :return: CommandSlot that must be released when the command finishes
+        :raise TerraformCommandQueueTimeout: No slot was free in time
+        """
+        if priority is None:
+            priority = self.get_priority(command_class)
+        timeout = self.queue_timeout if timeout is None else timeout
+        slot = CommandSlot(command_class, priority, self._clock())
+        entry = (priority, next(self._sequence), slot)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._condition:
+            bisect.insort(self._waiting, entry)
+            self._dispatch()
+            while slot.started_at is None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiting.remove(entry)
+                    self._stats.timed_out += 1
+                    # Removal may unblock waiters held back by this one
+                    self._dispatch()
+                    raise TerraformCommandQueueTimeout(
+                        f'No free slot for tofu {command_class} command in {timeout} seconds')
+                self._condition.wait(remaining)
+        return slot
+
+    def release(self, slot: CommandSlot) -> None:
+        """
+        Release the slot of a finished command.
+
+        :param slot: The slot returned by acquire
+        :return: None
+        """
+        with self._condition:
+            if slot.finished_at is not None:
+                return
+            slot.finished_at = self._clock()
+            self._running[slot.command_class] -= 1
+            self._running_total -= 1
+            self._stats.completed += 1
+            self._dispatch()
+
+    def start(self, command: List[str], start_process: Callable[[], object], priority: int = None,
+              on_exit: Callable[[object], None] = None):
+        """
+        Start a process once a slot for the command is free. The slot is released when the
+        process exits.
+
+        :param command: The command, used to determine its class
+        :param start_process: Callable starting the process, returns subprocess.Popen
+        :param priority: Priority of the command, see get_priority if None
+        :param on_exit: Callable called with the process after it exits
+        :return: The started process
+        :raise TerraformCommandQueueTimeout: No slot was free in time
+        """
+        slot = self.acquire(get_command_class(command), priority)
+        try:
+            process = start_process()
+        except BaseException:
+            self.release(slot)
+            raise
+        watcher = threading.Thread(target=self._watch, args=(process, slot, on_exit), daemon=True)
+        with self._condition:
+            self._watchers[watcher] = process
+        watcher.start()
+        return process
+
+    def wait_for_exit_callbacks(self, timeout: float = None) -> None:
+        """
+        Wait until the exit callbacks of processes which have already exited finish. Processes
+        which are still running are not waited for, their callbacks run when they exit.
+
+        :param timeout: The maximum wait time in seconds for all the callbacks
+        :return: None
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            # The return code is set by the first thread which has waited for the process
+            watchers = [watcher for watcher, process in self._watchers.items()
+                        if getattr(process, 'returncode', None) is not None]
+        for watcher in watchers:
+            watcher.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def get_stats(self) -> SchedulerStats:
+        """
+        Get the current load and counters of the scheduler.
+
+        :return: Copy of SchedulerStats
+        """
+        with self._condition:
+            queued_by_class: Dict[str, int] = {}
+            for _, _, slot in self._waiting:
+                queued_by_class[slot.command_class] = queued_by_class.get(slot.command_class, 0) + 1
+            return SchedulerStats(queued=len(self._waiting), running=self._running_total,
+                                  started=self._stats.started, completed=self._stats.completed,
+                                  timed_out=self._stats.timed_out,
+                                  total_wait_time=self._stats.total_wait_time,
+                                  max_wait_time=self._stats.max_wait_time,
+                                  queued_by_class=queued_by_class,
+                                  running_by_class={name: count for name, count in self._running.items()
+                                                    if count})
+
+    def _has_capacity(self, command_class: str) -> bool:
+        if self.max_commands is not None and self._running_total >= self.max_commands:
+            return False
+        limit = self.class_limits.get(command_class)
+        return limit is None or self._running.get(command_class, 0) < limit
+
+    def _dispatch(self) -> None:
+        # Called with the condition held
+        granted = []
+        for entry in self._waiting:
+            if self.max_commands is not None and self._running_total >= self.max_commands:
+                break
+            slot = entry[2]
+            if not self._has_capacity(slot.command_class):
+                continue
+            slot.started_at = self._clock()
+            self._running[slot.command_class] = self._running.get(slot.command_class, 0) + 1
+            self._running_total += 1
+            self._stats.started += 1
+            self._stats.total_wait_time += slot.wait_time
+            self._stats.max_wait_time = max(self._stats.max_wait_time, slot.wait_time)
+            granted.append(entry)
+        if granted:
+            for entry in granted:
+                self._waiting.remove(entry)
+            self._condition.notify_all()
+
+    def _watch(self, process, slot: CommandSlot, on_exit: Optional[Callable[[object], None]]) -> None:
+        try:
+            process.wait()
+        finally:
+            self.release(slot)
+        if on_exit is not None:
+            try:
+                on_exit(process)
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.warning('Exit callback of tofu process failed', error=str(exc))
+        with self._condition:
+            self._watchers.pop(threading.current_thread(), None)
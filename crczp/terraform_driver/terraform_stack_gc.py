@@ -0,0 +1,423 @@
+"""
+Module containing the garbage collector of stack directories and Terraform workspaces.
+
+Failed creations and manual cleanups leave stack directories without a workspace or state and
+workspaces without a stack directory. Idle stacks keep providers in `.terraform/` and copies of
+their state. The collector removes such directories and workspaces and reclaims the disk space
+of idle stacks, on demand or periodically in a background thread.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from fnmatch import fnmatch
+from typing import Callable, Dict, Iterator, List, Optional
+
+import structlog
+
+from crczp.terraform_driver.terraform_backend import TERRAFORM_STATE_FILE_NAME
+from crczp.terraform_driver.terraform_client_elements import CrczpTerraformBackendType, \
+    CrczpTerraformStackState, TerraformGarbageCollectionReport, TerraformStackRecord
+from crczp.terraform_driver.terraform_client_manager import CrczpTerraformClientManager, TERRAFORM_DATA_DIR, \
+    TERRAFORM_WORKSPACE_PATH
+from crczp.terraform_driver.terraform_process import OUTPUT_LOG_FILE_NAME
+
+LOG = structlog.get_logger()
+
+# Seconds after which stack directories of failed or destroyed stacks are removed
+DEFAULT_GC_RETENTION = 7 * 24 * 60 * 60
+# Seconds after which unused stacks are cleaned
+DEFAULT_GC_IDLE_TIME = 24 * 60 * 60
+# Seconds during which a stack is left alone after its last change, it may be still created
+DEFAULT_GC_GRACE_PERIOD = 60 * 60
+# Stacks removed or cleaned and workspaces deleted in one run
+DEFAULT_GC_MAX_ACTIONS = 100
+# Stacks removed or cleaned and workspaces deleted per second
+DEFAULT_GC_RATE = 2.0
+TERRAFORM_STATE_BACKUP_FILE_NAME = TERRAFORM_STATE_FILE_NAME + '.backup'
+# Stacks whose directory is kept only until the retention passes
+RETIRED_STACK_STATES = (CrczpTerraformStackState.FAILED, CrczpTerraformStackState.DESTROYING)
+# Stacks whose Terraform data may be reclaimed when they are idle
+CLEANABLE_STACK_STATES = (CrczpTerraformStackState.READY, CrczpTerraformStackState.FAILED)
+
+
+class TerraformStackGarbageCollector:
+    """
+    Garbage collector of stack directories and Terraform workspaces.
+
+    A stack directory is removed if the stack has no workspace or its state has no resources,
+    or if the stack failed or was destroyed and the retention has passed. Directories of stacks
+    whose state manages resources are kept, they are needed to destroy the resources, state of
+    the directory stack layout in a remote backend is read before its directory is removed.
+    Idle stacks lose `.terraform/`, spooled output and stale copies of remote state, the stack
+    directory is initialized again on its next use. Every action takes the write lock of the
+    stack and is paced by the rate limit.
+    """
+
+    def __init__(self, manager: CrczpTerraformClientManager, retention: float = DEFAULT_GC_RETENTION,
+                 idle_time: float = DEFAULT_GC_IDLE_TIME, grace_period: float = DEFAULT_GC_GRACE_PERIOD,
+                 max_actions: int = DEFAULT_GC_MAX_ACTIONS, rate: float = DEFAULT_GC_RATE,
+                 delete_orphaned_workspaces: bool = False, clock: Callable[[], float] = time.time):
+        """
+        :param manager: The client manager whose stacks are collected
+        :param retention: Seconds after which directories of failed or destroyed stacks are removed
+        :param idle_time: Seconds after which unused stacks are cleaned, never if None
+        :param grace_period: Seconds during which a changed stack is left alone
+        :param max_actions: The maximum number of actions of one run, unlimited if None
+        :param rate: The maximum number of actions per second, unlimited if None
+        :param delete_orphaned_workspaces: Delete empty workspaces of the shared remote backend
+            which have no stack directory, other clients must not share the backend
+        :param clock: Function returning current time as UNIX timestamp
+        """
+        self.manager = manager
+        self.retention = retention
+        self.idle_time = idle_time
+        self.grace_period = grace_period
+        self.max_actions = max_actions
+        self.rate = rate
+        self.delete_orphaned_workspaces = delete_orphaned_workspaces
+        self.clock = clock
+        self.last_report: Optional[TerraformGarbageCollectionReport] = None
+        self._run_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_action = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float) -> None:
+        """
+        Collect garbage periodically in a daemon thread.
+
+        :param interval: Seconds between the runs
+        :return: None
+        """
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run_periodically, args=(interval, self._stop_event),
+                                        name='terraform-stack-gc', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stop the background thread, a running collection stops before its next action.
+
+        :param timeout: Seconds to wait for the thread to finish
+        :return: None
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # Collections on demand are not stopped
+        self._stop_event = threading.Event()
+
+    def _run_periodically(self, interval: float, stop_event: threading.Event) -> None:
+        while not stop_event.wait(interval):
+            try:
+                self.collect()
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.error('Garbage collection of stacks has failed', error=str(exc))
+
+    def collect(self, dry_run: bool = False) -> TerraformGarbageCollectionReport:
+        """
+        Remove orphaned and stale stack directories and workspaces and clean idle stacks.
+
+        :param dry_run: Only report what would be removed and cleaned
+        :return: TerraformGarbageCollectionReport object
+        """
+        with self._run_lock:
+            start = time.monotonic()
+            report = TerraformGarbageCollectionReport(dry_run)
+            try:
+                self._collect(report)
+            finally:
+                report.duration = time.monotonic() - start
+            LOG.info('Garbage collection of stacks finished', dry_run=dry_run,
+                     removed=len(report.removed_stacks), cleaned=len(report.cleaned_stacks),
+                     deleted_workspaces=len(report.deleted_workspaces), reclaimed_bytes=report.reclaimed_bytes,
+                     errors=len(report.errors), truncated=report.truncated)
+            if not dry_run:
+                self.last_report = report
+            return report
+
+    def _collect(self, report: TerraformGarbageCollectionReport) -> None:
+        records = self._get_stack_records()
+        stack_names = self.manager._list_stack_directories()
+        report.scanned_stacks = len(stack_names)
+        workspaces = None
+        if self._uses_shared_workspaces():
+            workspaces = set(self.manager.list_terraform_workspaces())
+
+        actions = self._plan_actions(stack_names, records, workspaces)
+        on_disk = set(stack_names)
+        if self.delete_orphaned_workspaces and workspaces is not None:
+            actions.extend((self._delete_orphaned_workspace, workspace)
+                           for workspace in sorted(workspaces - on_disk - set(records)))
+        actions.extend((self._unregister_missing_stack, name) for name, record in sorted(records.items())
+                       if name not in on_disk and self._is_past(record.updated_at, self.grace_period))
+
+        for count, (action, name) in enumerate(actions):
+            if self.max_actions is not None and count >= self.max_actions or self._stop_event.is_set():
+                report.truncated = True
+                break
+            if not report.dry_run:
+                self._wait_for_rate_limit()
+            try:
+                action(name, report, workspaces)
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.warning('Garbage collection of stack has failed', stack_name=name, error=str(exc))
+                report.errors[name] = str(exc)
+
+    def _plan_actions(self, stack_names: List[str], records: Dict[str, TerraformStackRecord],
+                      workspaces: Optional[set]) -> list:
+        """
+        Select stacks to remove or clean, the selection is checked again under the stack lock.
+
+        :return: List of tuples of the action and the stack name
+        """
+        removals, cleanups = [], []
+        for stack_name in sorted(stack_names):
+            record = records.get(stack_name)
+            try:
+                if self._should_remove(stack_name, record, workspaces):
+                    removals.append((self._remove_stack, stack_name))
+                elif self._should_clean(stack_name, record):
+                    cleanups.append((self._clean_stack, stack_name))
+            except OSError as exc:
+                # The stack was removed meanwhile
+                LOG.debug('Failed to inspect stack directory', stack_name=stack_name, error=str(exc))
+        return removals + cleanups
+
+    def _get_stack_records(self) -> Dict[str, TerraformStackRecord]:
+        if self.manager.stack_registry is None:
+            return {}
+        return {record.name: record for record in self.manager.stack_registry.list_stacks()}
+
+    def _uses_shared_workspaces(self) -> bool:
+        return self.manager.uses_workspaces and \
+            self.manager.terraform_backend.backend_type != CrczpTerraformBackendType.LOCAL
+
+    def _is_past(self, timestamp: float, period: Optional[float]) -> bool:
+        return period is not None and timestamp + period <= self.clock()
+
+    def _has_state(self, stack_name: str, workspaces: Optional[set]) -> Optional[bool]:
+        """
+        Find out whether the stack may manage resources.
+
+        :param stack_name: The name of stack
+        :param workspaces: Names of workspaces of the shared remote backend
+        :return: False if the stack has no workspace or its state has no resources, None if
+            its state is stored in a remote backend of the directory stack layout
+        """
+        if workspaces is not None:
+            return stack_name in workspaces
+        if self.manager.terraform_backend.backend_type != CrczpTerraformBackendType.LOCAL:
+            return None
+        stack_dir = self.manager.get_stack_dir(stack_name)
+        state_path = os.path.join(stack_dir, TERRAFORM_WORKSPACE_PATH.format(stack_name)) \
+            if self.manager.uses_workspaces else os.path.join(stack_dir, TERRAFORM_STATE_FILE_NAME)
+        try:
+            with open(state_path) as file:
+                return bool(json.load(file).get('resources'))
+        except FileNotFoundError:
+            return False
+        except ValueError:
+            # Terraform is writing the state
+            return True
+
+    def _get_last_activity(self, stack_name: str, record: Optional[TerraformStackRecord]) -> float:
+        """
+        Get time of the last change of the stack, the newest of its record and the modification
+        times of the stack directory, its files and its Terraform data.
+        """
+        stack_dir = self.manager.get_stack_dir(stack_name)
+        times = [os.lstat(stack_dir).st_mtime]
+        if record is not None:
+            times.append(record.updated_at)
+        for directory in (stack_dir, os.path.join(stack_dir, TERRAFORM_DATA_DIR)):
+            try:
+                with os.scandir(directory) as entries:
+                    times.extend(entry.stat(follow_symlinks=False).st_mtime for entry in entries)
+            except FileNotFoundError:
+                pass
+        return max(times)
+
+    def _should_remove(self, stack_name: str, record: Optional[TerraformStackRecord],
+                       workspaces: Optional[set], read_remote_state: bool = False) -> bool:
+        """
+        Decide whether the stack directory is removed.
+
+        :param stack_name: The name of stack
+        :param record: The record of the stack in the stack registry
+        :param workspaces: Names of workspaces of the shared remote backend
+        :param read_remote_state: Read state of the directory stack layout from the remote backend,
+            the caller holds the write lock of the stack. If False, such stacks are only candidates.
+        :return: True if the stack directory is removed
+        """
+        last_activity = self._get_last_activity(stack_name, record)
+        if not self._is_past(last_activity, self.grace_period):
+            return False
+        state = record.state if record is not None else None
+        has_state = self._has_state(stack_name, workspaces)
+        if has_state is False:
+            # Stacks which failed, were destroyed or are not known, dry runs are kept until the retention
+            return state is None or state in RETIRED_STACK_STATES or self._is_past(last_activity, self.retention)
+        if has_state and workspaces is None:
+            # The state manages resources, the directory is needed to destroy them
+            return False
+        if state not in RETIRED_STACK_STATES or not self._is_past(last_activity, self.retention):
+            return False
+        if has_state is None:
+            # The stack has its own state in the remote backend, nothing refuses to delete it
+            return not read_remote_state or not self._has_remote_resources(stack_name)
+        # The workspace is deleted with the directory, Terraform refuses to delete one which is not empty
+        return True
+
+    def _has_remote_resources(self, stack_name: str) -> bool:
+        """
+        Read state of the stack of the directory stack layout from the remote backend.
+
+        :param stack_name: The name of stack
+        :return: True if the state manages resources
+        :raise CrczpException: The state could not be read
+        """
+        state = self.manager._read_terraform_state_directly(stack_name)
+        if state is None:
+            state = self.manager._pull_terraform_state(stack_name)
+        return bool(state.resources)
+
+    def _should_clean(self, stack_name: str, record: Optional[TerraformStackRecord]) -> bool:
+        if record is not None and record.state not in CLEANABLE_STACK_STATES:
+            return False
+        if not self._is_past(self._get_last_activity(stack_name, record), self.idle_time):
+            return False
+        return next(self._list_reclaimable_paths(stack_name), None) is not None
+
+    def _list_reclaimable_paths(self, stack_name: str) -> Iterator[str]:
+        """
+        List paths of data of the stack, which are recreated on its next use.
+
+        :param stack_name: The name of stack
+        :return: Iterator over the paths
+        """
+        stack_dir = self.manager.get_stack_dir(stack_name)
+        data_dir = os.path.join(stack_dir, TERRAFORM_DATA_DIR)
+        if os.path.isdir(data_dir):
+            yield data_dir
+        reclaimable = [OUTPUT_LOG_FILE_NAME.format('*')]
+        if self.manager.terraform_backend.backend_type != CrczpTerraformBackendType.LOCAL:
+            # State of a remote backend copied to the stack directory by older versions
+            reclaimable.extend([TERRAFORM_STATE_FILE_NAME, TERRAFORM_STATE_BACKUP_FILE_NAME])
+        with os.scandir(stack_dir) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False) and any(fnmatch(entry.name, pattern)
+                                                                for pattern in reclaimable):
+                    yield entry.path
+
+    def _remove_stack(self, stack_name: str, report: TerraformGarbageCollectionReport,
+                      workspaces: Optional[set]) -> None:
+        has_workspace = workspaces is not None and stack_name in workspaces
+        # Dry runs check the stack under the lock as well, the remote state may be read
+        with self.manager.stack_locks.write(stack_name):
+            stack_dir = self.manager.get_stack_dir(stack_name)
+            if not os.path.isdir(stack_dir):
+                return
+            record = self.manager.stack_registry.get(stack_name) if self.manager.stack_registry else None
+            if not self._should_remove(stack_name, record, workspaces, read_remote_state=True):
+                return
+            if has_workspace:
+                if not report.dry_run:
+                    self.manager.delete_empty_terraform_workspace(stack_name)
+                report.deleted_workspaces.append(stack_name)
+            size = get_size(stack_dir)
+            if not report.dry_run:
+                if not self.manager.uses_workspaces:
+                    self.manager._delete_stack_state(stack_name)
+                self.manager._remove_stack_directory(stack_name)
+                LOG.info('Stack directory removed by garbage collection', stack_name=stack_name,
+                         reclaimed_bytes=size)
+        report.removed_stacks.append(stack_name)
+        report.reclaimed_bytes += size
+
+    def _clean_stack(self, stack_name: str, report: TerraformGarbageCollectionReport,
+                     workspaces: Optional[set]) -> None:
+        if report.dry_run:
+            report.cleaned_stacks.append(stack_name)
+            report.reclaimed_bytes += sum(get_size(path) for path in self._list_reclaimable_paths(stack_name))
+            return
+        size = 0
+        with self.manager.stack_locks.write(stack_name):
+            if not os.path.isdir(self.manager.get_stack_dir(stack_name)):
+                return
+            record = self.manager.stack_registry.get(stack_name) if self.manager.stack_registry else None
+            if not self._should_clean(stack_name, record):
+                return
+            for path in list(self._list_reclaimable_paths(stack_name)):
+                path_size = get_size(path)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                size += path_size
+        LOG.info('Idle stack cleaned by garbage collection', stack_name=stack_name, reclaimed_bytes=size)
+        report.cleaned_stacks.append(stack_name)
+        report.reclaimed_bytes += size
+
+    def _delete_orphaned_workspace(self, workspace: str, report: TerraformGarbageCollectionReport,
+                                   workspaces: Optional[set]) -> None:
+        if not report.dry_run:
+            with self.manager.stack_locks.write(workspace):
+                if os.path.isdir(self.manager.get_stack_dir(workspace)):
+                    return
+                self.manager.delete_empty_terraform_workspace(workspace)
+            LOG.info('Orphaned workspace deleted by garbage collection', workspace=workspace)
+        report.deleted_workspaces.append(workspace)
+
+    def _unregister_missing_stack(self, stack_name: str, report: TerraformGarbageCollectionReport,
+                                  workspaces: Optional[set]) -> None:
+        if not report.dry_run:
+            with self.manager.stack_locks.write(stack_name):
+                if os.path.isdir(self.manager.get_stack_dir(stack_name)):
+                    return
+                self.manager._unregister_stack(stack_name)
+        report.unregistered_stacks.append(stack_name)
+
+    def _wait_for_rate_limit(self) -> None:
+        if not self.rate:
+            return
+        delay = self._last_action + 1 / self.rate - time.monotonic()
+        if delay > 0:
+            self._stop_event.wait(delay)
+        self._last_action = time.monotonic()
+
+
+def get_size(path: str) -> int:
+    """
+    Get disk usage of the file or directory, symbolic links are not followed.
+
+    :param path: The path to the file or directory
+    :return: The size in bytes
+    """
+    try:
+        size = _get_disk_usage(os.lstat(path))
+    except FileNotFoundError:
+        return 0
+    if os.path.islink(path) or not os.path.isdir(path):
+        return size
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                size += _get_disk_usage(os.lstat(os.path.join(root, name)))
+            except FileNotFoundError:
+                continue
+    return size
+
+
+def _get_disk_usage(stat: os.stat_result) -> int:
+    # Allocated blocks are not reported on Windows
+    return stat.st_blocks * 512 if hasattr(stat, 'st_blocks') else stat.st_size
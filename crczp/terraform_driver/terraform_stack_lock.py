@@ -0,0 +1,232 @@
+import contextlib
+import os
+import threading
+import weakref
+from typing import Callable, Dict, Generator, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from crczp.terraform_driver.terraform_exceptions import TerraformImproperlyConfigured
+
+STACK_LOCK_FILE_NAME = '{}.lock'
+
+
+class ReadWriteLock:
+    """
+    Lock shared by readers and exclusive for a writer. Waiting writers are preferred, so
+    readers cannot starve them. The lock is not reentrant and may be released by another
+    thread than the one which acquired it.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self) -> None:
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self) -> None:
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self) -> None:
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self) -> None:
+        with self._condition:
+            self._writer = False
+            self._condition.notify_all()
+
+
+class StackLockHandle:
+    """
+    Used to represent an acquired lock of a stack
+    """
+
+    def __init__(self, stack_name: str, exclusive: bool, lock: ReadWriteLock, lock_file=None):
+        self.stack_name = stack_name
+        self.exclusive = exclusive
+        self.lock = lock
+        self.lock_file = lock_file
+
+    def __repr__(self):
+        return "<StackLockHandle\n" \
+               "  stack_name: {0.stack_name},\n" \
+               "  exclusive: {0.exclusive}>\n".format(self)
+
+
+class TerraformStackLocks:
+    """
+    Read/write locks of stacks. Operations changing the stack directory or the stack take the
+    lock exclusively, state reads share it.
+
+    If lock_dir is set, the in-process lock is combined with an 'fcntl' lock of a file in the
+    directory, so the stacks are locked across worker processes as well.
+    """
+
+    def __init__(self, lock_dir: str = None):
+        """
+        :param lock_dir: Directory of lock files, only in-process locks are used if None
+        :raise TerraformImproperlyConfigured: File locks are not supported on the platform
+        """
+        if lock_dir and fcntl is None:
+            raise TerraformImproperlyConfigured('File locks of stacks require the fcntl module')
+        self.lock_dir = lock_dir
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        self._locks: weakref.WeakValueDictionary[str, ReadWriteLock] = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def acquire(self, stack_name: str, exclusive: bool) -> StackLockHandle:
+        """
+        Acquire lock of the stack, blocks until it is available.
+
+        :param stack_name: The name of stack
+        :param exclusive: Acquire the lock exclusively, shared otherwise
+        :return: StackLockHandle that must be passed to release
+        """
+        with self._lock:
+            lock = self._locks.get(stack_name)
+            if lock is None:
+                lock = ReadWriteLock()
+                self._locks[stack_name] = lock
+
+        if exclusive:
+            lock.acquire_write()
+        else:
+            lock.acquire_read()
+        handle = StackLockHandle(stack_name, exclusive, lock)
+        if self.lock_dir:
+            try:
+                handle.lock_file = self._lock_file(stack_name, exclusive)
+            except BaseException:
+                self._release_lock(handle)
+                raise
+        return handle
+
+    def release(self, handle: StackLockHandle) -> None:
+        """
+        Release lock of the stack.
+
+        :param handle: The handle returned by acquire
+        :return: None
+        """
+        if handle.lock_file is not None:
+            try:
+                fcntl.flock(handle.lock_file, fcntl.LOCK_UN)
+            finally:
+                handle.lock_file.close()
+                handle.lock_file = None
+        self._release_lock(handle)
+
+    @contextlib.contextmanager
+    def read(self, stack_name: str) -> Generator[StackLockHandle, None, None]:
+        """
+        Hold shared lock of the stack within the block.
+
+        :param stack_name: The name of stack
+        :return: Context manager
+        """
+        handle = self.acquire(stack_name, exclusive=False)
+        try:
+            yield handle
+        finally:
+            self.release(handle)
+
+    @contextlib.contextmanager
+    def write(self, stack_name: str) -> Generator[StackLockHandle, None, None]:
+        """
+        Hold exclusive lock of the stack within the block.
+
+        :param stack_name: The name of stack
+        :return: Context manager
+        """
+        handle = self.acquire(stack_name, exclusive=True)
+        try:
+            yield handle
+        finally:
+            self.release(handle)
+
+    def _lock_file(self, stack_name: str, exclusive: bool):
+        with contextlib.ExitStack() as stack:
+            # The file is closed if locking fails, otherwise it is kept open by the handle
+            lock_file = stack.enter_context(
+                open(os.path.join(self.lock_dir, STACK_LOCK_FILE_NAME.format(stack_name)), 'a'))
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            stack.pop_all()
+        return lock_file
+
+    @staticmethod
+    def _release_lock(handle: StackLockHandle) -> None:
+        if handle.exclusive:
+            handle.lock.release_write()
+        else:
+            handle.lock.release_read()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Executes a function at most once at a time per key. Callers arriving while the function
+    is in flight wait for it and share its result or exception.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, function: Callable, *args, **kwargs):
+        """
+        Execute the function or join its execution in flight.
+
+        :param key: The key of the execution
+        :param function: The function
+        :param args, kwargs: Arguments of the function
+        :return: The result of the function
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function(*args, **kwargs)
+            return flight.result
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
@@ -0,0 +1,228 @@
+"""
+Module containing persistent registry of stacks backed by SQLite.
+
+The registry records the state of every stack managed by the client, so stacks can be listed
+and filtered without scanning the stacks directory. It can be rebuilt from the stacks directory
+by the reconciliation of the client manager.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from crczp.terraform_driver.terraform_client_elements import CrczpTerraformStackState, TerraformStackRecord
+
+STACK_REGISTRY_FILE_NAME = '.stack-registry.sqlite3'
+# Seconds a connection waits for a lock held by another process
+DEFAULT_REGISTRY_TIMEOUT = 30.0
+STACK_REGISTRY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stacks (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    template_hash TEXT,
+    state_serial INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS stacks_state_name ON stacks (state, name);
+"""
+RECORD_COLUMNS = 'name, state, created_at, updated_at, template_hash, state_serial, error'
+
+
+class TerraformStackRegistry:
+    """
+    Registry of stacks stored in a SQLite database.
+
+    A single connection is shared by the threads of the process, concurrent processes are
+    serialized by the locks of SQLite. The database should be placed on a local filesystem,
+    locking of SQLite is not reliable on some network filesystems.
+    """
+
+    def __init__(self, path: str, timeout: float = DEFAULT_REGISTRY_TIMEOUT,
+                 clock: Callable[[], float] = time.time):
+        """
+        :param path: Path to the database file
+        :param timeout: Seconds to wait for a lock held by another process
+        :param clock: Function returning current time as UNIX timestamp
+        """
+        self.path = path
+        self.timeout = timeout
+        self.clock = clock
+        self._connection: Optional[sqlite3.Connection] = None
+        self._created = False
+        self._lock = threading.Lock()
+        # Serials already recorded, so repeated reads of an unchanged state do not write
+        self._state_serials: Dict[str, int] = {}
+
+    def initialize(self) -> bool:
+        """
+        Open the database and create its schema if it does not exist.
+
+        :return: True if the registry was created, so it should be reconciled with the stacks
+        """
+        with self._lock:
+            self._connect()
+            return self._created
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False)
+            self._created = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stacks'").fetchone() is None
+            connection.executescript(STACK_REGISTRY_SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _execute(self, query: str, parameters: Iterable = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connect().execute(query, tuple(parameters))
+
+    def _fetch(self, query: str, parameters: Iterable = ()) -> list:
+        with self._lock:
+            return self._connect().execute(query, tuple(parameters)).fetchall()
+
+    def set_state(self, stack_name: str, state: CrczpTerraformStackState, template_hash: str = None,
+                  error: str = None, created_at: float = None) -> None:
+        """
+        Record state of the stack, the stack is registered if it is not.
+
+        :param stack_name: The name of stack
+        :param state: The new state
+        :param template_hash: Hash of the template of the stack, the recorded one is kept if None
+        :param error: Description of the failure of the stack
+        :param created_at: Time of creation of a newly registered stack, the current time if None
+        :return: None
+        """
+        now = self.clock()
+        self._state_serials.pop(stack_name, None)
+        self._execute('INSERT INTO stacks (name, state, created_at, updated_at, template_hash, error) '
+                      'VALUES (?, ?, ?, ?, ?, ?) '
+                      'ON CONFLICT (name) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at, '
+                      'template_hash = COALESCE(excluded.template_hash, stacks.template_hash), '
+                      'error = excluded.error',
+                      (stack_name, state.value, now if created_at is None else created_at, now, template_hash, error))
+
+    def update_state(self, stack_name: str, state: CrczpTerraformStackState, error: str = None) -> bool:
+        """
+        Record state of a registered stack.
+
+        :param stack_name: The name of stack
+        :param state: The new state
+        :param error: Description of the failure of the stack
+        :return: True if the stack is registered
+        """
+        self._state_serials.pop(stack_name, None)
+        cursor = self._execute('UPDATE stacks SET state = ?, updated_at = ?, error = ? WHERE name = ?',
+                               (state.value, self.clock(), error, stack_name))
+        return cursor.rowcount > 0
+
+    def set_state_serial(self, stack_name: str, serial: int) -> None:
+        """
+        Record serial of the last read Terraform state of a registered stack. The serial is written
+        only if it differs from the one recorded since the last change of state of the stack.
+
+        :param stack_name: The name of stack
+        :param serial: The serial of the state
+        :return: None
+        """
+        if self._state_serials.get(stack_name) == serial:
+            return
+        self._execute('UPDATE stacks SET state_serial = ? WHERE name = ? AND state_serial IS NOT ?',
+                      (serial, stack_name, serial))
+        self._state_serials[stack_name] = serial
+
+    def remove(self, stack_name: str) -> None:
+        """
+        Remove the stack from the registry.
+
+        :param stack_name: The name of stack
+        :return: None
+        """
+        self._state_serials.pop(stack_name, None)
+        self._execute('DELETE FROM stacks WHERE name = ?', (stack_name,))
+
+    def get(self, stack_name: str) -> Optional[TerraformStackRecord]:
+        """
+        Get record of the stack.
+
+        :param stack_name: The name of stack
+        :return: TerraformStackRecord object or None if the stack is not registered
+        """
+        rows = self._fetch(f'SELECT {RECORD_COLUMNS} FROM stacks WHERE name = ?', (stack_name,))
+        return self._create_record(rows[0]) if rows else None
+
+    def list_stacks(self, states: List[CrczpTerraformStackState] = None, name_prefix: str = None,
+                    limit: int = None, after: str = None) -> List[TerraformStackRecord]:
+        """
+        List records of stacks ordered by name.
+
+        :param states: Return only stacks in these states, all stacks if None
+        :param name_prefix: Return only stacks whose name starts with the prefix
+        :param limit: The maximum number of returned stacks, all if None
+        :param after: Return only stacks whose name follows this name, the name of the last stack
+            of the previous page
+        :return: List of TerraformStackRecord objects
+        """
+        conditions, parameters = self._get_conditions(states, name_prefix)
+        if after is not None:
+            conditions.append('name > ?')
+            parameters.append(after)
+        query = f'SELECT {RECORD_COLUMNS} FROM stacks'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY name'
+        if limit is not None:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+        return [self._create_record(row) for row in self._fetch(query, parameters)]
+
+    def count_stacks(self, states: List[CrczpTerraformStackState] = None, name_prefix: str = None) -> int:
+        """
+        Count stacks.
+
+        :param states: Count only stacks in these states, all stacks if None
+        :param name_prefix: Count only stacks whose name starts with the prefix
+        :return: The number of stacks
+        """
+        conditions, parameters = self._get_conditions(states, name_prefix)
+        query = 'SELECT COUNT(*) FROM stacks'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        return self._fetch(query, parameters)[0][0]
+
+    @staticmethod
+    def _get_conditions(states: Optional[List[CrczpTerraformStackState]], name_prefix: Optional[str])\
+            -> Tuple[List[str], list]:
+        conditions, parameters = [], []
+        if states is not None:
+            conditions.append('state IN ({})'.format(', '.join('?' * len(states))))
+            parameters.extend(state.value for state in states)
+        if name_prefix:
+            # Range of names with the prefix, unlike LIKE it uses the primary key index
+            conditions.append('name >= ? AND name < ?')
+            parameters.extend([name_prefix, name_prefix[:-1] + chr(ord(name_prefix[-1]) + 1)])
+        return conditions, parameters
+
+    @staticmethod
+    def _create_record(row: tuple) -> TerraformStackRecord:
+        name, state, created_at, updated_at, template_hash, state_serial, error = row
+        return TerraformStackRecord(name, CrczpTerraformStackState(state), created_at, updated_at,
+                                    template_hash, state_serial, error)
+
+    def close(self) -> None:
+        """
+        Close the database connection, it is opened again on the next use.
+
+        :return: None
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from crczp.terraform_driver.terraform_client_elements import TerraformState
+
+DEFAULT_STATE_CACHE_TTL = 15
+DEFAULT_STATE_CACHE_SIZE = 256
+
+
+class CacheStats:
+    """
+    Used to represent counters of a cache
+    """
+
+    def __init__(self, hits: int = 0, misses: int = 0, evictions: int = 0, expirations: int = 0,
+                 invalidations: int = 0, rejected: int = 0):
+        self.hits = hits
+        self.misses = misses
+        self.evictions = evictions
+        self.expirations = expirations
+        self.invalidations = invalidations
+        self.rejected = rejected
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'rejected': self.rejected,
+            'hit_rate': self.hit_rate,
+        }
+
+    def __repr__(self):
+        return "<CacheStats\n" \
+               "  hits: {0.hits},\n" \
+               "  misses: {0.misses},\n" \
+               "  evictions: {0.evictions},\n" \
+               "  expirations: {0.expirations},\n" \
+               "  invalidations: {0.invalidations},\n" \
+               "  rejected: {0.rejected},\n" \
+               "  hit_rate: {0.hit_rate:.2f}>\n".format(self)
+
+
+class TerraformStateCache:
+    """
+    In-process LRU cache of parsed Terraform states keyed by stack name.
+
+    Every stack has a generation which is increased on invalidation. A state pulled before
+    the invalidation is not stored, as well as a state older (lower serial of the same lineage)
+    than the one already cached.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_STATE_CACHE_TTL, max_size: int = DEFAULT_STATE_CACHE_SIZE,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        self._stats = CacheStats()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+    def get(self, stack_name: str) -> Optional[TerraformState]:
+        """
+        Get cached Terraform state of the stack.
+
+        :param stack_name: The name of stack
+        :return: TerraformState object or None if it is not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.get(stack_name)
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            state, expires_at = entry
+            if self._clock() >= expires_at:
+                del self._entries[stack_name]
+                self._stats.expirations += 1
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(stack_name)
+            self._stats.hits += 1
+            return state
+
+    def generation(self, stack_name: str) -> Tuple[int, int]:
+        """
+        Get the current generation of the stack. Pass it to `put` to detect invalidations
+        which happened while the state was being pulled.
+
+        :param stack_name: The name of stack
+        :return: The generation
+        """
+        with self._lock:
+            return self._epoch, self._generations.get(stack_name, 0)
+
+    def put(self, stack_name: str, state: TerraformState, generation: Tuple[int, int] = None) -> bool:
+        """
+        Store Terraform state of the stack.
+
+        :param stack_name: The name of stack
+        :param state: The parsed Terraform state
+        :param generation: The generation obtained before the state was pulled
+        :return: True if the state was stored, False if it was rejected as outdated
+        """
+        if not self.enabled:
+            return False
+
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(stack_name, 0)):
+                self._stats.rejected += 1
+                return False
+            cached = self._entries.get(stack_name)
+            if cached is not None and cached[0].lineage == state.lineage \
+                    and cached[0].serial > state.serial:
+                self._stats.rejected += 1
+                return False
+
+            self._entries[stack_name] = (state, self._clock() + self.ttl)
+            self._entries.move_to_end(stack_name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+            return True
+
+    def invalidate(self, stack_name: str) -> None:
+        """
+        Drop cached Terraform state of the stack and increase its generation.
+
+        :param stack_name: The name of stack
+        :return: None
+        """
+        with self._lock:
+            self._generations[stack_name] = self._generations.get(stack_name, 0) + 1
+            if self._entries.pop(stack_name, None) is not None:
+                self._stats.invalidations += 1
+
+    def clear(self) -> None:
+        """
+        Drop all cached Terraform states.
+
+        :return: None
+        """
+        with self._lock:
+            self._epoch += 1
+            self._stats.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def get_stats(self) -> CacheStats:
+        """
+        Get snapshot of cache counters.
+
+        :return: CacheStats object
+        """
+        with self._lock:
+            return CacheStats(**vars(self._stats))
+
+    def __len__(self):
+        return len(self._entries)
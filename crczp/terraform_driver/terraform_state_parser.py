@@ -0,0 +1,162 @@
+"""
+Module containing streaming parser of the Terraform state document produced by 'tofu state pull'.
+
+Resources are decoded one by one directly from the stream and only managed resources are kept,
+so the memory used by the parser is bounded by the size of the largest resource, not of the
+whole state.
+"""
+
+import json
+from typing import Iterable, Optional, TextIO
+
+from crczp.terraform_driver.terraform_client_elements import TerraformState
+
+STATE_READ_CHUNK_SIZE = 64 * 1024
+MANAGED_RESOURCE_MODE = 'managed'
+JSON_WHITESPACE = ' \t\n\r'
+
+# Attributes of resources read by the client and by the supported cloud clients. Passed as
+# state_attributes of the client, the parsed states keep only these and use less memory.
+CLIENT_STATE_ATTRIBUTES = (
+    'id', 'mac_address', 'network', 'block_device', 'all_fixed_ips', 'image_id', 'power_state',
+    'flavor_name', 'private_ip_list', 'ami', 'instance_state', 'instance_type',
+)
+
+
+class _JsonStreamReader:
+    """
+    Reads JSON values one by one from a text stream read in chunks
+    """
+
+    def __init__(self, stream: TextIO, chunk_size: int):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size: int = 0) -> bool:
+        if self.eof:
+            return False
+        chunk = self.stream.read(max(size, self.chunk_size))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in JSON_WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                return ''
+
+    def next_char(self) -> str:
+        char = self.peek()
+        if not char:
+            raise ValueError('Unexpected end of Terraform state')
+        self.position += 1
+        return char
+
+    def expect(self, expected: str) -> None:
+        char = self.next_char()
+        if char != expected:
+            raise ValueError(f'Invalid Terraform state: expected "{expected}", got "{char}"')
+
+    def next_item(self, closing: str) -> bool:
+        char = self.next_char()
+        if char == closing:
+            return False
+        if char != ',':
+            raise ValueError(f'Invalid Terraform state: expected "," or "{closing}", got "{char}"')
+        return True
+
+    def decode_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                # Grow the buffer geometrically, so a large value is not decoded too many times
+                if not self._fill(len(self.buffer) - self.position):
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.position = end
+            return value
+
+    def drain(self) -> None:
+        while self._fill():
+            self.position = len(self.buffer)
+
+
+def _project_resource(resource: dict, attributes: Optional[frozenset]) -> dict:
+    """
+    Keep only the selected attributes of all instances of the resource.
+    """
+    if attributes is None:
+        return resource
+    for instance in resource.get('instances') or []:
+        instance_attributes = instance.get('attributes')
+        if instance_attributes:
+            instance['attributes'] = {key: value for key, value in instance_attributes.items()
+                                      if key in attributes}
+    return resource
+
+
+def parse_terraform_state(stream: TextIO, attributes: Iterable[str] = None,
+                          chunk_size: int = STATE_READ_CHUNK_SIZE) -> TerraformState:
+    """
+    Parse Terraform state document from the stream, keeping only managed resources.
+
+    :param stream: Text stream containing the Terraform state, e.g. stdout of 'tofu state pull'
+    :param attributes: Names of resource attributes that are kept, all attributes if None
+    :param chunk_size: The number of characters read from the stream at once
+    :return: TerraformState object, empty if the stream is empty
+    :raise ValueError: The stream does not contain valid Terraform state
+    """
+    projection = None if attributes is None else frozenset(attributes)
+    reader = _JsonStreamReader(stream, chunk_size)
+    serial, lineage, resources = 0, '', []
+
+    if not reader.peek():
+        return TerraformState(serial, lineage, resources)
+
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.next_char()
+    else:
+        while True:
+            key = reader.decode_value()
+            reader.expect(':')
+            if key == 'resources':
+                reader.expect('[')
+                if reader.peek() == ']':
+                    reader.next_char()
+                else:
+                    while True:
+                        resource = reader.decode_value()
+                        if not isinstance(resource, dict):
+                            raise ValueError('Invalid Terraform state: resource is not an object')
+                        if resource.get('mode') == MANAGED_RESOURCE_MODE:
+                            resources.append(_project_resource(resource, projection))
+                        if not reader.next_item(']'):
+                            break
+            else:
+                value = reader.decode_value()
+                if key == 'serial':
+                    serial = value
+                elif key == 'lineage':
+                    lineage = value
+            if not reader.next_item('}'):
+                break
+
+    reader.drain()
+    return TerraformState(serial, lineage, resources)
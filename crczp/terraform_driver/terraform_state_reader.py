@@ -0,0 +1,205 @@
+import contextlib
+import io
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+import structlog
+
+from crczp.terraform_driver.terraform_backend import CrczpTerraformBackend
+from crczp.terraform_driver.terraform_client_elements import CrczpTerraformBackendType, TerraformState, \
+    CrczpTerraformStackLayout
+from crczp.terraform_driver.terraform_state_parser import parse_terraform_state
+
+try:
+    import psycopg2
+except ImportError:  # pragma: no cover
+    psycopg2 = None
+
+LOG = structlog.get_logger()
+
+POSTGRES_STATES_TABLE = 'terraform_remote_state.states'
+POSTGRES_STACK_STATES_TABLE = 'states'
+POSTGRES_DEFAULT_WORKSPACE = 'default'
+
+
+class PostgresTerraformStateReader:
+    """
+    Reads Terraform states directly from the table of the Postgres backend, without 'tofu'.
+
+    A single connection is kept open and shared by all reads. States of multiple stacks are
+    fetched by a single query. In the directory stack layout, every stack has its own schema
+    given by stack_schema and its state is stored in the default workspace.
+    """
+
+    def __init__(self, connect: Callable[[], object], table: str = POSTGRES_STATES_TABLE,
+                 placeholder: str = '%s', attributes: Iterable[str] = None,
+                 stack_schema: Callable[[str], str] = None):
+        """
+        :param connect: Callable returning a new DB-API connection
+        :param table: The table containing states, it has the columns name and data
+        :param placeholder: The placeholder of query parameters of the DB-API driver
+        :param attributes: Names of resource attributes that are kept, all attributes if None
+        :param stack_schema: Callable returning schema of a stack, states are read from the
+                             workspaces of the table if None
+        """
+        self._connect = connect
+        self.stack_schema = stack_schema
+        self.table = table
+        self.placeholder = placeholder
+        self.attributes = attributes
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_db_configuration(cls, db_configuration: dict, attributes: Iterable[str] = None,
+                              stack_schema: Callable[[str], str] = None)\
+            -> Optional['PostgresTerraformStateReader']:
+        """
+        Create reader using the same database configuration as the Postgres backend.
+
+        :param db_configuration: Dictionary with keys user, password, host and name
+        :param attributes: Names of resource attributes that are kept, all attributes if None
+        :param stack_schema: Callable returning schema of a stack in the directory stack layout
+        :return: PostgresTerraformStateReader or None if the psycopg2 driver is not installed
+        """
+        if psycopg2 is None:
+            LOG.warning('Direct reads of Terraform state require psycopg2, install the postgres extra;'
+                        ' Terraform state is pulled by tofu')
+            return None
+
+        def connect():
+            return psycopg2.connect(user=db_configuration['user'], password=db_configuration['password'],
+                                    host=db_configuration['host'], dbname=db_configuration['name'])
+        return cls(connect, attributes=attributes, stack_schema=stack_schema)
+
+    def read_state(self, workspace: str) -> Optional[TerraformState]:
+        """
+        Read Terraform state of one workspace.
+
+        :param workspace: The name of the workspace
+        :return: TerraformState or None if the state is not stored in the table
+        """
+        return self.read_states([workspace]).get(workspace)
+
+    def read_states(self, workspaces: List[str]) -> Dict[str, TerraformState]:
+        """
+        Read Terraform states of multiple workspaces in a single query.
+
+        :param workspaces: The names of workspaces
+        :return: Dictionary of TerraformState keyed by workspace, missing states are omitted
+        """
+        if not workspaces:
+            return {}
+
+        with self._lock:
+            connection = self._get_connection()
+            try:
+                cursor = connection.cursor()
+                try:
+                    if self.stack_schema is None:
+                        rows = self._fetch_workspace_states(cursor, workspaces)
+                    else:
+                        rows = self._fetch_stack_schema_states(cursor, workspaces)
+                finally:
+                    cursor.close()
+                # Do not keep the transaction open between reads
+                connection.rollback()
+            except Exception:
+                self._close_connection()
+                raise
+
+        return {name: parse_terraform_state(io.StringIO(data), self.attributes)
+                for name, data in rows if data}
+
+    def _fetch_workspace_states(self, cursor, workspaces: List[str]) -> list:
+        placeholders = ', '.join([self.placeholder] * len(workspaces))
+        cursor.execute(f'SELECT name, data FROM {self.table} WHERE name IN ({placeholders})',
+                       list(workspaces))
+        return cursor.fetchall()
+
+    def _fetch_stack_schema_states(self, cursor, stack_names: List[str]) -> list:
+        schemas = {stack_name: self.stack_schema(stack_name) for stack_name in stack_names}
+        # Schemas of stacks are created by the backend on the first use
+        placeholders = ', '.join([self.placeholder] * len(schemas))
+        cursor.execute(f'SELECT nspname FROM pg_namespace WHERE nspname IN ({placeholders})',
+                       list(schemas.values()))
+        existing = {row[0] for row in cursor.fetchall()}
+
+        queries, parameters = [], []
+        for stack_name, schema in schemas.items():
+            if schema not in existing:
+                continue
+            queries.append(f'SELECT {self.placeholder}, data FROM {_quote_identifier(schema)}.'
+                           f'{POSTGRES_STACK_STATES_TABLE} WHERE name = {self.placeholder}')
+            parameters.extend([stack_name, POSTGRES_DEFAULT_WORKSPACE])
+        if not queries:
+            return []
+        cursor.execute(' UNION ALL '.join(queries), parameters)
+        return cursor.fetchall()
+
+    def drop_stack_schema(self, stack_name: str) -> None:
+        """
+        Drop the schema holding the state of the stack in the directory stack layout.
+
+        :param stack_name: The name of stack
+        :return: None
+        :raise ValueError: The reader does not read states of the directory stack layout
+        """
+        if self.stack_schema is None:
+            raise ValueError('States are not stored in schemas of stacks')
+        with self._lock:
+            connection = self._get_connection()
+            try:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(f'DROP SCHEMA IF EXISTS {_quote_identifier(self.stack_schema(stack_name))} CASCADE')
+                finally:
+                    cursor.close()
+                connection.commit()
+            except Exception:
+                self._close_connection()
+                raise
+
+    def close(self) -> None:
+        """
+        Close the shared connection.
+
+        :return: None
+        """
+        with self._lock:
+            self._close_connection()
+
+    def _get_connection(self):
+        if self._connection is None:
+            self._connection = self._connect()
+        return self._connection
+
+    def _close_connection(self) -> None:
+        if self._connection is not None:
+            with contextlib.suppress(Exception):
+                self._connection.close()
+            self._connection = None
+
+
+def _quote_identifier(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def create_state_reader(terraform_backend: CrczpTerraformBackend, attributes: Iterable[str] = None,
+                        stack_layout: CrczpTerraformStackLayout = CrczpTerraformStackLayout.WORKSPACE)\
+        -> Optional[PostgresTerraformStateReader]:
+    """
+    Create reader of Terraform states bypassing 'tofu' if the backend supports it.
+
+    :param terraform_backend: The Terraform backend
+    :param attributes: Names of resource attributes that are kept, all attributes if None
+    :param stack_layout: The layout of stacks in the backend
+    :return: The state reader or None if states have to be pulled by 'tofu'
+    """
+    if terraform_backend.backend_type != CrczpTerraformBackendType.POSTGRES:
+        return None
+    stack_schema = None
+    if stack_layout == CrczpTerraformStackLayout.DIRECTORY:
+        stack_schema = terraform_backend.get_stack_schema_name
+    return PostgresTerraformStateReader.from_db_configuration(terraform_backend.db_configuration,
+                                                              attributes, stack_schema)
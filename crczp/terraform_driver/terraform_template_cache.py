@@ -0,0 +1,135 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from crczp.cloud_commons import TopologyInstance, TransformationConfiguration
+
+from crczp.terraform_driver.terraform_stack_lock import SingleFlight
+from crczp.terraform_driver.terraform_state_cache import CacheStats
+
+DEFAULT_TEMPLATE_CACHE_SIZE = 64
+RESOURCE_PREFIX_PLACEHOLDER = 'crczp-resource-prefix-placeholder'
+RESOURCE_PREFIX_ARGUMENT = 'resource_prefix'
+
+
+def get_template_fingerprint(topology_instance: TopologyInstance, trc: TransformationConfiguration,
+                             *args, **kwargs) -> str:
+    """
+    Get stable hash of everything the rendered template depends on except the resource prefix.
+
+    :param topology_instance: The TopologyInstance from which the template is created
+    :param trc: The TransformationConfiguration of the client
+    :param args, kwargs: Other attributes of the rendering, resource_prefix is ignored
+    :return: Hexadecimal SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    digest.update(type(topology_instance.topology_definition).dump(topology_instance.topology_definition)
+                  .encode())
+    if topology_instance.containers is not None:
+        digest.update(type(topology_instance.containers).dump(topology_instance.containers).encode())
+    digest.update(type(trc).dump(trc).encode())
+    attributes = {key: value for key, value in kwargs.items() if key != RESOURCE_PREFIX_ARGUMENT}
+    digest.update(json.dumps([args, attributes], sort_keys=True, default=repr).encode())
+    return digest.hexdigest()
+
+
+class TemplateRenderCache:
+    """
+    In-process LRU cache of rendered Terraform templates keyed by template fingerprint.
+
+    A template requested with a resource prefix is rendered once with a placeholder prefix and
+    the placeholder is substituted for every prefix, so templates of stacks created from the same
+    topology share one rendering. If the cloud client does not keep the placeholder verbatim,
+    the template is rendered and cached for every prefix. Failed renderings are not cached.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_TEMPLATE_CACHE_SIZE):
+        """
+        :param max_size: The maximum number of cached templates, 0 disables caching
+        """
+        self.max_size = max_size
+        self._entries: OrderedDict[Tuple[str, Optional[str]], str] = OrderedDict()
+        self._stats = CacheStats()
+        self._lock = threading.Lock()
+        self._renders = SingleFlight()
+
+    def get_template(self, fingerprint: str, resource_prefix: Optional[str],
+                     render: Callable[[Optional[str]], str]) -> str:
+        """
+        Get rendered template.
+
+        :param fingerprint: The fingerprint of the template, see get_template_fingerprint
+        :param resource_prefix: The resource prefix, the default of the cloud client if None
+        :param render: Callable rendering the template with the given resource prefix
+        :return: Rendered Terraform template
+        :raise CrczpException: Invalid template of attributes.
+        """
+        if resource_prefix is None:
+            return self._get((fingerprint, None), render, None)
+        return self.get_templates(fingerprint, [resource_prefix], render)[resource_prefix]
+
+    def get_templates(self, fingerprint: str, resource_prefixes: List[str],
+                      render: Callable[[Optional[str]], str]) -> Dict[str, str]:
+        """
+        Get rendered templates of multiple resource prefixes.
+
+        :param fingerprint: The fingerprint of the template, see get_template_fingerprint
+        :param resource_prefixes: The resource prefixes
+        :param render: Callable rendering the template with the given resource prefix
+        :return: Dictionary of rendered Terraform templates keyed by resource prefix
+        :raise CrczpException: Invalid template of attributes.
+        """
+        template = self._get((fingerprint, RESOURCE_PREFIX_PLACEHOLDER), render, RESOURCE_PREFIX_PLACEHOLDER)
+        if RESOURCE_PREFIX_PLACEHOLDER in template:
+            return {prefix: template.replace(RESOURCE_PREFIX_PLACEHOLDER, prefix) for prefix in resource_prefixes}
+        return {prefix: self._get((fingerprint, prefix), render, prefix) for prefix in resource_prefixes}
+
+    def clear(self) -> None:
+        """
+        Drop all cached templates.
+
+        :return: None
+        """
+        with self._lock:
+            self._stats.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def get_stats(self) -> CacheStats:
+        """
+        Get snapshot of cache counters.
+
+        :return: CacheStats object
+        """
+        with self._lock:
+            return CacheStats(**vars(self._stats))
+
+    def _get(self, key: Tuple[str, Optional[str]], render: Callable[[Optional[str]], str],
+             resource_prefix: Optional[str]) -> str:
+        if self.max_size <= 0:
+            return render(resource_prefix)
+
+        with self._lock:
+            template = self._entries.get(key)
+            if template is not None:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return template
+            self._stats.misses += 1
+
+        return self._renders.run(repr(key), self._render, key, render, resource_prefix)
+
+    def _render(self, key: Tuple[str, Optional[str]], render: Callable[[Optional[str]], str],
+                resource_prefix: Optional[str]) -> str:
+        template = render(resource_prefix)
+        with self._lock:
+            self._entries[key] = template
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+        return template
+
+    def __len__(self):
+        return len(self._entries)
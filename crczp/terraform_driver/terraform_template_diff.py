@@ -0,0 +1,331 @@
+"""
+Module containing comparison of rendered Terraform templates used to update stacks incrementally.
+
+Templates are split into top-level blocks. Resources whose blocks were added, removed or changed
+are targeted together with all resources referring to them, so an update plans and refreshes only
+the affected part of the stack. Whenever the affected part cannot be determined reliably, the whole
+stack is applied.
+"""
+
+import re
+from typing import Dict, List, Set, Tuple
+
+# Blocks of other types, e.g. variables or providers, may affect all resources
+TARGETABLE_BLOCK_TYPES = ('resource', 'data', 'module')
+HEREDOC_PATTERN = re.compile(r'<<-?([A-Za-z_][A-Za-z0-9_]*)\r?\n')
+BLOCK_HEADER_PATTERN = re.compile(r'([A-Za-z_][A-Za-z0-9_-]*)((?:\s+(?:"[^"]*"|[A-Za-z_][A-Za-z0-9_-]*))*)$')
+PROVIDER_ARGUMENT_PATTERN = re.compile(r'^\s*provider\s*=\s*([A-Za-z0-9_.-]+)', re.MULTILINE)
+BLOCK_LABEL_PATTERN = re.compile(r'"([^"]*)"|([A-Za-z_][A-Za-z0-9_-]*)')
+# References of resources, data sources and modules, e.g. 'data.openstack_networking_network_v2.net'
+REFERENCE_PATTERN = re.compile(r'(?<![\w.-])((?:data\.)?[a-z][a-z0-9]*_[a-z0-9_]*\.[A-Za-z_][A-Za-z0-9_-]*'
+                               r'|module\.[A-Za-z_][A-Za-z0-9_-]*)')
+
+
+class TemplateBlock:
+    """
+    Used to represent a top-level block of a Terraform template
+    """
+
+    def __init__(self, block_type: str, labels: List[str], body: str):
+        self.block_type = block_type
+        self.labels = labels
+        self.body = body
+
+    @property
+    def address(self) -> str:
+        """
+        Address of the block used by the '-target' option, e.g. 'openstack_networking_port_v2.port'
+        """
+        if self.block_type == 'resource':
+            return '.'.join(self.labels[:2])
+        if self.block_type == 'data':
+            return '.'.join(['data'] + self.labels[:2])
+        if self.block_type == 'module':
+            return '.'.join(['module'] + self.labels[:1])
+        return '.'.join([self.block_type] + self.labels)
+
+    @property
+    def targetable(self) -> bool:
+        return self.block_type in TARGETABLE_BLOCK_TYPES
+
+    def __repr__(self):
+        return "<TemplateBlock\n" \
+               "  address: {}>\n".format(self.address)
+
+
+class TemplateDiff:
+    """
+    Used to represent differences of two Terraform templates
+    """
+
+    def __init__(self, added: List[str], removed: List[str], changed: List[str], targets: List[str],
+                 requires_full_apply: bool):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.targets = targets
+        self.requires_full_apply = requires_full_apply
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+    @property
+    def only_additions(self) -> bool:
+        """
+        True if the new template only adds blocks. Existing resources are not changed then and
+        refresh of their state can be skipped.
+        """
+        return bool(self.added) and not (self.removed or self.changed or self.requires_full_apply)
+
+    def __repr__(self):
+        return "<TemplateDiff\n" \
+               "  added: {0.added},\n" \
+               "  removed: {0.removed},\n" \
+               "  changed: {0.changed},\n" \
+               "  targets: {0.targets},\n" \
+               "  requires_full_apply: {0.requires_full_apply}>\n".format(self)
+
+
+def _skip_string(template: str, position: int) -> int:
+    """
+    Get position after the string starting at position, interpolations may contain strings.
+    """
+    depth = 0
+    position += 1
+    while position < len(template):
+        char = template[position]
+        if char == '\\':
+            position += 2
+            continue
+        if template.startswith('${', position) or template.startswith('%{', position):
+            depth += 1
+            position += 2
+            continue
+        if depth:
+            # Braces of objects within interpolations are counted as well
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+            elif char == '"':
+                position = _skip_string(template, position)
+                continue
+        elif char == '"':
+            return position + 1
+        position += 1
+    raise ValueError('Unterminated string in Terraform template')
+
+
+def _skip_ignored(template: str, position: int) -> Tuple[int, bool, bool]:
+    """
+    Skip comment, string or heredoc starting at position.
+
+    :return: Tuple of the position after it, whether anything was skipped and whether it was
+             a comment
+    """
+    if template.startswith('#', position) or template.startswith('//', position):
+        end = template.find('\n', position)
+        return (len(template) if end < 0 else end), True, True
+    if template.startswith('/*', position):
+        end = template.find('*/', position + 2)
+        if end < 0:
+            raise ValueError('Unterminated comment in Terraform template')
+        return end + 2, True, True
+    if template.startswith('"', position):
+        return _skip_string(template, position), True, False
+    heredoc = HEREDOC_PATTERN.match(template, position)
+    if heredoc:
+        terminator = re.compile(r'^[ \t]*' + re.escape(heredoc.group(1)) + r'[ \t]*$', re.MULTILINE)
+        end = terminator.search(template, heredoc.end())
+        if end is None:
+            raise ValueError('Unterminated heredoc in Terraform template')
+        return end.end(), True, False
+    return position, False, False
+
+
+def _skip_block_body(template: str, position: int) -> int:
+    """
+    Get position after the closing brace of the block whose body starts at position.
+    """
+    depth = 1
+    while depth:
+        if position >= len(template):
+            raise ValueError('Unterminated block in Terraform template')
+        position, skipped, _ = _skip_ignored(template, position)
+        if skipped:
+            continue
+        if template[position] == '{':
+            depth += 1
+        elif template[position] == '}':
+            depth -= 1
+        position += 1
+    return position
+
+
+def parse_template_blocks(template: str) -> List[TemplateBlock]:
+    """
+    Split Terraform template into top-level blocks.
+
+    :param template: Terraform template in HCL native syntax
+    :return: List of TemplateBlock objects
+    :raise ValueError: The template is not a valid HCL template
+    """
+    blocks = []
+    position, header = 0, []
+    while position < len(template):
+        start = position
+        position, skipped, comment = _skip_ignored(template, position)
+        if skipped:
+            if not comment:
+                header.append(template[start:position])
+            continue
+        if template[position] != '{':
+            header.append(template[position])
+            position += 1
+            continue
+
+        match = BLOCK_HEADER_PATTERN.match(''.join(header).strip())
+        if match is None:
+            raise ValueError('Invalid block header in Terraform template')
+        labels = [quoted or bare for quoted, bare in BLOCK_LABEL_PATTERN.findall(match.group(2))]
+        body_start = position + 1
+        position = _skip_block_body(template, body_start)
+        blocks.append(TemplateBlock(match.group(1), labels, template[body_start:position - 1]))
+        header = []
+    if ''.join(header).strip():
+        raise ValueError('Unexpected content at the end of Terraform template')
+    return blocks
+
+
+def get_init_dependencies(template: str) -> str:
+    """
+    Get the part of the template 'tofu init' depends on: providers of resources and data sources,
+    modules and provider and terraform blocks. Changes of other blocks do not require 'tofu init'.
+
+    :param template: Terraform template in HCL native syntax
+    :return: Normalized text of the dependencies
+    :raise ValueError: The template is not a valid HCL template
+    """
+    providers, blocks = set(), []
+    for block in parse_template_blocks(template):
+        if block.block_type in ('resource', 'data'):
+            providers.add(block.labels[0].split('_', 1)[0] if block.labels else '')
+            provider_argument = PROVIDER_ARGUMENT_PATTERN.search(block.body)
+            if provider_argument:
+                providers.add(provider_argument.group(1))
+        elif block.block_type in ('module', 'provider', 'terraform'):
+            blocks.append(f'{block.address}\n{_normalize_body(block.body)}')
+    return '\n'.join(sorted(providers) + sorted(blocks))
+
+
+def _normalize_body(body: str) -> str:
+    return '\n'.join(line.strip() for line in body.strip().splitlines() if line.strip())
+
+
+def _strip_literals(body: str) -> str:
+    """
+    Remove comments and strings without interpolations from the body, references are kept.
+    """
+    parts, position, start = [], 0, 0
+    while position < len(body):
+        end, skipped, comment = _skip_ignored(body, position)
+        if not skipped:
+            position += 1
+            continue
+        literal = body[position:end]
+        parts.append(body[start:position])
+        parts.append(literal if not comment and ('${' in literal or '%{' in literal) else ' ')
+        position = start = end
+    parts.append(body[start:])
+    return ''.join(parts)
+
+
+def _get_unresolved_references(blocks: Dict[str, TemplateBlock]) -> Set[str]:
+    """
+    Get references in bodies of the blocks to resources, data sources and modules which are not
+    declared in the template.
+
+    :raise ValueError: A body is not valid HCL
+    """
+    return {reference for block in blocks.values()
+            for reference in REFERENCE_PATTERN.findall(_strip_literals(block.body))
+            if reference not in blocks}
+
+
+def _get_dependents(blocks: Dict[str, TemplateBlock], addresses: Set[str]) -> Set[str]:
+    """
+    Get addresses of blocks referring transitively to any of the addresses. References through
+    blocks which cannot be targeted, e.g. 'locals', are followed as well.
+    """
+    affected = set(addresses)
+    pending = list(addresses)
+    while pending:
+        address = pending.pop()
+        block = blocks.get(address)
+        if block is not None and block.block_type == 'locals':
+            # Locals are referred to by their names, e.g. 'local.network_id'
+            names = re.findall(r'^\s*([A-Za-z_][A-Za-z0-9_-]*)\s*=', block.body, re.MULTILINE)
+            patterns = [r'local\.' + re.escape(name) for name in names]
+        else:
+            patterns = [re.escape(address)]
+        if not patterns:
+            continue
+        reference = re.compile(r'(?<![\w.-])(?:' + '|'.join(patterns) + r')(?![\w-])')
+        for block_address, block in blocks.items():
+            if block_address not in affected and reference.search(block.body):
+                affected.add(block_address)
+                pending.append(block_address)
+    return affected - set(addresses)
+
+
+def _index_blocks(template: str) -> Tuple[Dict[str, TemplateBlock], Set[str]]:
+    """
+    Index top-level blocks of the template by address. Bodies of blocks sharing an address,
+    e.g. several 'locals' blocks, are joined.
+
+    :return: Tuple of the blocks by address and the addresses shared by several blocks
+    :raise ValueError: The template is not a valid HCL template
+    """
+    blocks, duplicated = {}, set()
+    for block in parse_template_blocks(template):
+        existing = blocks.get(block.address)
+        if existing is not None:
+            duplicated.add(block.address)
+            block = TemplateBlock(block.block_type, block.labels, f'{existing.body}\n{block.body}')
+        blocks[block.address] = block
+    return blocks, duplicated
+
+
+def diff_templates(old_template: str, new_template: str) -> TemplateDiff:
+    """
+    Compare two Terraform templates of the same stack.
+
+    :param old_template: The template the stack was applied from
+    :param new_template: The new template of the stack
+    :return: TemplateDiff object, requires_full_apply is set if any untargetable block changed
+             or depends on a changed one, or if the template refers to undeclared blocks whose
+             dependencies cannot be followed
+    :raise ValueError: Any of the templates is not a valid HCL template
+    """
+    old_blocks, old_duplicated = _index_blocks(old_template)
+    new_blocks, new_duplicated = _index_blocks(new_template)
+
+    added = [address for address in new_blocks if address not in old_blocks]
+    removed = [address for address in old_blocks if address not in new_blocks]
+    changed = [address for address, block in new_blocks.items()
+               if address in old_blocks and _normalize_body(block.body) != _normalize_body(old_blocks[address].body)]
+
+    modified = added + removed + changed
+    # Resources referring to changed or removed ones may change as well
+    dependents = _get_dependents(new_blocks, set(changed) | set(removed))
+    # Blocks sharing an address cannot be told apart, so their changes cannot be targeted. Targets
+    # would miss resources depending on the changes through untargetable blocks or unknown references.
+    requires_full_apply = any(not (new_blocks.get(address) or old_blocks[address]).targetable
+                              or address in old_duplicated or address in new_duplicated
+                              for address in modified) \
+        or any(not new_blocks[address].targetable for address in dependents) \
+        or bool(modified and _get_unresolved_references(new_blocks))
+    targets = [address for address in modified + sorted(dependents)
+               if (new_blocks.get(address) or old_blocks[address]).targetable]
+    return TemplateDiff(added, removed, changed, targets, requires_full_apply)
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+import sys
+from unittest import mock
+
+import pytest
+from crczp.cloud_commons import CrczpException
+
+from crczp.terraform_driver.terraform_async_client_manager import AsyncCrczpTerraformClientManager, \
+    AsyncStreamTextReader
+from crczp.terraform_driver.terraform_backend import CrczpTerraformBackend
+from crczp.terraform_driver.terraform_client_elements import CrczpTerraformBackendType
+from crczp.terraform_driver.terraform_client_manager import CrczpTerraformClientManager
+from crczp.terraform_driver.terraform_events import TerraformChangeSummaryEvent
+
+STACK_NAME = 'stack-1'
+FAKE_TOFU = '''
+import json
+import os
+import sys
+
+arguments = sys.argv[1:]
+with open(os.environ['FAKE_TOFU_CALLS'], 'a') as file:
+    file.write(' '.join(arguments) + '\\n')
+if arguments[:2] == ['state', 'pull']:
+    with open(os.environ['FAKE_TOFU_STATE'], 'rb') as file:
+        sys.stdout.buffer.write(file.read())
+elif '-json' in arguments:
+    print(json.dumps({'type': 'change_summary', '@message': 'Destroy complete!',
+                      'changes': {'add': 0, 'change': 0, 'remove': 1, 'operation': arguments[0]}}))
+'''
+
+
+def create_state(resource_count: int) -> str:
+    resources = [{'mode': 'data', 'type': 'openstack_images_image_v2', 'name': 'image', 'instances': []}]
+    resources += [{'mode': 'managed', 'type': 'openstack_compute_instance_v2', 'name': f'host-{index}',
+                   'instances': [{'attributes': {'id': str(index), 'name': f'hôst-{index} ✓'}}]}
+                  for index in range(resource_count)]
+    return json.dumps({'version': 4, 'serial': 7, 'lineage': 'lineage-1', 'resources': resources})
+
+
+def write_state(tmp_path, state: str) -> None:
+    (tmp_path / 'state.json').write_text(state, encoding='utf-8')
+
+
+@pytest.fixture
+def fake_tofu(tmp_path, monkeypatch) -> str:
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    script = bin_dir / 'tofu'
+    script.write_text(f'#!{sys.executable}\n{FAKE_TOFU}')
+    script.chmod(0o755)
+    calls = tmp_path / 'calls'
+    write_state(tmp_path, create_state(3))
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.setenv('FAKE_TOFU_CALLS', str(calls))
+    monkeypatch.setenv('FAKE_TOFU_STATE', str(tmp_path / 'state.json'))
+    return str(calls)
+
+
+@pytest.fixture
+def manager(tmp_path, fake_tofu) -> AsyncCrczpTerraformClientManager:
+    cloud_client = mock.Mock()
+    cloud_client.get_terraform_provider.return_value = 'provider "openstack" {}\n'
+    sync_manager = CrczpTerraformClientManager(str(tmp_path / 'stacks'), cloud_client, mock.Mock(), None,
+                                               CrczpTerraformBackend(CrczpTerraformBackendType.LOCAL))
+    os.makedirs(sync_manager.get_stack_dir(STACK_NAME))
+    manager = AsyncCrczpTerraformClientManager(sync_manager)
+    yield manager
+    manager.close()
+
+
+def read_calls(calls_path: str) -> list:
+    with open(calls_path) as file:
+        return file.read().splitlines()
+
+
+def test_managers_share_components(manager):
+    assert manager.state_cache is manager.manager.state_cache
+    assert manager.stack_locks is manager.manager.stack_locks
+    assert manager.scheduler is manager.manager.scheduler
+
+
+def test_pulled_state_is_parsed_from_output_stream(manager, fake_tofu, tmp_path):
+    write_state(tmp_path, create_state(2000))
+
+    resources = asyncio.run(manager.list_stack_resources(STACK_NAME))
+
+    assert len(resources) == 2000
+    assert resources[-1]['instances'][0]['attributes']['name'] == 'hôst-1999 ✓'
+    assert manager.state_cache.get(STACK_NAME).serial == 7
+    assert read_calls(fake_tofu)[-1] == 'state pull -no-color'
+
+
+def test_invalid_pulled_state_is_reported(manager, tmp_path):
+    # Output following the invalid part is read, so the command does not block on a full pipe
+    write_state(tmp_path, '{"resources": [1, ' + ' ' * 1024 * 1024 + ']}')
+
+    with pytest.raises(CrczpException, match='Failed to parse Terraform state'):
+        asyncio.run(asyncio.wait_for(manager.list_stack_resources(STACK_NAME), 30))
+
+
+def test_delete_stack_with_json_output(manager, fake_tofu):
+    async def delete():
+        process = await manager.delete_stack(STACK_NAME, json_output=True)
+        events = [event async for event in process.events()]
+        return events, await process.wait()
+
+    events, (_, _, return_code) = asyncio.run(delete())
+
+    assert return_code == 0
+    assert isinstance(events[0], TerraformChangeSummaryEvent)
+    assert read_calls(fake_tofu)[-1] == 'destroy -auto-approve -no-color -json -no-color'
+
+
+def test_text_reader_decodes_characters_split_between_chunks():
+    async def read() -> list:
+        stream = asyncio.StreamReader()
+        encoded = 'hôst ✓'.encode()
+        reader = AsyncStreamTextReader(stream, asyncio.get_running_loop())
+        for index in range(len(encoded)):
+            stream.feed_data(encoded[index:index + 1])
+        stream.feed_eof()
+        return await asyncio.to_thread(lambda: list(iter(lambda: reader.read(1), '')))
+
+    assert ''.join(asyncio.run(read())) == 'hôst ✓'
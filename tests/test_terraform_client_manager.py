@@ -0,0 +1,100 @@
+import os
+from unittest import mock
+
+import pytest
+
+from crczp.terraform_driver.terraform_backend import CrczpTerraformBackend
+from crczp.terraform_driver.terraform_client_elements import CrczpTerraformBackendType
+from crczp.terraform_driver.terraform_client_manager import CrczpTerraformClientManager, APPLIED_TEMPLATE_FILE_NAME, \
+    WORKSPACE_ADMIN_DIR_NAME
+from crczp.terraform_driver.terraform_stack_registry import TerraformStackRegistry, STACK_REGISTRY_FILE_NAME
+
+STACK_NAME = 'stack-1'
+TEMPLATE = '''
+resource "openstack_networking_network_v2" "stack-net" {
+    name = "stack-net"
+}
+
+resource "openstack_compute_instance_v2" "stack-host" {
+    flavor_name = "small"
+}
+'''
+APPLY = ['tofu', 'apply', '-auto-approve', '-no-color']
+
+
+@pytest.fixture
+def manager(tmp_path) -> CrczpTerraformClientManager:
+    manager = CrczpTerraformClientManager(str(tmp_path), mock.Mock(), mock.Mock(), None,
+                                          CrczpTerraformBackend(CrczpTerraformBackendType.LOCAL))
+    os.makedirs(manager.get_stack_dir(STACK_NAME))
+    return manager
+
+
+def store_applied_template(manager: CrczpTerraformClientManager, template: str) -> None:
+    with open(os.path.join(manager.get_stack_dir(STACK_NAME), APPLIED_TEMPLATE_FILE_NAME), 'w') as file:
+        file.write(template)
+
+
+def read_stack_template(manager: CrczpTerraformClientManager) -> str:
+    with open(os.path.join(manager.get_stack_dir(STACK_NAME), manager.template_file_name)) as file:
+        return file.read()
+
+
+def test_update_of_changed_resource_is_targeted(manager):
+    store_applied_template(manager, TEMPLATE)
+    new_template = TEMPLATE.replace('small', 'large')
+
+    command = manager._prepare_stack_update(STACK_NAME, new_template, targeted=True, json_output=False)
+
+    assert command == APPLY + ['-target=openstack_compute_instance_v2.stack-host']
+    assert read_stack_template(manager) == new_template
+
+
+def test_update_adding_resources_skips_refresh(manager):
+    store_applied_template(manager, TEMPLATE)
+    new_template = TEMPLATE + 'resource "openstack_networking_network_v2" "stack-net-2" {\n}\n'
+
+    command = manager._prepare_stack_update(STACK_NAME, new_template, targeted=True, json_output=True)
+
+    assert command == APPLY + ['-json', '-target=openstack_networking_network_v2.stack-net-2', '-refresh=false']
+
+
+def test_unchanged_template_is_not_applied(manager):
+    store_applied_template(manager, TEMPLATE)
+
+    assert manager._prepare_stack_update(STACK_NAME, TEMPLATE, targeted=True, json_output=False) is None
+
+
+@pytest.mark.parametrize('applied_template', [
+    None,
+    # Not parsed, the update must not be limited to a guessed set of resources
+    TEMPLATE + 'resource "openstack_networking_port_v2" "stack-port" {\n    name = "unterminated\n}\n',
+    TEMPLATE + 'locals {\n    flavor = "small"\n}\n',
+])
+def test_update_falls_back_to_full_apply(manager, applied_template):
+    if applied_template is not None:
+        store_applied_template(manager, applied_template)
+
+    command = manager._prepare_stack_update(STACK_NAME, TEMPLATE.replace('small', 'large'), targeted=True,
+                                            json_output=False)
+
+    assert command == APPLY
+
+
+def test_list_stacks_lists_stacks_directory(manager):
+    os.makedirs(os.path.join(manager.stacks_dir, WORKSPACE_ADMIN_DIR_NAME))
+    os.makedirs(os.path.join(manager.stacks_dir, '.hidden-stack'))
+
+    assert sorted(manager.list_stacks()) == ['.hidden-stack', STACK_NAME]
+
+
+def test_list_stacks_skips_stack_registry_in_stacks_directory(tmp_path):
+    registry = TerraformStackRegistry(str(tmp_path / STACK_REGISTRY_FILE_NAME))
+    manager = CrczpTerraformClientManager(str(tmp_path), mock.Mock(), mock.Mock(), None,
+                                          CrczpTerraformBackend(CrczpTerraformBackendType.LOCAL),
+                                          stack_registry=registry)
+    os.makedirs(manager.get_stack_dir(STACK_NAME))
+
+    assert os.path.exists(registry.path)
+    assert manager.list_stacks() == [STACK_NAME]
+    registry.close()
@@ -0,0 +1,106 @@
+import queue
+import subprocess
+import sys
+from unittest import mock
+
+import pytest
+
+from crczp.terraform_driver.terraform_process import TerraformProcess, STDOUT, STDERR
+
+SCRIPT = '''
+import sys
+for index in range(5):
+    print(f'out-{index}', flush=True)
+print('err-0', file=sys.stderr, flush=True)
+sys.exit(3)
+'''
+
+
+def start_process(script: str = SCRIPT) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            text=True)
+
+
+class FailingStream:
+    """
+    Stream failing after the first line
+    """
+
+    def __init__(self):
+        self.lines = ['line\n']
+
+    def readline(self):
+        if not self.lines:
+            raise OSError('read failed')
+        return self.lines.pop()
+
+
+def test_drain_returns_output_and_return_code():
+    process = TerraformProcess(start_process())
+
+    stdout, stderr, return_code = process.drain(10)
+
+    assert (stdout, stderr, return_code) == ('\n'.join(f'out-{index}' for index in range(5)), 'err-0', 3)
+    assert process.output_bytes == len('out-0\n') * 5 + len('err-0\n')
+
+
+def test_drain_keeps_recent_lines():
+    process = TerraformProcess(start_process('for index in range(100):\n    print(index)'), buffer_size=2)
+
+    assert process.drain(10) == ('98\n99', '', 0)
+
+
+def test_output_is_spooled_to_log_file(tmp_path):
+    log_path = tmp_path / 'tofu.log'
+    process = TerraformProcess(start_process(), log_path=str(log_path))
+
+    lines = list(process.stream_output(10))
+    process.drain(10)
+
+    assert [(line.stream, line.line) for line in lines if line.stream == STDERR] == [(STDERR, 'err-0')]
+    assert len([line for line in lines if line.stream == STDOUT]) == 5
+    assert process._log_file is None
+    logged = log_path.read_text().splitlines()
+    assert len(logged) == 6
+    assert logged[0].split(' ', 1)[1] == 'stdout out-0'
+
+
+def test_log_file_is_closed_when_reading_fails(tmp_path):
+    popen = mock.Mock(stdout=FailingStream(), stderr=None, args=['tofu'])
+    process = TerraformProcess(popen, log_path=str(tmp_path / 'tofu.log'))
+    with mock.patch('threading.excepthook'):
+        lines = list(process.stream_output(10))
+
+    assert [line.line for line in lines] == ['line']
+    assert process._log_file is None
+
+
+def test_log_file_is_closed_when_readers_cannot_start(tmp_path):
+    process = TerraformProcess(start_process(), log_path=str(tmp_path / 'tofu.log'))
+    log_files = []
+    original_open = open
+
+    def tracking_open(*args, **kwargs):
+        log_files.append(original_open(*args, **kwargs))
+        return log_files[-1]
+
+    with mock.patch('builtins.open', tracking_open), \
+            mock.patch('threading.Thread.start', side_effect=RuntimeError('no threads')), \
+            pytest.raises(RuntimeError):
+        process._start_readers()
+
+    assert log_files[0].closed
+    assert process._log_file is None
+    process.process.kill()
+    process.process.communicate()
+
+
+def test_stream_timeout_chains_empty_queue():
+    process = TerraformProcess(start_process('import time\ntime.sleep(10)'))
+
+    with pytest.raises(subprocess.TimeoutExpired) as exc_info:
+        list(process.stream_output(0.1))
+
+    assert isinstance(exc_info.value.__cause__, queue.Empty)
+    process.process.kill()
+    process.process.communicate()
@@ -0,0 +1,195 @@
+import asyncio
+
+import pytest
+
+from crczp.terraform_driver.terraform_retry import is_retryable_error, RetryPolicy, RetryBudget
+
+STATE_LOCKED = '''
+Error: Error acquiring the state lock
+
+Error message: pq: could not obtain lock on row in relation "locks"
+Lock Info:
+  ID:        5c9a7b1e-0d7e-4c0e-8f4b-5a3ad3b1b2f1
+  Path:      terraform_remote_state/stack-1
+  Operation: OperationTypeApply
+  Who:       crczp@sandbox-service
+  Version:   1.8.2
+  Created:   2024-05-02 10:21:13.012 +0000 UTC
+
+OpenTofu acquires a state lock to protect the state from being written
+by multiple users at the same time.
+'''
+OPENSTACK_UNAVAILABLE = '''
+Error: Error creating OpenStack server: Expected HTTP response code [202] when accessing \
+[POST https://compute.example.org:8774/v2.1/servers], but got 503 instead
+
+  with openstack_compute_instance_v2.stack-1-host-1,
+  on deploy.tf line 118, in resource "openstack_compute_instance_v2" "stack-1-host-1":
+ 118: resource "openstack_compute_instance_v2" "stack-1-host-1" {
+'''
+AWS_THROTTLED = '''
+Error: creating EC2 Instance: operation error EC2: RunInstances, https response error StatusCode: 503, \
+RequestID: 0c1f6c4e-8a0e-4c59-9c1d-6d3e7b8f2a10, api error Unavailable: Please try again.
+
+  with aws_instance.stack-1-host-1,
+  on deploy.tf line 54, in resource "aws_instance" "stack-1-host-1":
+  54: resource "aws_instance" "stack-1-host-1" {
+'''
+REGISTRY_RESET = '''
+Error: Failed to install provider
+
+Error while installing terraform-provider-openstack/openstack v1.54.1: \
+Get "https://github.com/terraform-provider-openstack/releases/download/v1.54.1/terraform-provider-openstack_1.54.1.zip": \
+read tcp 10.0.0.5:50504->140.82.121.4:443: read: connection reset by peer
+'''
+POSTGRES_OVERLOADED = '''
+Error: Failed to get existing workspaces: pq: sorry, too many clients already
+'''
+UNDECLARED_RESOURCE = '''
+Error: Reference to undeclared resource
+
+  on deploy.tf line 502, in resource "openstack_networking_port_v2" "stack-1-port-503":
+ 502:   network_id = openstack_networking_network_v2.stack-1-net-504.id
+
+A managed resource "openstack_networking_network_v2" "stack-1-net-504" has not been declared in the root module.
+'''
+UNKNOWN_HOST = '''
+Error: Failed to query available provider packages
+
+Could not retrieve the list of available versions for provider terraform-provider-openstack/openstack: \
+could not connect to registry.opentofu.org: failed to request discovery document: \
+Get "https://registry.opentofu.org/.well-known/terraform.json": dial tcp: lookup registry.opentofu.org \
+on 127.0.0.53:53: no such host
+'''
+DUPLICATE_WORKSPACE = '''
+Error: Failed to create workspace: pq: duplicate key value violates unique constraint "states_pkey"
+'''
+UNAUTHORIZED = '''
+Error: Error creating OpenStack compute client: Authentication failed
+
+  with provider["registry.opentofu.org/terraform-provider-openstack/openstack"],
+  on provider.tf line 10, in provider "openstack":
+  10: provider "openstack" {
+
+The request you have made requires authentication. HTTP 503 is not expected here.
+'''
+
+
+@pytest.mark.parametrize('stderr', [
+    STATE_LOCKED,
+    OPENSTACK_UNAVAILABLE,
+    AWS_THROTTLED,
+    REGISTRY_RESET,
+    POSTGRES_OVERLOADED,
+    'Error: Post "https://identity.example.org/v3/auth/tokens": net/http: TLS handshake timeout',
+    'Error: GET https://compute.example.org/v2.1/flavors returned HTTP/1.1 429 Too Many Requests',
+])
+def test_transient_errors_are_retryable(stderr):
+    assert is_retryable_error(stderr)
+
+
+@pytest.mark.parametrize('stderr', [
+    UNDECLARED_RESOURCE,
+    UNKNOWN_HOST,
+    DUPLICATE_WORKSPACE,
+    UNAUTHORIZED,
+    'Error: expected port_range_max to be in the range (1 - 65535), got 70502',
+    'Error: Error creating OpenStack server: Quota exceeded for cores: Requested 504, but already used 20 of 20 cores',
+    '',
+    None,
+])
+def test_permanent_errors_are_not_retryable(stderr):
+    assert not is_retryable_error(stderr)
+
+
+def create_attempt(*return_codes: int, stderr: str = STATE_LOCKED):
+    calls = []
+
+    def attempt():
+        return_code = return_codes[len(calls)]
+        calls.append(return_code)
+        return len(calls), stderr if return_code else '', return_code
+
+    return attempt, calls
+
+
+def create_policy(sleeps: list = None, **kwargs) -> RetryPolicy:
+    return RetryPolicy(sleep=(sleeps if sleeps is not None else []).append, rand=lambda: 1.0, **kwargs)
+
+
+def test_delay_grows_exponentially_up_to_the_limit():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0, multiplier=2.0, rand=lambda: 0.5)
+
+    assert [policy.get_delay(attempt) for attempt in range(1, 6)] == [0.5, 1.0, 2.0, 2.5, 2.5]
+
+
+def test_transient_failures_are_retried_until_success():
+    sleeps = []
+    policy = create_policy(sleeps, base_delay=1.0, multiplier=3.0)
+    attempt, calls = create_attempt(1, 1, 0)
+
+    assert policy.execute(attempt, command='tofu init') == (3, '', 0)
+
+    assert calls == [1, 1, 0]
+    assert sleeps == [1.0, 3.0]
+    stats = policy.get_stats()
+    assert (stats.retries, stats.recovered, stats.exhausted) == (2, 1, 0)
+
+
+def test_fatal_failure_is_not_retried():
+    policy = create_policy()
+    attempt, calls = create_attempt(1, 0, stderr=UNDECLARED_RESOURCE)
+
+    assert policy.execute(attempt) == (1, UNDECLARED_RESOURCE, 1)
+
+    assert calls == [1]
+    assert policy.get_stats().fatal == 1
+
+
+def test_retries_are_limited_by_max_attempts():
+    policy = create_policy(max_attempts=3)
+    attempt, calls = create_attempt(1, 1, 1, 0)
+
+    _, _, return_code = policy.execute(attempt)
+
+    assert return_code == 1
+    assert len(calls) == 3
+    assert policy.get_stats().exhausted == 1
+
+
+def test_shared_budget_limits_retries():
+    budget = RetryBudget(size=1, ratio=0.5)
+    policies = [create_policy(budget=budget), create_policy(budget=budget)]
+    first_attempt, first_calls = create_attempt(1, 0)
+    second_attempt, second_calls = create_attempt(1, 0)
+
+    policies[0].execute(first_attempt)
+    policies[1].execute(second_attempt)
+
+    assert len(first_calls) == 2
+    assert len(second_calls) == 1
+    assert policies[1].get_stats().budget_exhausted == 1
+    # The successful command returned half of a token
+    assert budget.tokens == 0.5
+
+
+def test_budget_is_refilled_up_to_its_size():
+    budget = RetryBudget(size=2, ratio=1.5)
+
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+
+    assert budget.tokens == 2
+
+
+def test_async_execution_is_retried():
+    policy = create_policy(base_delay=0.0)
+    attempt, calls = create_attempt(1, 0)
+
+    async def async_attempt():
+        return attempt()
+
+    assert asyncio.run(policy.execute_async(async_attempt)) == (2, '', 0)
+    assert policy.get_stats().recovered == 1
@@ -0,0 +1,140 @@
+import threading
+
+import pytest
+
+from crczp.terraform_driver.terraform_exceptions import TerraformCommandQueueTimeout
+from crczp.terraform_driver.terraform_scheduler import TerraformCommandScheduler, PRIORITY_BULK, \
+    PRIORITY_INTERACTIVE, COMMAND_APPLY, COMMAND_STATE, get_command_class
+
+APPLY = ['tofu', 'apply', '-auto-approve']
+WAIT_TIMEOUT = 5
+
+
+class FakeProcess:
+    """
+    Process running until it is finished by the test
+    """
+
+    def __init__(self):
+        self.returncode = None
+        self.exited = threading.Event()
+
+    def wait(self):
+        self.exited.wait()
+        return self.returncode
+
+    def finish(self):
+        self.returncode = 0
+        self.exited.set()
+
+
+def start_in_thread(scheduler: TerraformCommandScheduler, command, process: FakeProcess, started: list,
+                    priority: int = None) -> threading.Thread:
+    def run():
+        scheduler.start(command, lambda: process, priority)
+        started.append(process)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_until(condition) -> None:
+    event = threading.Event()
+    for _ in range(WAIT_TIMEOUT * 100):
+        if condition():
+            return
+        event.wait(0.01)
+    raise AssertionError('Condition not met in time')
+
+
+def test_command_class():
+    assert get_command_class(APPLY) == COMMAND_APPLY
+    assert get_command_class(['tofu', 'workspace', 'select', 'stack-1']) == COMMAND_STATE
+    assert get_command_class(['tofu']) == 'other'
+
+
+def test_commands_are_not_limited_by_default():
+    scheduler = TerraformCommandScheduler()
+    processes = [FakeProcess() for _ in range(64)]
+
+    for process in processes:
+        assert scheduler.start(APPLY, lambda process=process: process) is process
+
+    assert scheduler.get_stats().running == 64
+    for process in processes:
+        process.finish()
+
+
+def test_saturated_class_queue_makes_progress():
+    scheduler = TerraformCommandScheduler(class_limits={COMMAND_APPLY: 2})
+    processes = [FakeProcess() for _ in range(5)]
+    started = []
+    threads = [start_in_thread(scheduler, APPLY, process, started) for process in processes]
+
+    wait_until(lambda: len(started) == 2 and scheduler.get_stats().queued == 3)
+    # Other classes are not held back by the saturated one
+    state_process = FakeProcess()
+    scheduler.start(['tofu', 'state', 'pull'], lambda: state_process)
+    state_process.finish()
+
+    while len(started) < len(processes):
+        running = [process for process in started if not process.exited.is_set()]
+        assert len(running) <= 2
+        running[0].finish()
+        count = len(started)
+        wait_until(lambda count=count: len(started) > count or len(started) == len(processes))
+    for thread in threads:
+        thread.join(WAIT_TIMEOUT)
+    for process in started:
+        process.finish()
+
+    wait_until(lambda: scheduler.get_stats().running == 0)
+    stats = scheduler.get_stats()
+    assert stats.started == stats.completed == 6
+    assert stats.queued == 0
+
+
+def test_waiting_commands_start_by_priority():
+    scheduler = TerraformCommandScheduler(max_commands=1)
+    blocking = FakeProcess()
+    scheduler.start(APPLY, lambda: blocking)
+    started = []
+    bulk, interactive = FakeProcess(), FakeProcess()
+    start_in_thread(scheduler, APPLY, bulk, started, PRIORITY_BULK)
+    wait_until(lambda: scheduler.get_stats().queued == 1)
+    start_in_thread(scheduler, APPLY, interactive, started, PRIORITY_INTERACTIVE)
+    wait_until(lambda: scheduler.get_stats().queued == 2)
+
+    blocking.finish()
+    wait_until(lambda: len(started) == 1)
+    assert started == [interactive]
+    interactive.finish()
+    wait_until(lambda: len(started) == 2)
+    bulk.finish()
+
+
+def test_queue_timeout():
+    scheduler = TerraformCommandScheduler(max_commands=1, queue_timeout=0.05)
+    blocking = FakeProcess()
+    scheduler.start(APPLY, lambda: blocking)
+
+    with pytest.raises(TerraformCommandQueueTimeout):
+        scheduler.start(APPLY, FakeProcess)
+
+    assert scheduler.get_stats().timed_out == 1
+    blocking.finish()
+
+
+def test_exit_callbacks_of_running_processes_are_not_waited_for():
+    scheduler = TerraformCommandScheduler()
+    recorded = []
+    running, exited = FakeProcess(), FakeProcess()
+    scheduler.start(APPLY, lambda: running, on_exit=recorded.append)
+    scheduler.start(APPLY, lambda: exited, on_exit=recorded.append)
+    exited.finish()
+
+    scheduler.wait_for_exit_callbacks()
+
+    assert recorded == [exited]
+    running.finish()
@@ -0,0 +1,123 @@
+import json
+import os
+import time
+from unittest import mock
+
+import pytest
+
+from crczp.terraform_driver.terraform_backend import CrczpTerraformBackend
+from crczp.terraform_driver.terraform_client_elements import CrczpTerraformBackendType, CrczpTerraformStackLayout, \
+    CrczpTerraformStackState, TerraformStackRecord
+from crczp.terraform_driver.terraform_client_manager import CrczpTerraformClientManager, TERRAFORM_WORKSPACE_PATH
+from crczp.terraform_driver.terraform_stack_gc import TerraformStackGarbageCollector
+
+STACK_NAME = 'stack-1'
+GRACE_PERIOD = 60
+RETENTION = 600
+
+
+class FakeClock:
+    """
+    Clock set by the test relative to the current time
+    """
+
+    def __init__(self):
+        self.offset = 0.0
+
+    def __call__(self) -> float:
+        return time.time() + self.offset
+
+
+@pytest.fixture
+def manager(tmp_path) -> CrczpTerraformClientManager:
+    manager = CrczpTerraformClientManager(str(tmp_path), mock.Mock(), mock.Mock(), None,
+                                          CrczpTerraformBackend(CrczpTerraformBackendType.LOCAL))
+    os.makedirs(manager.get_stack_dir(STACK_NAME))
+    return manager
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def collector(manager, clock) -> TerraformStackGarbageCollector:
+    return TerraformStackGarbageCollector(manager, retention=RETENTION, grace_period=GRACE_PERIOD, clock=clock)
+
+
+def write_state(manager: CrczpTerraformClientManager, resources: list) -> None:
+    state_path = os.path.join(manager.get_stack_dir(STACK_NAME), TERRAFORM_WORKSPACE_PATH.format(STACK_NAME))
+    os.makedirs(os.path.dirname(state_path))
+    with open(state_path, 'w') as file:
+        json.dump({'serial': 1, 'resources': resources}, file)
+
+
+def create_record(state: CrczpTerraformStackState) -> TerraformStackRecord:
+    return TerraformStackRecord(STACK_NAME, state, time.time(), time.time())
+
+
+def test_recently_changed_stack_is_kept(collector):
+    assert not collector._should_remove(STACK_NAME, None, None)
+
+
+def test_unknown_stack_without_state_is_removed(collector, clock):
+    clock.offset = GRACE_PERIOD
+
+    assert collector._should_remove(STACK_NAME, None, None)
+
+
+def test_ready_stack_without_resources_is_kept_until_retention(collector, manager, clock):
+    write_state(manager, [])
+    record = create_record(CrczpTerraformStackState.READY)
+    clock.offset = GRACE_PERIOD
+
+    assert not collector._should_remove(STACK_NAME, record, None)
+    clock.offset = RETENTION
+    assert collector._should_remove(STACK_NAME, record, None)
+
+
+def test_failed_stack_without_resources_is_removed(collector, manager, clock):
+    write_state(manager, [])
+    clock.offset = GRACE_PERIOD
+
+    assert collector._should_remove(STACK_NAME, create_record(CrczpTerraformStackState.FAILED), None)
+
+
+@pytest.mark.parametrize('state', [CrczpTerraformStackState.READY, CrczpTerraformStackState.FAILED])
+def test_stack_managing_resources_is_kept(collector, manager, clock, state):
+    write_state(manager, [{'mode': 'managed'}])
+    clock.offset = RETENTION
+
+    assert not collector._should_remove(STACK_NAME, create_record(state), None)
+
+
+@pytest.mark.parametrize('state, removed', [
+    (CrczpTerraformStackState.READY, False),
+    (CrczpTerraformStackState.FAILED, True),
+    (CrczpTerraformStackState.DESTROYING, True),
+])
+def test_retired_stack_with_shared_workspace_is_removed(collector, clock, state, removed):
+    clock.offset = RETENTION
+
+    assert collector._should_remove(STACK_NAME, create_record(state), {STACK_NAME}) is removed
+
+
+def test_retired_stack_with_shared_workspace_is_kept_until_retention(collector, clock):
+    clock.offset = GRACE_PERIOD
+
+    assert not collector._should_remove(STACK_NAME, create_record(CrczpTerraformStackState.FAILED), {STACK_NAME})
+
+
+@pytest.mark.parametrize('has_resources', [True, False])
+def test_remote_state_of_directory_layout_is_read_under_lock(collector, manager, clock, has_resources):
+    manager.stack_layout = CrczpTerraformStackLayout.DIRECTORY
+    manager.terraform_backend = mock.Mock(backend_type=CrczpTerraformBackendType.POSTGRES)
+    record = create_record(CrczpTerraformStackState.FAILED)
+    clock.offset = RETENTION
+
+    with mock.patch.object(collector, '_has_remote_resources', return_value=has_resources) as has_remote_resources:
+        # Only a candidate when the state is not read
+        assert collector._should_remove(STACK_NAME, record, None)
+        assert not has_remote_resources.called
+        assert collector._should_remove(STACK_NAME, record, None, read_remote_state=True) is not has_resources
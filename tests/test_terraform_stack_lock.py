@@ -0,0 +1,181 @@
+import fcntl
+import os
+import threading
+
+import pytest
+
+from crczp.terraform_driver.terraform_stack_lock import TerraformStackLocks, SingleFlight, STACK_LOCK_FILE_NAME
+
+STACK_NAME = 'stack-1'
+WAIT_TIMEOUT = 5
+
+
+class CountingEvent(threading.Event):
+    """
+    Event counting callers waiting for it
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def wait(self, timeout=None):
+        with self._lock:
+            self.waiting += 1
+        return super().wait(timeout)
+
+
+def start_in_thread(function, *args) -> threading.Thread:
+    thread = threading.Thread(target=function, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_until(condition) -> None:
+    event = threading.Event()
+    for _ in range(WAIT_TIMEOUT * 100):
+        if condition():
+            return
+        event.wait(0.01)
+    raise AssertionError('Condition not met in time')
+
+
+def count_waiting_callers(flights: SingleFlight, key: str) -> CountingEvent:
+    done = CountingEvent()
+    flights._flights[key].done = done
+    return done
+
+
+def acquire_in_thread(locks: TerraformStackLocks, stack_name: str, exclusive: bool, acquired: list)\
+        -> threading.Thread:
+    return start_in_thread(lambda: acquired.append(locks.acquire(stack_name, exclusive)))
+
+
+def test_readers_share_lock():
+    locks = TerraformStackLocks()
+
+    with locks.read(STACK_NAME), locks.read(STACK_NAME):
+        pass
+
+
+def test_writer_excludes_readers_and_writers():
+    locks = TerraformStackLocks()
+    acquired = []
+    writer = locks.acquire(STACK_NAME, exclusive=True)
+    acquire_in_thread(locks, STACK_NAME, False, acquired)
+    acquire_in_thread(locks, STACK_NAME, True, acquired)
+
+    threading.Event().wait(0.1)
+    assert not acquired
+    # The lock may be released by another thread than the one which acquired it
+    start_in_thread(locks.release, writer).join(WAIT_TIMEOUT)
+
+    wait_until(lambda: len(acquired) == 1)
+    locks.release(acquired[0])
+    wait_until(lambda: len(acquired) == 2)
+    locks.release(acquired[1])
+
+
+def test_waiting_writer_is_preferred_to_new_readers():
+    locks = TerraformStackLocks()
+    acquired = []
+    reader = locks.acquire(STACK_NAME, exclusive=False)
+    acquire_in_thread(locks, STACK_NAME, True, acquired)
+    wait_until(lambda: locks._locks[STACK_NAME]._waiting_writers == 1)
+    acquire_in_thread(locks, STACK_NAME, False, acquired)
+
+    threading.Event().wait(0.1)
+    assert not acquired
+    locks.release(reader)
+
+    wait_until(lambda: len(acquired) == 1)
+    assert acquired[0].exclusive
+    locks.release(acquired[0])
+    wait_until(lambda: len(acquired) == 2)
+    locks.release(acquired[1])
+
+
+def test_stacks_are_locked_independently():
+    locks = TerraformStackLocks()
+
+    with locks.write(STACK_NAME), locks.write('stack-2'):
+        pass
+
+
+def test_lock_file_is_locked_across_open_files(tmp_path):
+    locks = TerraformStackLocks(str(tmp_path / 'locks'))
+
+    with open(os.path.join(locks.lock_dir, STACK_LOCK_FILE_NAME.format(STACK_NAME)), 'a') as other_file:
+        with locks.write(STACK_NAME) as handle:
+            assert handle.lock_file is not None
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(other_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        assert handle.lock_file is None
+        fcntl.flock(other_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def test_shared_lock_file_admits_readers(tmp_path):
+    locks = TerraformStackLocks(str(tmp_path / 'locks'))
+
+    with open(os.path.join(locks.lock_dir, STACK_LOCK_FILE_NAME.format(STACK_NAME)), 'a') as other_file, \
+            locks.read(STACK_NAME):
+        fcntl.flock(other_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        with pytest.raises(BlockingIOError):
+            fcntl.flock(other_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def test_concurrent_calls_share_single_flight():
+    flights = SingleFlight()
+    started, finish = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def load(value):
+        calls.append(value)
+        started.set()
+        finish.wait(WAIT_TIMEOUT)
+        return value
+
+    leader = start_in_thread(lambda: results.append(flights.run(STACK_NAME, load, 'first')))
+    started.wait(WAIT_TIMEOUT)
+    done = count_waiting_callers(flights, STACK_NAME)
+    followers = [start_in_thread(lambda: results.append(flights.run(STACK_NAME, load, 'second')))
+                 for _ in range(3)]
+    wait_until(lambda: done.waiting == 3)
+    finish.set()
+    for thread in [leader] + followers:
+        thread.join(WAIT_TIMEOUT)
+
+    assert calls == ['first']
+    assert results == ['first'] * 4
+    # The next call after the flight landed executes the function again
+    assert flights.run(STACK_NAME, load, 'third') == 'third'
+
+
+def test_error_of_flight_is_raised_to_all_callers():
+    flights = SingleFlight()
+    started, finish = threading.Event(), threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        finish.wait(WAIT_TIMEOUT)
+        raise ValueError('failed')
+
+    def run():
+        try:
+            flights.run(STACK_NAME, fail)
+        except ValueError as exc:
+            errors.append(exc)
+
+    threads = [start_in_thread(run)]
+    started.wait(WAIT_TIMEOUT)
+    done = count_waiting_callers(flights, STACK_NAME)
+    threads.append(start_in_thread(run))
+    wait_until(lambda: done.waiting == 1)
+    finish.set()
+    for thread in threads:
+        thread.join(WAIT_TIMEOUT)
+
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
@@ -0,0 +1,93 @@
+from unittest import mock
+
+import pytest
+
+from crczp.terraform_driver.terraform_client_elements import CrczpTerraformStackState
+from crczp.terraform_driver.terraform_stack_registry import TerraformStackRegistry, STACK_REGISTRY_FILE_NAME
+
+STACK_NAME = 'stack-1'
+
+
+class FakeClock:
+    """
+    Clock advanced by every call
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def registry(tmp_path) -> TerraformStackRegistry:
+    registry = TerraformStackRegistry(str(tmp_path / 'registry' / STACK_REGISTRY_FILE_NAME), clock=FakeClock())
+    yield registry
+    registry.close()
+
+
+def test_new_registry_should_be_reconciled(registry):
+    assert registry.initialize()
+    registry.close()
+
+    assert not registry.initialize()
+
+
+def test_state_of_stack_is_recorded(registry):
+    registry.set_state(STACK_NAME, CrczpTerraformStackState.INITIALIZING, template_hash='hash-1')
+    registry.set_state(STACK_NAME, CrczpTerraformStackState.FAILED, error='apply failed')
+
+    record = registry.get(STACK_NAME)
+
+    assert (record.state, record.template_hash, record.error) == \
+           (CrczpTerraformStackState.FAILED, 'hash-1', 'apply failed')
+    assert record.updated_at > record.created_at
+    assert registry.update_state(STACK_NAME, CrczpTerraformStackState.READY)
+    assert registry.get(STACK_NAME).error is None
+
+
+def test_update_of_unknown_stack_is_reported(registry):
+    assert not registry.update_state(STACK_NAME, CrczpTerraformStackState.READY)
+    assert registry.get(STACK_NAME) is None
+
+
+def test_stacks_are_listed_and_paginated(registry):
+    for index in range(5):
+        state = CrczpTerraformStackState.READY if index % 2 else CrczpTerraformStackState.FAILED
+        registry.set_state(f'stack-{index}', state)
+    registry.set_state('other-1', CrczpTerraformStackState.READY)
+
+    first_page = registry.list_stacks(name_prefix='stack-', limit=2)
+    second_page = registry.list_stacks(name_prefix='stack-', limit=2, after=first_page[-1].name)
+
+    assert [record.name for record in first_page + second_page] == [f'stack-{index}' for index in range(4)]
+    assert [record.name for record in registry.list_stacks([CrczpTerraformStackState.READY])] == \
+           ['other-1', 'stack-1', 'stack-3']
+    assert registry.count_stacks([CrczpTerraformStackState.READY], name_prefix='stack-') == 2
+    assert registry.count_stacks() == 6
+
+
+def test_unchanged_state_serial_is_not_written(registry):
+    registry.set_state(STACK_NAME, CrczpTerraformStackState.READY)
+    registry.set_state_serial(STACK_NAME, 3)
+
+    with mock.patch.object(registry, '_execute', wraps=registry._execute) as execute:
+        registry.set_state_serial(STACK_NAME, 3)
+        assert not execute.called
+        registry.set_state_serial(STACK_NAME, 4)
+        assert execute.called
+
+    assert registry.get(STACK_NAME).state_serial == 4
+
+
+def test_state_serial_is_written_again_after_removal(registry):
+    registry.set_state(STACK_NAME, CrczpTerraformStackState.READY)
+    registry.set_state_serial(STACK_NAME, 3)
+    registry.remove(STACK_NAME)
+    registry.set_state(STACK_NAME, CrczpTerraformStackState.READY)
+
+    registry.set_state_serial(STACK_NAME, 3)
+
+    assert registry.get(STACK_NAME).state_serial == 3
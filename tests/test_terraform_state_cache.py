@@ -0,0 +1,96 @@
+from crczp.terraform_driver.terraform_client_elements import TerraformState
+from crczp.terraform_driver.terraform_state_cache import TerraformStateCache
+
+STACK_NAME = 'stack-1'
+
+
+class FakeClock:
+    """
+    Clock advanced by the test
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def create_state(serial: int, lineage: str = 'lineage-1') -> TerraformState:
+    return TerraformState(serial, lineage, [])
+
+
+def test_cached_state_expires():
+    clock = FakeClock()
+    cache = TerraformStateCache(ttl=10, clock=clock)
+    state = create_state(1)
+    cache.put(STACK_NAME, state)
+
+    assert cache.get(STACK_NAME) is state
+    clock.now = 10
+    assert cache.get(STACK_NAME) is None
+
+    stats = cache.get_stats()
+    assert (stats.hits, stats.misses, stats.expirations) == (1, 1, 1)
+
+
+def test_least_recently_used_state_is_evicted():
+    cache = TerraformStateCache(max_size=2)
+    for stack_name in ['stack-1', 'stack-2']:
+        cache.put(stack_name, create_state(1))
+    cache.get('stack-1')
+
+    cache.put('stack-3', create_state(1))
+
+    assert cache.get('stack-2') is None
+    assert cache.get('stack-1') is not None
+    assert cache.get_stats().evictions == 1
+
+
+def test_state_pulled_before_invalidation_is_rejected():
+    cache = TerraformStateCache()
+    generation = cache.generation(STACK_NAME)
+    cache.invalidate(STACK_NAME)
+
+    assert not cache.put(STACK_NAME, create_state(1), generation)
+    assert cache.get(STACK_NAME) is None
+    assert cache.put(STACK_NAME, create_state(1), cache.generation(STACK_NAME))
+
+
+def test_state_pulled_before_clear_is_rejected():
+    cache = TerraformStateCache()
+    generation = cache.generation(STACK_NAME)
+    cache.put('stack-2', create_state(1))
+
+    cache.clear()
+
+    assert not cache.put(STACK_NAME, create_state(1), generation)
+    assert len(cache) == 0
+    assert cache.get_stats().invalidations == 1
+
+
+def test_invalidation_of_other_stack_does_not_reject_state():
+    cache = TerraformStateCache()
+    generation = cache.generation(STACK_NAME)
+    cache.invalidate('stack-2')
+
+    assert cache.put(STACK_NAME, create_state(1), generation)
+
+
+def test_older_serial_of_same_lineage_is_rejected():
+    cache = TerraformStateCache()
+    cache.put(STACK_NAME, create_state(5))
+
+    assert not cache.put(STACK_NAME, create_state(4))
+    assert cache.get(STACK_NAME).serial == 5
+    assert cache.get_stats().rejected == 1
+    # A state of a new lineage replaces the cached one, e.g. after the stack was recreated
+    assert cache.put(STACK_NAME, create_state(1, 'lineage-2'))
+    assert cache.put(STACK_NAME, create_state(1, 'lineage-2'))
+
+
+def test_disabled_cache_stores_nothing():
+    cache = TerraformStateCache(ttl=0)
+
+    assert not cache.put(STACK_NAME, create_state(1))
+    assert cache.get(STACK_NAME) is None
@@ -0,0 +1,68 @@
+import io
+import json
+
+import pytest
+
+from crczp.terraform_driver.terraform_state_parser import parse_terraform_state
+
+INSTANCE = {
+    'mode': 'managed', 'type': 'openstack_compute_instance_v2', 'name': 'host',
+    'instances': [{'attributes': {'id': 'id-1', 'name': 'hôst "quoted" \\ ✓', 'flavor_name': 'small',
+                                  'metadata': {'key': '}]'}}}],
+}
+IMAGE = {'mode': 'data', 'type': 'openstack_images_image_v2', 'name': 'image', 'instances': []}
+STATE = {
+    'version': 4, 'terraform_version': '1.6.0', 'serial': 1234567, 'lineage': 'lineage-1',
+    'outputs': {'value': {'value': [1.5e3, None, True]}}, 'resources': [IMAGE, INSTANCE],
+    'check_results': None,
+}
+
+
+def parse(document: str, **kwargs):
+    return parse_terraform_state(io.StringIO(document), **kwargs)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64 * 1024])
+def test_state_is_parsed_across_chunk_boundaries(chunk_size):
+    state = parse(json.dumps(STATE, ensure_ascii=False, indent=2), chunk_size=chunk_size)
+
+    assert (state.serial, state.lineage) == (1234567, 'lineage-1')
+    assert state.resources == [INSTANCE]
+
+
+def test_escaped_characters_are_decoded():
+    state = parse(json.dumps(STATE), chunk_size=1)
+
+    assert state.resources[0]['instances'][0]['attributes']['name'] == 'hôst "quoted" \\ ✓'
+
+
+def test_number_at_end_of_chunk_is_not_truncated():
+    document = '{"lineage": "lineage-1", "serial": 1234567}'
+
+    assert parse(document, chunk_size=document.index('4')).serial == 1234567
+
+
+def test_attributes_are_projected():
+    state = parse(json.dumps(STATE), attributes=['id', 'flavor_name'])
+
+    assert state.resources[0]['instances'][0]['attributes'] == {'id': 'id-1', 'flavor_name': 'small'}
+
+
+@pytest.mark.parametrize('document', ['', '  \n', '{}', '{"resources": []}'])
+def test_empty_state_is_parsed(document):
+    state = parse(document)
+
+    assert (state.serial, state.lineage, state.resources) == (0, '', [])
+
+
+@pytest.mark.parametrize('document', [
+    '{"resources": [',
+    '{"resources": [1]}',
+    '{"serial": 1 "lineage": "lineage-1"}',
+    '{"resources": [{"mode": "managed"}}',
+    '[]',
+    '{"serial": 1',
+])
+def test_invalid_state_is_rejected(document):
+    with pytest.raises(ValueError):
+        parse(document, chunk_size=2)
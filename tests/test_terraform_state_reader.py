@@ -0,0 +1,131 @@
+import json
+import sqlite3
+from unittest import mock
+
+import pytest
+
+from crczp.terraform_driver.terraform_backend import CrczpTerraformBackend
+from crczp.terraform_driver.terraform_client_elements import CrczpTerraformBackendType
+from crczp.terraform_driver.terraform_state_reader import PostgresTerraformStateReader, create_state_reader
+
+STATES_TABLE = 'states'
+
+
+def create_state(serial: int, *names: str) -> str:
+    resources = [{'mode': 'managed', 'type': 'openstack_compute_instance_v2', 'name': name,
+                  'instances': [{'attributes': {'id': f'{name}-id', 'name': name, 'flavor_name': 'small'}}]}
+                 for name in names]
+    resources.append({'mode': 'data', 'type': 'openstack_images_image_v2', 'name': 'image', 'instances': []})
+    return json.dumps({'version': 4, 'serial': serial, 'lineage': 'lineage', 'resources': resources})
+
+
+class CountingConnect:
+    """
+    Connection factory of an in-memory SQLite database counting opened connections
+    """
+
+    def __init__(self, states: dict):
+        self.count = 0
+        self.states = states
+
+    def __call__(self) -> sqlite3.Connection:
+        self.count += 1
+        connection = sqlite3.connect(':memory:')
+        connection.execute(f'CREATE TABLE {STATES_TABLE} (name TEXT PRIMARY KEY, data TEXT)')
+        connection.executemany(f'INSERT INTO {STATES_TABLE} VALUES (?, ?)', self.states.items())
+        connection.commit()
+        return connection
+
+
+@pytest.fixture
+def connect() -> CountingConnect:
+    return CountingConnect({
+        'stack-1': create_state(3, 'host-1', 'host-2'),
+        'stack-2': create_state(7, 'router'),
+        'stack-empty': '',
+    })
+
+
+@pytest.fixture
+def reader(connect: CountingConnect) -> PostgresTerraformStateReader:
+    return PostgresTerraformStateReader(connect, table=STATES_TABLE, placeholder='?')
+
+
+def test_read_states_of_multiple_workspaces(reader):
+    states = reader.read_states(['stack-1', 'stack-2'])
+
+    assert sorted(states) == ['stack-1', 'stack-2']
+    assert states['stack-1'].serial == 3
+    assert [resource['name'] for resource in states['stack-1'].resources] == ['host-1', 'host-2']
+    assert [resource['name'] for resource in states['stack-2'].resources] == ['router']
+
+
+def test_read_states_omits_missing_and_empty_states(reader):
+    assert reader.read_states(['stack-1', 'stack-missing', 'stack-empty']).keys() == {'stack-1'}
+    assert reader.read_states([]) == {}
+
+
+def test_read_state(reader):
+    assert reader.read_state('stack-2').lineage == 'lineage'
+    assert reader.read_state('stack-missing') is None
+
+
+def test_read_states_keeps_selected_attributes(connect):
+    reader = PostgresTerraformStateReader(connect, table=STATES_TABLE, placeholder='?', attributes=['id'])
+
+    state = reader.read_state('stack-1')
+
+    assert [instance['attributes'] for resource in state.resources for instance in resource['instances']] \
+        == [{'id': 'host-1-id'}, {'id': 'host-2-id'}]
+
+
+def test_connection_is_shared_by_reads(reader, connect):
+    reader.read_state('stack-1')
+    reader.read_states(['stack-1', 'stack-2'])
+
+    assert connect.count == 1
+
+
+def test_connection_is_reopened_after_failure(connect):
+    reader = PostgresTerraformStateReader(connect, table='missing_table', placeholder='?')
+    with pytest.raises(sqlite3.OperationalError):
+        reader.read_state('stack-1')
+
+    reader.table = STATES_TABLE
+
+    assert reader.read_state('stack-1').serial == 3
+    assert connect.count == 2
+
+
+def test_close_reopens_connection_on_next_read(reader, connect):
+    reader.read_state('stack-1')
+    reader.close()
+    reader.read_state('stack-1')
+
+    assert connect.count == 2
+
+
+def test_drop_stack_schema():
+    connection = mock.Mock()
+    reader = PostgresTerraformStateReader(lambda: connection, stack_schema=lambda name: f'terraform_stack_{name}')
+
+    reader.drop_stack_schema('stack-1')
+
+    connection.cursor.return_value.execute.assert_called_once_with(
+        'DROP SCHEMA IF EXISTS "terraform_stack_stack-1" CASCADE')
+    connection.commit.assert_called_once_with()
+
+
+def test_drop_stack_schema_requires_stack_schemas(reader):
+    with pytest.raises(ValueError):
+        reader.drop_stack_schema('stack-1')
+
+
+def test_missing_driver_is_reported():
+    backend = CrczpTerraformBackend(CrczpTerraformBackendType.POSTGRES,
+                                    {'user': 'user', 'password': 'password', 'host': 'host', 'port': 5432, 'name': 'db'})
+    with mock.patch('crczp.terraform_driver.terraform_state_reader.psycopg2', None), \
+            mock.patch('crczp.terraform_driver.terraform_state_reader.LOG') as log:
+        assert create_state_reader(backend) is None
+
+    log.warning.assert_called_once()
@@ -0,0 +1,78 @@
+import pytest
+
+from crczp.terraform_driver.terraform_template_cache import TemplateRenderCache
+
+FINGERPRINT = 'fingerprint-1'
+
+
+class Renderer:
+    """
+    Template renderer recording the resource prefixes it was called with
+    """
+
+    def __init__(self, keeps_placeholder: bool = True):
+        self.keeps_placeholder = keeps_placeholder
+        self.prefixes = []
+
+    def __call__(self, resource_prefix):
+        self.prefixes.append(resource_prefix)
+        prefix = resource_prefix if self.keeps_placeholder else str(resource_prefix).upper()
+        return f'resource "openstack_compute_instance_v2" "host" {{\n    name = "{prefix}-host"\n}}\n'
+
+
+def test_placeholder_is_substituted_for_every_prefix():
+    cache = TemplateRenderCache()
+    render = Renderer()
+
+    templates = cache.get_templates(FINGERPRINT, ['stack-1', 'stack-2'], render)
+    template = cache.get_template(FINGERPRINT, 'stack-3', render)
+
+    assert len(render.prefixes) == 1
+    assert 'name = "stack-2-host"' in templates['stack-2']
+    assert 'name = "stack-3-host"' in template
+    stats = cache.get_stats()
+    assert (stats.hits, stats.misses) == (1, 1)
+
+
+def test_template_is_rendered_for_every_prefix_without_placeholder():
+    cache = TemplateRenderCache()
+    render = Renderer(keeps_placeholder=False)
+
+    templates = cache.get_templates(FINGERPRINT, ['stack-1', 'stack-2'], render)
+    cache.get_template(FINGERPRINT, 'stack-1', render)
+
+    assert render.prefixes[1:] == ['stack-1', 'stack-2']
+    assert 'name = "STACK-2-host"' in templates['stack-2']
+
+
+def test_default_prefix_is_rendered_separately():
+    cache = TemplateRenderCache()
+    render = Renderer()
+    cache.get_template(FINGERPRINT, 'stack-1', render)
+
+    cache.get_template(FINGERPRINT, None, render)
+    cache.get_template(FINGERPRINT, None, render)
+
+    assert render.prefixes[1:] == [None]
+
+
+def test_failed_rendering_is_not_cached():
+    cache = TemplateRenderCache()
+
+    def fail(resource_prefix):
+        raise ValueError('invalid template')
+
+    with pytest.raises(ValueError):
+        cache.get_template(FINGERPRINT, 'stack-1', fail)
+    assert len(cache) == 0
+
+
+def test_disabled_cache_renders_every_template():
+    cache = TemplateRenderCache(max_size=0)
+    render = Renderer()
+
+    cache.get_templates(FINGERPRINT, ['stack-1', 'stack-2'], render)
+    cache.get_template(FINGERPRINT, 'stack-1', render)
+
+    assert len(render.prefixes) == 2
+    assert len(cache) == 0
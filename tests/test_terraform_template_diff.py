@@ -0,0 +1,229 @@
+import pytest
+
+from crczp.terraform_driver.terraform_template_diff import diff_templates, get_init_dependencies, \
+    parse_template_blocks
+
+NETWORK = '''
+resource "openstack_networking_network_v2" "stack-net" {
+    name = "stack-net"
+}
+'''
+SUBNET = '''
+resource "openstack_networking_subnet_v2" "stack-subnet" {
+    name = "stack-subnet"
+    network_id = openstack_networking_network_v2.stack-net.id
+    cidr = "{cidr}"
+}
+'''
+PORT = '''
+resource "openstack_networking_port_v2" "stack-port" {
+    network_id = data.openstack_networking_network_v2.base-net.id
+    fixed_ip {
+        subnet_id = openstack_networking_subnet_v2.stack-subnet.id
+    }
+}
+'''
+INSTANCE = '''
+resource "openstack_compute_instance_v2" "stack-host" {
+    name = "stack-host"
+    flavor_name = "{flavor}"
+    network {
+        port = openstack_networking_port_v2.stack-port.id
+    }
+}
+'''
+BASE_NETWORK = '''
+data "openstack_networking_network_v2" "base-net" {
+    name = "base-net"
+}
+'''
+
+
+def create_template(cidr: str = '10.10.0.0/24', flavor: str = 'standard.small', *extra: str) -> str:
+    return ''.join([BASE_NETWORK, NETWORK, SUBNET.replace('{cidr}', cidr), PORT,
+                    INSTANCE.replace('{flavor}', flavor), *extra])
+
+
+def test_parse_blocks_of_template():
+    blocks = parse_template_blocks(create_template())
+
+    assert [block.address for block in blocks] == [
+        'data.openstack_networking_network_v2.base-net',
+        'openstack_networking_network_v2.stack-net',
+        'openstack_networking_subnet_v2.stack-subnet',
+        'openstack_networking_port_v2.stack-port',
+        'openstack_compute_instance_v2.stack-host',
+    ]
+    assert 'fixed_ip {' in blocks[3].body
+
+
+def test_parse_ignores_braces_in_comments_strings_and_heredocs():
+    template = '''
+# resource "ignored" "comment" {
+// }
+/* resource "ignored" "block_comment" { */
+resource "openstack_compute_instance_v2" "host" {
+    name = "host-{not-a-block}"
+    escaped = "quote \\" and brace { inside"
+    user_data = <<-EOT
+        #!/bin/sh
+        echo "}" {
+        EOT
+    metadata = {
+        key = "${jsonencode({a = "}"})}"
+        other = "%{ if true }{%{ endif }"
+    }
+}
+
+locals {
+    value = "${ {"}" = 1}["}"] }"
+}
+'''
+    blocks = parse_template_blocks(template)
+
+    assert [block.address for block in blocks] == ['openstack_compute_instance_v2.host', 'locals']
+    assert 'echo "}" {' in blocks[0].body
+    assert blocks[0].body.rstrip().endswith('}')
+    assert blocks[1].body.strip() == 'value = "${ {"}" = 1}["}"] }"'
+
+
+@pytest.mark.parametrize('template', [
+    'resource "openstack_networking_network_v2" "net" {\n    name = "net"\n',
+    'resource "openstack_networking_network_v2" "net" {\n    name = "net\n}\n',
+    'resource "openstack_compute_instance_v2" "host" {\n    user_data = <<EOT\n    echo\n}\n',
+    'resource "openstack_networking_network_v2" "net" {\n}\n/* unterminated',
+    'resource "openstack_networking_network_v2" "net" {\n}\ntrailing',
+    '= "invalid" {\n}\n',
+])
+def test_parse_invalid_template(template):
+    with pytest.raises(ValueError):
+        parse_template_blocks(template)
+
+
+def test_unchanged_template_ignores_formatting_and_comments():
+    old_template = create_template()
+    new_template = old_template.replace('    name = "stack-net"', '  name = "stack-net"  ')
+
+    diff = diff_templates(old_template, new_template)
+
+    assert diff.is_empty
+    assert not diff.requires_full_apply
+
+
+def test_added_resources_are_targeted_without_refresh():
+    new_network = NETWORK.replace('stack-net', 'stack-net-2')
+
+    diff = diff_templates(create_template(), create_template('10.10.0.0/24', 'standard.small', new_network))
+
+    assert diff.added == ['openstack_networking_network_v2.stack-net-2']
+    assert diff.targets == diff.added
+    assert diff.only_additions
+    assert not diff.requires_full_apply
+
+
+def test_changed_resource_targets_transitive_dependents():
+    diff = diff_templates(create_template(), create_template(cidr='10.20.0.0/24'))
+
+    assert diff.changed == ['openstack_networking_subnet_v2.stack-subnet']
+    assert diff.targets == ['openstack_networking_subnet_v2.stack-subnet',
+                            'openstack_compute_instance_v2.stack-host',
+                            'openstack_networking_port_v2.stack-port']
+    assert not diff.only_additions
+    assert not diff.requires_full_apply
+
+
+def test_changed_leaf_resource_is_targeted_alone():
+    diff = diff_templates(create_template(), create_template(flavor='standard.large'))
+
+    assert diff.targets == ['openstack_compute_instance_v2.stack-host']
+    assert not diff.requires_full_apply
+
+
+def test_removed_resource_is_targeted():
+    old_template = create_template('10.10.0.0/24', 'standard.small', NETWORK.replace('stack-net', 'stack-old'))
+
+    diff = diff_templates(old_template, create_template())
+
+    assert diff.removed == ['openstack_networking_network_v2.stack-old']
+    assert diff.targets == diff.removed
+
+
+def test_references_in_comments_and_strings_are_dependents():
+    commented = INSTANCE.replace('{flavor}', 'small').replace('stack-host', 'stack-other') \
+        .replace('port = openstack_networking_port_v2.stack-port.id', '# openstack_networking_subnet_v2.stack-subnet')
+
+    diff = diff_templates(create_template('10.10.0.0/24', 'small', commented),
+                          create_template('10.20.0.0/24', 'small', commented))
+
+    # Matches in comments make the targets wider, never narrower
+    assert 'openstack_compute_instance_v2.stack-other' in diff.targets
+    assert not diff.requires_full_apply
+
+
+def test_changed_untargetable_block_requires_full_apply():
+    old_template = create_template('10.10.0.0/24', 'small', 'variable "size" {\n    default = 1\n}\n')
+    new_template = create_template('10.10.0.0/24', 'small', 'variable "size" {\n    default = 2\n}\n')
+
+    assert diff_templates(old_template, new_template).requires_full_apply
+
+
+def test_dependents_through_locals_require_full_apply():
+    locals_block = 'locals {\n    subnet_id = openstack_networking_subnet_v2.stack-subnet.id\n}\n'
+    consumer = '''
+resource "openstack_networking_port_v2" "stack-local-port" {
+    fixed_ip {
+        subnet_id = local.subnet_id
+    }
+}
+'''
+    diff = diff_templates(create_template('10.10.0.0/24', 'small', locals_block, consumer),
+                          create_template('10.20.0.0/24', 'small', locals_block, consumer))
+
+    assert 'openstack_networking_port_v2.stack-local-port' in diff.targets
+    assert diff.requires_full_apply
+
+
+def test_unresolved_reference_requires_full_apply():
+    dynamic = '''
+resource "openstack_networking_port_v2" "stack-dynamic-port" {
+    network_id = openstack_networking_network_v2.defined-elsewhere.id
+}
+'''
+    diff = diff_templates(create_template('10.10.0.0/24', 'small', dynamic),
+                          create_template('10.20.0.0/24', 'small', dynamic))
+
+    assert diff.requires_full_apply
+
+
+def test_references_in_plain_strings_are_not_unresolved():
+    image = BASE_NETWORK.replace('"base-net"\n', '"base-net"\n    description = "debian_12.image"\n')
+    old_template = create_template().replace(BASE_NETWORK, image)
+
+    diff = diff_templates(old_template, old_template.replace('standard.small', 'standard.large'))
+
+    assert not diff.requires_full_apply
+
+
+def test_duplicate_addresses_require_full_apply():
+    old_template = create_template('10.10.0.0/24', 'small', 'locals {\n    a = 1\n}\n', 'locals {\n    b = 2\n}\n')
+    new_template = old_template.replace('b = 2', 'b = 3')
+
+    diff = diff_templates(old_template, new_template)
+
+    assert diff.changed == ['locals']
+    assert diff.requires_full_apply
+
+
+def test_duplicate_resource_addresses_require_full_apply():
+    old_template = create_template('10.10.0.0/24', 'small', NETWORK)
+
+    diff = diff_templates(old_template, old_template.replace('name = "stack-net"', 'name = "renamed"', 1))
+
+    assert diff.requires_full_apply
+
+
+def test_init_dependencies_ignore_resource_arguments():
+    old_dependencies = get_init_dependencies(create_template())
+
+    assert get_init_dependencies(create_template(cidr='10.20.0.0/24')) == old_dependencies
+    assert get_init_dependencies(create_template() + 'provider "aws" {\n    region = "eu"\n}\n') != old_dependencies